@@ -0,0 +1,380 @@
+"""
+Сквозной бенчмарк цикла positions_guard на записанных фикстурах (1, 10, 50 пар).
+
+    python benchmarks/bench_cycles.py record                 # фикстуры: симулятор → модели → кассеты
+    python benchmarks/bench_cycles.py run --out benchmarks/results/baseline.json
+    python benchmarks/bench_cycles.py run --out benchmarks/results/current.json
+    python benchmarks/bench_cycles.py compare benchmarks/results/current.json \
+        --baseline benchmarks/results/baseline.json
+
+record — для каждого сценария поднимает core.exchange_sim (speed=0, seed — детерминированно),
+обучает недостающие модели (benchmarks/fixtures/models) и пишет кассету
+benchmarks/fixtures/pairs_<N>.jsonl.gz за --cycles циклов (между циклами рынок сдвигается на бар).
+
+run — каждый сценарий в отдельном процессе, без сети (EXCHANGE_TRANSPORT=replay, задержки из
+кассеты × --latency-scale). Первый цикл — прогрев (рынки, часы, полная загрузка свечей), дальше
+измеряемые: wall и CPU цикла, время стадий (из трассы core.tracing), REST по эндпоинтам;
+последний цикл — под tracemalloc (пик памяти), поэтому в тайминги не входит.
+
+compare — проверка результата против benchmarks/budgets.json (абсолютные бюджеты, например
+REST на пару за цикл — сверх фиксированных запросов цикла fixed_per_cycle: баланс, тикеры,
+позиции) и, с --baseline, против прошлого прогона (допустимый рост в долях).
+Код возврата 1 — бюджет превышен.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+HERE = Path(__file__).resolve().parent
+FIXTURES = HERE / "fixtures"
+RESULTS = HERE / "results"
+BUDGETS = HERE / "budgets.json"
+
+SCENARIOS = (1, 10, 50)
+TIMEFRAME = "5m"
+SIM_INTERVAL = "5"
+START_MS = 1_735_689_600_000  # 2025-01-01 00:00 UTC: одинаковые свечи и метки времени при каждой записи
+_SYMBOLS = ["BTCUSDT", "ETHUSDT", "SOLUSDT", "BNBUSDT", "XRPUSDT", "DOGEUSDT", "TONUSDT"] + [
+    f"SIM{i:02d}USDT" for i in range(1, 60)
+]
+
+
+def _symbols(n: int):
+    return _SYMBOLS[:n]
+
+
+def _pairs(n: int) -> str:
+    return ",".join(f"{s[:-4]}/USDT" for s in _symbols(n))
+
+
+def _fixture(n: int) -> Path:
+    return FIXTURES / f"pairs_{n}.jsonl.gz"
+
+
+def _env(n: int, work: Path, **extra) -> dict:
+    """Окружение дочернего процесса: только то, что задаёт сценарий (.env разработчика не читается)."""
+    keep = ("PATH", "HOME", "LANG", "LC_ALL", "PYTHONPATH", "TMPDIR", "TRAIN_LIMIT")
+    env = {k: v for k, v in os.environ.items() if k in keep}
+    env.update(
+        PAIRS=_pairs(n),
+        TIMEFRAME=TIMEFRAME,
+        ATR_TIMEFRAME=TIMEFRAME,
+        CONF_THRESHOLD="0.5",
+        BYBIT_API_KEY="bench",
+        BYBIT_SECRET_KEY="bench",
+        MODEL_DIR=str(FIXTURES / "models"),
+        MAKER_ENTRY="false",  # ожидание maker-исполнения — таймер, а не работа цикла
+        ORDER_STREAM="off",
+        MAKER_BOOK_STREAM="off",
+        METRICS_PORT="0",
+        CLOCK_SYNC_INTERVAL_S="0",
+        CONFIG_RELOAD="0",
+        LOG_FILE="",
+        LOG_LEVEL=os.getenv("BENCH_LOG_LEVEL", "WARNING"),
+        TRACE_DIR=str(work / "traces"),
+        TRACE_KEEP="0",
+        PYTHONHASHSEED="0",
+    )
+    env.update({k: str(v) for k, v in extra.items()})
+    return env
+
+
+def _spawn(phase: str, n: int, cycles: int, env: dict, work: Path) -> dict:
+    out = work / f"{phase}.json"
+    cmd = [sys.executable, str(Path(__file__).resolve()), "_child", phase, str(n), str(cycles), str(out)]
+    rc = subprocess.run(cmd, env=env, cwd=work).returncode
+    if rc != 0 or not out.exists():
+        raise SystemExit(f"{phase} pairs={n}: child failed (rc={rc})")
+    return json.loads(out.read_text(encoding="utf-8"))
+
+
+# ---------------------------------------------------------------------
+# дочерний процесс: циклы guard'а в одном процессе, как в daemon-режиме
+# ---------------------------------------------------------------------
+class _ErrorCount(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__(logging.ERROR)
+        self.n = 0
+
+    def emit(self, record) -> None:
+        self.n += 1
+
+
+def _stages(trace_dir: Path) -> dict:
+    """Сумма длительностей span'ов стадий из трассы цикла (мс) и удаление прочитанных файлов."""
+    out: dict = {}
+    for f in sorted(trace_dir.glob("trace-*.json")):
+        for e in json.loads(f.read_text(encoding="utf-8")).get("traceEvents", []):
+            if e.get("cat") == "stage":
+                out[e["name"]] = out.get(e["name"], 0.0) + e["dur"] / 1000.0
+        f.unlink()
+    return out
+
+
+def _child(phase: str, n: int, cycles: int, out_path: str) -> None:
+    import tracemalloc
+
+    import requests
+
+    import positions_guard as pg
+    from core.bybit_exchange import rest_calls
+    from core.cassette import get_cassette, transport_mode
+    from core.env_loader import load_and_check_env
+    from core.logging_setup import setup_logging
+    from core.scheduler import last_bar_close
+
+    mode = transport_mode()
+    api = os.getenv("BYBIT_API_URL", "")
+    if mode != "replay" and not api.startswith(("http://127.0.0.1", "http://localhost")):
+        raise SystemExit("bench: only replay or a local simulator — refusing to trade against a real exchange")
+
+    Path(".env").touch()
+    cfg = load_and_check_env(env_file=".env")
+    setup_logging()  # как main() guard'а: после конфига, уровень — из LOG_LEVEL сценария
+    pairs = list(cfg.pairs)
+    if phase == "train":
+        t0 = time.perf_counter()
+        pg.ensure_models_exist(pairs, timeframe=TIMEFRAME, limit=int(os.getenv("TRAIN_LIMIT", "2000")),
+                               model_dir=os.environ["MODEL_DIR"])
+        Path(out_path).write_text(json.dumps({"train_s": round(time.perf_counter() - t0, 2)}), encoding="utf-8")
+        return
+
+    args = pg.build_parser(cfg).parse_args(["--once", "--live", "--no-lock"])
+    errors = _ErrorCount()
+    logging.getLogger().addHandler(errors)
+    trace_dir = Path(os.environ["TRACE_DIR"])
+    rows = []
+    for i in range(cycles):
+        if i and mode == "record":
+            requests.post(f"{api}/sim/advance", json={"bars": 1}, timeout=10).raise_for_status()
+        mem = i == cycles - 1 and cycles >= 3
+        if mem:
+            tracemalloc.start()
+        before = rest_calls()
+        e0 = errors.n
+        c0, t0 = time.process_time(), time.perf_counter()
+        pg.run_cycle(args, pairs, dry_run=False, bar_close_ts=last_bar_close(TIMEFRAME), cfg=cfg)
+        wall, cpu = time.perf_counter() - t0, time.process_time() - c0
+        row = {
+            "wall_ms": round(wall * 1000.0, 2),
+            "cpu_ms": round(cpu * 1000.0, 2),
+            "rest": {k: v - before.get(k, 0) for k, v in rest_calls().items() if v - before.get(k, 0)},
+            "stages_ms": _stages(trace_dir),
+            "errors": errors.n - e0,
+        }
+        if mem:
+            row["peak_alloc_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+            tracemalloc.stop()
+        rows.append(row)
+
+    cassette = get_cassette()
+    rss_mb = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+    result = {"pairs": n, "cycles": rows, "peak_rss_mb": rss_mb}
+    if cassette is not None:
+        cassette.close()
+        result["cassette"] = dict(cassette.stats)
+    Path(out_path).write_text(json.dumps(result), encoding="utf-8")
+
+
+# ---------------------------------------------------------------------
+# record / run / compare
+# ---------------------------------------------------------------------
+def cmd_record(a) -> None:
+    from core.exchange_sim import BybitSim, Faults, SimServer, build_series
+
+    FIXTURES.mkdir(parents=True, exist_ok=True)
+    for n in a.pairs:
+        series = build_series(_symbols(n), None, SIM_INTERVAL, a.warmup + a.cycles + 10, a.seed)
+        sim = BybitSim(series, speed=0, start_ms=START_MS, warmup=a.warmup)
+        faults = Faults(latency_ms=a.latency_ms, jitter_ms=a.jitter_ms, seed=a.seed)
+        server = SimServer(sim, faults).start()
+        try:
+            with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+                work = Path(tmp)
+                live = _env(n, work, EXCHANGE_TRANSPORT="live", BYBIT_API_URL=server.url)
+                trained = _spawn("train", n, 0, live, work)
+                res = _spawn("cycles", n, a.cycles, _env(
+                    n, work, EXCHANGE_TRANSPORT="record", CASSETTE=_fixture(n), BYBIT_API_URL=server.url), work)
+        finally:
+            server.stop()
+        size_kb = _fixture(n).stat().st_size / 1024.0
+        fills = sum(acc["fills"] for acc in sim.state()["accounts"].values())
+        print(f"pairs={n:>3}  {_fixture(n).relative_to(ROOT)}  {size_kb:,.0f} KB  "
+              f"recorded={res.get('cassette', {}).get('recorded')}  fills={fills}  train_s={trained['train_s']}")
+
+
+def _median(xs):
+    return round(statistics.median(xs), 2) if xs else 0.0
+
+
+def _summarize(res: dict) -> dict:
+    """Прогрев отдельно, измеряемые циклы — медианы; REST — в среднем за цикл."""
+    n = res["pairs"]
+    warm, timed = res["cycles"][0], res["cycles"][1:]
+    clock = [c for c in timed if "peak_alloc_mb" not in c] or timed
+    k = len(timed) or 1
+    rest: dict = {}
+    for c in timed:
+        for ep, v in c["rest"].items():
+            rest[ep] = rest.get(ep, 0) + v
+    rest = {ep: round(v / k, 2) for ep, v in sorted(rest.items())}
+    per_cycle = round(sum(rest.values()), 2)
+    stages = sorted({s for c in clock for s in c["stages_ms"]})
+    return {
+        "pairs": n,
+        "measured_cycles": len(timed),
+        "wall_ms": _median([c["wall_ms"] for c in clock]),
+        "wall_ms_max": max((c["wall_ms"] for c in clock), default=0.0),
+        "cpu_ms": _median([c["cpu_ms"] for c in clock]),
+        "stages_ms": {s: _median([c["stages_ms"].get(s, 0.0) for c in clock]) for s in stages},
+        "rest_per_endpoint": rest,
+        "rest_per_cycle": per_cycle,
+        "rest_per_pair_per_cycle": round(per_cycle / n, 2),
+        "peak_alloc_mb": max((c.get("peak_alloc_mb", 0.0) for c in timed), default=0.0),
+        "peak_rss_mb": res.get("peak_rss_mb"),
+        "errors": sum(c["errors"] for c in res["cycles"]),
+        "cassette_misses": (res.get("cassette") or {}).get("misses", 0),
+        "warmup": {"wall_ms": warm["wall_ms"], "cpu_ms": warm["cpu_ms"], "rest": sum(warm["rest"].values())},
+    }
+
+
+def _git_rev() -> str:
+    try:
+        cmd = ["git", "rev-parse", "--short", "HEAD"]
+        return subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def cmd_run(a) -> None:
+    import ccxt
+
+    out = {
+        "meta": {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "ccxt": ccxt.__version__,
+            "host": platform.node(),
+            "latency_scale": a.latency_scale,
+        },
+        "scenarios": {},
+    }
+    for n in a.pairs:
+        if not _fixture(n).exists():
+            raise SystemExit(f"{_fixture(n)} not found — run: python benchmarks/bench_cycles.py record")
+        with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+            work = Path(tmp)
+            env = _env(
+                n, work, EXCHANGE_TRANSPORT="replay", CASSETTE=_fixture(n), REPLAY_LATENCY_SCALE=a.latency_scale
+            )
+            s = _summarize(_spawn("cycles", n, a.cycles, env, work))
+        out["scenarios"][f"pairs_{n}"] = s
+        top = sorted(s["stages_ms"].items(), key=lambda kv: kv[1], reverse=True)[:4]
+        print(f"pairs={n:>3}  wall={s['wall_ms']:>8.1f}ms  cpu={s['cpu_ms']:>8.1f}ms  "
+              f"rest/cycle={s['rest_per_cycle']:>6.1f} ({s['rest_per_pair_per_cycle']:.2f}/pair)  "
+              f"peak={s['peak_alloc_mb']:.1f}MB  stages: " + " ".join(f"{k}={v:.0f}" for k, v in top))
+    path = Path(a.out) if a.out else RESULTS / f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(out, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"→ {path}")
+
+
+def _checks(name: str, cur: dict, base, budgets: dict):
+    """
+    (метрика, значение, предел, ok) для одного сценария. REST на пару считается без фиксированных
+    запросов цикла (fixed_per_cycle — не больше указанного на эндпоинт): иначе на 1 паре они
+    съедают весь бюджет, а на 50 — маскируют лишние запросы по парам.
+    """
+    b = dict(budgets.get("default", {}), **budgets.get("scenarios", {}).get(name, {}))
+    n = cur["pairs"]
+    rest = cur["rest_per_endpoint"]
+    fixed = sum(min(rest.get(ep, 0.0), limit) for ep, limit in (b.get("fixed_per_cycle") or {}).items())
+    per_pair = round((cur["rest_per_cycle"] - fixed) / n, 2)
+    absolute = [
+        ("rest_per_pair_per_cycle", per_pair, b.get("rest_per_pair_per_cycle")),
+        ("wall_ms_per_pair", round(cur["wall_ms"] / n, 2), b.get("wall_ms_per_pair")),
+        ("cpu_ms_per_pair", round(cur["cpu_ms"] / n, 2), b.get("cpu_ms_per_pair")),
+        ("peak_alloc_mb", cur["peak_alloc_mb"], b.get("peak_alloc_mb")),
+        ("errors", cur["errors"], b.get("errors")),
+        ("cassette_misses", cur["cassette_misses"], b.get("cassette_misses")),
+    ]
+    for ep, limit in (b.get("endpoint_per_cycle") or {}).items():
+        absolute.append((f"rest[{ep}]", rest.get(ep, 0.0), limit))
+    for metric, value, limit in absolute:
+        if limit is not None:
+            yield metric, value, limit, value <= limit
+    if base is None:
+        return
+    for metric, tol in (budgets.get("regression") or {}).items():
+        if metric not in cur or metric not in base:
+            continue
+        limit = round(base[metric] * (1.0 + tol), 2)
+        yield f"{metric} vs baseline", cur[metric], limit, cur[metric] <= limit
+
+
+def cmd_compare(a) -> None:
+    cur = json.loads(Path(a.current).read_text(encoding="utf-8"))
+    base = json.loads(Path(a.baseline).read_text(encoding="utf-8")) if a.baseline else None
+    budgets = json.loads(Path(a.budgets).read_text(encoding="utf-8"))
+    failed = 0
+    for name, s in cur["scenarios"].items():
+        b = (base or {}).get("scenarios", {}).get(name) if base else None
+        for metric, value, limit, ok in _checks(name, s, b, budgets):
+            failed += not ok
+            if not ok or a.verbose:
+                print(f"{'OK  ' if ok else 'FAIL'} {name:<9} {metric:<32} {value:>10} <= {limit}")
+    print(f"{len(cur['scenarios'])} scenarios, {failed} budget violations")
+    sys.exit(1 if failed else 0)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "_child":
+        _, _, phase, n, cycles, out = sys.argv
+        return _child(phase, int(n), int(cycles), out)
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    pairs = dict(type=lambda s: [int(x) for x in s.split(",")], default=list(SCENARIOS), help="сценарии: 1,10,50")
+
+    r = sub.add_parser("record", help="записать фикстуры против локального симулятора")
+    r.add_argument("--pairs", **pairs)
+    r.add_argument("--cycles", type=int, default=5, help="циклов в кассете (прогрев + измеряемые + память)")
+    r.add_argument("--warmup", type=int, default=3000, help="баров истории в симуляторе")
+    r.add_argument("--seed", type=int, default=0)
+    r.add_argument("--latency-ms", type=float, default=30.0)
+    r.add_argument("--jitter-ms", type=float, default=15.0)
+    r.set_defaults(fn=cmd_record)
+
+    u = sub.add_parser("run", help="прогнать циклы на фикстурах и сохранить JSON")
+    u.add_argument("--pairs", **pairs)
+    u.add_argument("--cycles", type=int, default=5)
+    u.add_argument("--latency-scale", type=float, default=1.0, help="множитель записанных задержек (0 — без сети)")
+    u.add_argument("--out")
+    u.set_defaults(fn=cmd_run)
+
+    c = sub.add_parser("compare", help="проверить результат против бюджетов (и базового прогона)")
+    c.add_argument("current")
+    c.add_argument("--baseline")
+    c.add_argument("--budgets", default=str(BUDGETS))
+    c.add_argument("-v", "--verbose", action="store_true")
+    c.set_defaults(fn=cmd_compare)
+
+    a = ap.parse_args()
+    a.fn(a)
+
+
+if __name__ == "__main__":
+    main()
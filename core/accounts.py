@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import contextvars
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Текущий аккаунт исполнения (ACCOUNTS): None — основной (BYBIT_API_KEY / BYBIT_SECRET_KEY)
+ACCOUNT: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("account", default=None)
+
+
+def current_account() -> Optional[str]:
+    return ACCOUNT.get()
+
+
+def account_label(name: Optional[str]) -> str:
+    return name or "main"
+
+
+@contextmanager
+def use_account(name: Optional[str]):
+    """with use_account("sub1"): ... — клиент биржи, состояние и журнал сделок этого аккаунта."""
+    token = ACCOUNT.set(name)
+    try:
+        yield name
+    finally:
+        ACCOUNT.reset(token)
+
+
+def account_path(path: str, account: Optional[str] = None) -> str:
+    """Раздел файла аккаунта: logs/trades.csv → logs/trades.sub1.csv (основной — без изменений)."""
+    if not account or path == ":memory:":
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{account}{ext}"
+
+
+def account_env(key: str, account: Optional[str] = None) -> str:
+    """Имя переменной аккаунта: BYBIT_API_KEY → BYBIT_API_KEY__SUB1."""
+    return f"{key}__{account.upper()}" if account else key
+
+
+class PerAccount(Generic[T]):
+    """
+    Ленивый экземпляр на аккаунт вместо синглтона процесса: get() отдаёт объект текущего
+    аккаунта (contextvar), создавая его factory(account) при первом обращении.
+    """
+
+    def __init__(self, factory: Callable[[Optional[str]], T]) -> None:
+        self._factory = factory
+        self._items: Dict[Optional[str], T] = {}
+        self._lock = threading.Lock()
+
+    def get(self) -> T:
+        key = ACCOUNT.get()
+        with self._lock:
+            obj = self._items.get(key)
+            if obj is None:
+                obj = self._items[key] = self._factory(key)
+            return obj
+
+    def peek(self) -> Optional[T]:
+        """Объект текущего аккаунта, если он уже создан (без создания)."""
+        return self._items.get(ACCOUNT.get())
+
+    def set(self, obj: Optional[T]) -> None:
+        with self._lock:
+            if obj is None:
+                self._items.pop(ACCOUNT.get(), None)
+            else:
+                self._items[ACCOUNT.get()] = obj
+
+    def items(self) -> List[Tuple[Optional[str], T]]:
+        with self._lock:
+            return list(self._items.items())
+
+    def pop_all(self) -> List[T]:
+        with self._lock:
+            out = list(self._items.values())
+            self._items.clear()
+            return out
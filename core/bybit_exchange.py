@@ -1,47 +1,160 @@
+import logging
 import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
 
 import ccxt
 
+from .accounts import PerAccount, account_env, account_label, current_account
+from .cassette import install as install_transport
+from .clock_sync import get_clock
+from .metrics import REST_ERRORS, REST_REQUESTS, REST_SECONDS, THROTTLE_SECONDS, stage_timer
+from .resilience import call_with_retry
+from .tracing import rest_span
 
-def create_exchange() -> ccxt.bybit:
+log = logging.getLogger(__name__)
+
+# Счётчик REST-запросов по эндпоинтам (v5/market/tickers, v5/order/create, ...)
+_REST_CALLS: Counter = Counter()
+_REST_LOCK = threading.Lock()
+
+# Общий «тёплый» клиент для долгоживущего процесса (daemon-режим guard'а) — свой на аккаунт
+_SHARED: PerAccount[Optional[ccxt.bybit]] = PerAccount(lambda acc: None)
+_SHARED_LOCK = threading.Lock()
+
+
+class InstrumentedBybit(ccxt.bybit):
+    """
+    ccxt.bybit с единой точкой входа для всех REST-вызовов (fetch2):
+    здесь считаем запросы по эндпоинтам (каждую попытку) и оборачиваем вызов в
+    повтор/предохранитель (core.resilience.call_with_retry). Латентность, ошибки и ожидание
+    в клиентском rate limiter'е уходят в core.metrics, каждая попытка — span в трассе цикла.
+    На 10002 (InvalidNonce: timestamp вне recv_window) — внеочередная синхронизация часов
+    (core.clock_sync) и один повтор: такой запрос биржа отклонила до исполнения, повтор безопасен.
+    """
+
+    def throttle(self, cost=None):
+        t0 = time.perf_counter()
+        super().throttle(cost)
+        THROTTLE_SECONDS.observe(time.perf_counter() - t0)
+
+    def fetch2(self, path, api="public", method="GET", params={}, headers=None, body=None, config={}):
+        endpoint = str(path)
+
+        def _call():
+            with _REST_LOCK:
+                _REST_CALLS[endpoint] += 1
+            REST_REQUESTS.labels(endpoint).inc()
+            with rest_span(endpoint):
+                return super(InstrumentedBybit, self).fetch2(path, api, method, params, headers, body, config)
+
+        t0 = time.perf_counter()
+        try:
+            try:
+                return call_with_retry(endpoint, _call, method=method)
+            except ccxt.InvalidNonce:
+                if not get_clock().on_time_error():
+                    raise
+                return call_with_retry(endpoint, _call, method=method)
+        except Exception as e:
+            REST_ERRORS.labels(endpoint, type(e).__name__).inc()
+            raise
+        finally:
+            REST_SECONDS.labels(endpoint).observe(time.perf_counter() - t0)
+
+
+def rest_calls() -> Dict[str, int]:
+    """Снимок счётчика REST-вызовов {endpoint: count} с начала процесса."""
+    with _REST_LOCK:
+        return dict(_REST_CALLS)
+
+
+def rest_calls_total() -> int:
+    with _REST_LOCK:
+        return sum(_REST_CALLS.values())
+
+
+def create_exchange(markets_from: Optional[ccxt.bybit] = None) -> ccxt.bybit:
     """
     Создает подключение к Bybit с поддержкой PROXY_URL и unified аккаунта.
+    Смещение часов берётся из общего core.clock_sync (без своего запроса /v5/market/time).
+    Ключи — текущего аккаунта (core.accounts: BYBIT_API_KEY__<NAME>); markets_from — клиент,
+    чьи уже загруженные рынки переиспользуем вместо второго load_markets.
+    EXCHANGE_TRANSPORT=record|replay — HTTP идёт через кассету (core.cassette), а не в сеть.
+    BYBIT_API_URL — другой REST-адрес (testnet, локальный симулятор tools/bybit_sim.py).
     """
     proxy = os.getenv("PROXY_URL")
     recv_window = int(os.getenv("RECV_WINDOW", "20000"))
+    account = current_account()
 
-    exchange = ccxt.bybit(
+    exchange = InstrumentedBybit(
         {
-            "apiKey": os.getenv("BYBIT_API_KEY"),
-            "secret": os.getenv("BYBIT_SECRET_KEY"),
+            "apiKey": os.getenv(account_env("BYBIT_API_KEY", account)),
+            "secret": os.getenv(account_env("BYBIT_SECRET_KEY", account)),
             "enableRateLimit": True,
             "options": {
                 "defaultType": "swap",  # Для деривативов
-                "adjustForTimeDifference": True,
+                "adjustForTimeDifference": False,  # смещение раздаёт core.clock_sync
                 "recvWindow": recv_window,
+                # опрос исполнения (core.order_tracker) идёт через fetch_order (/v5/order/realtime);
+                # без подтверждения ccxt бросает ArgumentsRequired на каждый вызов
+                "fetchOrder": {"acknowledged": True},
             },
         }
     )
 
+    api_url = os.getenv("BYBIT_API_URL", "").rstrip("/")
+    if api_url:
+        exchange.urls["api"] = {k: api_url for k in exchange.urls["api"]}
+
     # Настройка прокси
     if proxy:
         exchange.proxies = {"http": proxy, "https": proxy}
+    install_transport(exchange)
+
+    get_clock().attach(exchange)
+
+    if markets_from is not None and markets_from.markets:
+        exchange.set_markets(markets_from.markets, markets_from.currencies)
+        return exchange
 
     try:
-        exchange.load_markets(reload=True)
+        with stage_timer("market_load"):
+            exchange.load_markets(reload=True)
     except ccxt.AuthenticationError:
-        print("⛔ Ошибка аутентификации: проверь BYBIT_API_KEY и BYBIT_SECRET_KEY.")
+        log.error("⛔ Ошибка аутентификации (%s): проверь %s и %s.", account_label(account),
+                  account_env("BYBIT_API_KEY", account), account_env("BYBIT_SECRET_KEY", account))
         raise
     except ccxt.NetworkError:
-        print("🌐 Сетевая ошибка: проверь PROXY_URL или интернет.")
+        log.error("🌐 Сетевая ошибка: проверь PROXY_URL или интернет.")
         raise
     except Exception as e:
-        print(f"⚠️ Неизвестная ошибка при загрузке рынков: {e}")
+        log.error("⚠️ Неизвестная ошибка при загрузке рынков: %s", e)
         raise
 
     return exchange
 
 
+def get_exchange(refresh: bool = False) -> ccxt.bybit:
+    """
+    Возвращает общий экземпляр биржи текущего аккаунта (создаётся один раз на процесс).
+    Повторно не грузит рынки и не переоткрывает HTTP-сессию; клиенты доп. аккаунтов берут
+    рынки у основного. У каждого клиента свой rate limiter ccxt — лимиты Bybit считаются по UID.
+    refresh=True — пересоздать клиент (например, после смены ключей).
+    """
+    with _SHARED_LOCK:
+        ex = _SHARED.get()
+        if ex is None or refresh:
+            main = None
+            if current_account() is not None:
+                main = next((e for acc, e in _SHARED.items() if acc is None and e is not None), None)
+            ex = create_exchange(markets_from=main)
+            _SHARED.set(ex)
+        return ex
+
+
 def get_balance(coin: str):
     """
     Получает баланс в Unified аккаунте.
@@ -51,7 +164,7 @@ def get_balance(coin: str):
         balance = exchange.fetch_balance(params={"accountType": "UNIFIED"})
         return balance[coin]["free"]
     except Exception as e:
-        print(f"Ошибка получения баланса для {coin}: {e}")
+        log.error("Ошибка получения баланса для %s: %s", coin, e)
         return None
 
 
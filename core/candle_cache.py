@@ -0,0 +1,73 @@
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from .metrics import stage_timer
+from .scheduler import timeframe_seconds
+
+# Bybit v5 /market/kline отдаёт до 1000 баров, ccxt по умолчанию просит 200
+_INCREMENTAL_MAX_BARS = 200
+
+# (symbol, timeframe) -> список свечей [ts, o, h, l, c, v], отсортирован по ts
+_CACHE: Dict[Tuple[str, str], List[List[float]]] = {}
+# (symbol, timeframe) -> time.time() последней загрузки
+_FETCHED_AT: Dict[Tuple[str, str], float] = {}
+_LOCK = threading.Lock()
+
+
+def _merge(old: List[List[float]], new: List[List[float]]) -> List[List[float]]:
+    """Склеивает свечи по timestamp: новые значения перетирают старые (формирующийся бар)."""
+    if not new:
+        return old
+    first_new = new[0][0]
+    head = [c for c in old if c[0] < first_new]
+    return head + [list(c) for c in new]
+
+
+def fetch_ohlcv_cached(
+    exchange, symbol: str, timeframe: str, limit: int, *, max_age_s: float = 0.0
+) -> List[List[float]]:
+    """
+    Возвращает последние limit свечей, держа их в памяти процесса.
+    Первый вызов — полная загрузка, дальше догружаем только хвост (since=последний бар),
+    поэтому в daemon-режиме каждый цикл тянет 1–2 бара вместо сотен.
+    max_age_s > 0 — если кэш обновлялся не раньше max_age_s назад, сеть не трогаем вовсе.
+    """
+    key = (symbol, timeframe)
+    step_ms = timeframe_seconds(timeframe) * 1000
+
+    with _LOCK:
+        cached = _CACHE.get(key)
+        fetched_at = _FETCHED_AT.get(key, 0.0)
+
+    if cached and len(cached) >= limit and max_age_s > 0 and time.time() - fetched_at <= max_age_s:
+        return cached[-limit:]
+
+    if cached and len(cached) >= limit:
+        last_ts = int(cached[-1][0])
+        missing = (int(time.time() * 1000) - last_ts) // step_ms + 1
+        if missing <= _INCREMENTAL_MAX_BARS:
+            with stage_timer("ohlcv_fetch"):
+                tail = exchange.fetch_ohlcv(symbol, timeframe=timeframe, since=last_ts, limit=int(missing) + 1)
+            merged = _merge(cached, tail)
+            keep = max(limit, len(cached))
+            merged = merged[-keep:]
+            with _LOCK:
+                _CACHE[key] = merged
+                _FETCHED_AT[key] = time.time()
+            return merged[-limit:]
+
+    with stage_timer("ohlcv_fetch"):
+        full = exchange.fetch_ohlcv(symbol, timeframe=timeframe, limit=limit)
+    with _LOCK:
+        prev = _CACHE.get(key) or []
+        # Не теряем более длинную историю, если её уже кто-то запросил
+        _CACHE[key] = _merge(prev, full) if len(prev) > len(full) else [list(c) for c in full]
+        _FETCHED_AT[key] = time.time()
+    return [list(c) for c in full]
+
+
+def clear_cache() -> None:
+    with _LOCK:
+        _CACHE.clear()
+        _FETCHED_AT.clear()
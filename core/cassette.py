@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import atexit
+import gzip
+import io
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .accounts import current_account
+from .logging_setup import log_event
+
+log = logging.getLogger(__name__)
+
+# Параметры, которые меняются от запуска к запуску и не участвуют в сопоставлении запросов
+_VOLATILE = ("timestamp", "sign", "signature", "recvWindow", "api_key", "apiKey", "nonce", "orderLinkId")
+# Из заголовков ответа храним только нужные ccxt (тип тела) и лимиты Bybit
+_KEEP_HEADERS = ("content-type", "retry-after")
+
+Key = Tuple[Optional[str], str, str, str]  # (аккаунт, метод, путь, канонические параметры)
+
+
+class CassetteMiss(RuntimeError):
+    """В кассете нет ответа на запрос (replay): сеть не трогаем, ошибку не повторяем."""
+
+
+def transport_mode() -> str:
+    """EXCHANGE_TRANSPORT: live (по умолчанию) | record | replay."""
+    mode = os.getenv("EXCHANGE_TRANSPORT", "live").strip().lower() or "live"
+    if mode not in ("live", "record", "replay"):
+        raise ValueError(f"EXCHANGE_TRANSPORT must be live|record|replay, got {mode!r}")
+    return mode
+
+
+def offline() -> bool:
+    """Replay: ни REST, ни WebSocket — потоки ccxt.pro заменяются опросом (через кассету)."""
+    return transport_mode() == "replay"
+
+
+def _ignored() -> frozenset:
+    extra = os.getenv("CASSETTE_IGNORE_PARAMS", "")
+    return frozenset(_VOLATILE) | {p.strip() for p in extra.split(",") if p.strip()}
+
+
+def request_key(method: str, url: str, body: Any, account: Optional[str] = None) -> Key:
+    """Ключ запроса без хоста, подписи и меток времени: GET — query, POST — JSON-тело."""
+    parts = urlsplit(url)
+    params: List[Tuple[str, str]] = parse_qsl(parts.query, keep_blank_values=True)
+    if body:
+        text = body.decode("utf-8", "replace") if isinstance(body, (bytes, bytearray)) else str(body)
+        try:
+            data = json.loads(text)
+            if isinstance(data, dict):
+                params += [(k, json.dumps(v, sort_keys=True) if isinstance(v, (dict, list)) else str(v))
+                           for k, v in data.items()]
+        except ValueError:
+            params += parse_qsl(text, keep_blank_values=True)
+    skip = _ignored()
+    canon = "&".join(f"{k}={v}" for k, v in sorted(params) if k not in skip)
+    return account, method.upper(), parts.path, canon
+
+
+class Cassette:
+    """
+    Запись обменов с биржей: одна строка JSON на запрос (JSON Lines, *.gz — сжатый).
+    Поля: a — аккаунт, m/p/q — метод, путь, канонические параметры, s/r/h/b — статус, reason,
+    заголовки и тело ответа, ms — латентность, x — сетевое исключение requests (Timeout, ...).
+
+    Replay отдаёт ответы на одинаковые запросы в порядке записи, последний повторяется
+    (daemon крутит циклы дольше записи). Если точного совпадения нет — следующий
+    неиспользованный ответ того же эндпоинта (параметры вроде since/limit зависят от «сейчас»);
+    strict=True отключает этот запасной путь.
+    """
+
+    def __init__(self, path: str, mode: str = "replay", strict: bool = False) -> None:
+        self.path = Path(path)
+        self.mode = mode
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._entries: List[Dict[str, Any]] = []
+        self._by_key: Dict[Key, List[int]] = {}
+        self._by_path: Dict[Tuple[Optional[str], str, str], List[int]] = {}
+        self._used: set = set()
+        self._out: Optional[io.TextIOBase] = None
+        self.stats = {"recorded": 0, "hits": 0, "fuzzy": 0, "repeats": 0, "misses": 0}
+        if mode == "replay":
+            self._load()
+        elif mode == "record":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._out = self._open("wt")
+
+    def _open(self, mode: str):
+        if self.path.suffix == ".gz":
+            return gzip.open(self.path, mode, encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            raise FileNotFoundError(f"cassette not found: {self.path}")
+        with self._open("rt") as f:
+            for line in f:
+                if line.strip():
+                    self._index(json.loads(line))
+
+    def _index(self, e: Dict[str, Any]) -> None:
+        i = len(self._entries)
+        self._entries.append(e)
+        self._by_key.setdefault((e.get("a"), e["m"], e["p"], e.get("q", "")), []).append(i)
+        self._by_path.setdefault((e.get("a"), e["m"], e["p"]), []).append(i)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # --- запись ---
+
+    def record(self, key: Key, entry: Dict[str, Any]) -> None:
+        account, method, path, canon = key
+        row = {"a": account, "m": method, "p": path, "q": canon, **entry}
+        line = json.dumps(row, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            if self._out is None:
+                return
+            self._out.write(line + "\n")
+            self._out.flush()  # gzip: Z_SYNC_FLUSH — запись до падения процесса не теряется
+            self.stats["recorded"] += 1
+
+    # --- воспроизведение ---
+
+    def _next(self, idx: Optional[List[int]]) -> Tuple[Optional[int], bool]:
+        if not idx:
+            return None, False
+        for i in idx:
+            if i not in self._used:
+                return i, False
+        return idx[-1], True
+
+    def take(self, key: Key) -> Dict[str, Any]:
+        with self._lock:
+            i, repeat = self._next(self._by_key.get(key))
+            fuzzy = False
+            if i is None and not self.strict:
+                i, repeat = self._next(self._by_path.get(key[:3]))
+                fuzzy = i is not None
+            if i is None:
+                self.stats["misses"] += 1
+                raise CassetteMiss(f"no recorded response for {key[1]} {key[2]}?{key[3]} in {self.path}")
+            self._used.add(i)
+            self.stats["fuzzy" if fuzzy else "hits"] += 1
+            if repeat:
+                self.stats["repeats"] += 1
+            return self._entries[i]
+
+    def close(self) -> None:
+        with self._lock:
+            out, self._out = self._out, None
+        if out is not None:
+            out.close()
+        log_event(log, "CASSETTE", mode=self.mode, path=str(self.path), entries=len(self._entries), **self.stats)
+
+
+class CassetteSession(requests.Session):
+    """
+    requests.Session под ccxt (exchange.session): record — настоящий запрос + запись ответа,
+    replay — ответ из кассеты с записанной задержкой (× REPLAY_LATENCY_SCALE), без сети.
+    Разбор ответа, handle_errors ccxt, повторы и метрики InstrumentedBybit работают как вживую.
+    """
+
+    def __init__(self, cassette: Cassette, account: Optional[str] = None, latency_scale: float = 1.0) -> None:
+        super().__init__()
+        self.cassette = cassette
+        self.account = account
+        self.latency_scale = latency_scale
+
+    def request(self, method, url, data=None, headers=None, **kwargs):
+        key = request_key(method, url, data if data is not None else kwargs.get("json"), self.account)
+        if self.cassette.mode == "replay":
+            return self._replay(key, method, url)
+        t0 = time.perf_counter()
+        try:
+            resp = super().request(method, url, data=data, headers=headers, **kwargs)
+        except requests.RequestException as e:
+            self.cassette.record(key, {"x": type(e).__name__, "ms": round((time.perf_counter() - t0) * 1000.0, 1)})
+            raise
+        ms = (time.perf_counter() - t0) * 1000.0
+        resp.encoding = "utf-8"
+        self.cassette.record(key, {
+            "s": resp.status_code,
+            "r": resp.reason,
+            "h": {
+                k: v for k, v in resp.headers.items()
+                if k.lower() in _KEEP_HEADERS or k.lower().startswith("x-bapi-limit")
+            },
+            "b": resp.text,
+            "ms": round(ms, 1),
+        })
+        return resp
+
+    def _replay(self, key: Key, method: str, url: str) -> requests.Response:
+        e = self.cassette.take(key)
+        delay = float(e.get("ms", 0.0)) / 1000.0 * self.latency_scale
+        if delay > 0:
+            time.sleep(delay)
+        if e.get("x"):
+            exc = getattr(requests.exceptions, e["x"], requests.exceptions.ConnectionError)
+            raise exc(f"replayed {e['x']}: {method} {url}")
+        resp = requests.Response()
+        resp.status_code = int(e.get("s", 200))
+        resp.reason = e.get("r", "")
+        resp.headers = CaseInsensitiveDict(e.get("h") or {})
+        resp._content = str(e.get("b", "")).encode("utf-8")
+        resp.encoding = "utf-8"
+        resp.url = url
+        resp.request = requests.Request(method, url).prepare()
+        return resp
+
+
+_CASSETTE: Optional[Cassette] = None
+_CASSETTE_LOCK = threading.Lock()
+
+
+def get_cassette() -> Optional[Cassette]:
+    """Кассета процесса (CASSETTE) для record/replay; None — живой транспорт."""
+    global _CASSETTE
+    mode = transport_mode()
+    if mode == "live":
+        return None
+    with _CASSETTE_LOCK:
+        if _CASSETTE is None:
+            _CASSETTE = Cassette(
+                os.getenv("CASSETTE", "logs/cassettes/bybit.jsonl.gz"),
+                mode=mode,
+                strict=os.getenv("REPLAY_STRICT", "0") == "1",
+            )
+            atexit.register(_CASSETTE.close)
+            log_event(log, "CASSETTE_OPEN", mode=mode, path=str(_CASSETTE.path), entries=len(_CASSETTE))
+        return _CASSETTE
+
+
+def http_session(account: Optional[str] = None) -> requests.Session:
+    """HTTP-сессия с учётом EXCHANGE_TRANSPORT (для ccxt-клиентов и прямых запросов к API)."""
+    cassette = get_cassette()
+    if cassette is None:
+        return requests.Session()
+    return CassetteSession(cassette, account, latency_scale=float(os.getenv("REPLAY_LATENCY_SCALE", "1")))
+
+
+def install(exchange) -> None:
+    """Подменить HTTP-сессию ccxt-клиента на запись/воспроизведение (live — ничего не делает)."""
+    if transport_mode() != "live":
+        exchange.session = http_session(current_account())
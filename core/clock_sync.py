@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Callable, List, Optional, Tuple
+
+import requests
+
+from .cassette import http_session
+from .logging_setup import log_event
+from .metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+CLOCK_OFFSET = REGISTRY.gauge("bybit_clock_offset_ms", "Server minus local clock, ms (best-RTT sample)")
+CLOCK_RTT = REGISTRY.gauge("bybit_clock_rtt_ms", "Round trip of the best /v5/market/time sample, ms")
+CLOCK_DRIFT = REGISTRY.gauge("bybit_clock_drift_ms_per_hour", "Offset change between the last two syncs, ms/hour")
+CLOCK_SYNCS = REGISTRY.counter(
+    "bybit_clock_syncs_total", "Clock syncs, per reason (startup/schedule/10002/manual)", ["reason"]
+)
+
+
+def _default_base_url() -> str:
+    return os.getenv("BYBIT_API_URL", "https://api.bybit.com").rstrip("/")
+
+
+class ClockSync:
+    """
+    Одна оценка смещения часов биржи на процесс.
+
+    sync() делает несколько запросов /v5/market/time и берёт выборку с минимальным RTT:
+    offset = server - (t_send + t_recv) / 2, ошибка оценки не больше rtt/2. Смещение
+    раздаётся всем зарегистрированным ccxt-клиентам (options["timeDifference"]), поэтому
+    create_exchange больше не ходит за временем сам (adjustForTimeDifference выключен).
+    Пересинхронизация — по расписанию (start()) и после 10002 (on_time_error()).
+    """
+
+    def __init__(
+        self,
+        fetch_server_ms: Optional[Callable[[], int]] = None,
+        samples: Optional[int] = None,
+        interval_s: Optional[float] = None,
+        min_resync_s: Optional[float] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self._fetch = fetch_server_ms or self._fetch_bybit_ms
+        self.samples = max(1, samples if samples is not None else int(os.getenv("CLOCK_SYNC_SAMPLES", "5")))
+        self.interval_s = interval_s if interval_s is not None else float(os.getenv("CLOCK_SYNC_INTERVAL_S", "300"))
+        if min_resync_s is None:
+            min_resync_s = float(os.getenv("CLOCK_SYNC_MIN_RESYNC_S", "5"))
+        self.min_resync_s = min_resync_s
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._clients: "weakref.WeakSet" = weakref.WeakSet()
+        self._session: Optional[requests.Session] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.offset_ms: Optional[float] = None
+        self.rtt_ms: Optional[float] = None
+        self.drift_ms_per_hour: Optional[float] = None
+        self.synced_at: Optional[float] = None
+
+    # --- источник времени ---
+
+    def _fetch_bybit_ms(self) -> int:
+        if self._session is None:
+            self._session = http_session()
+            proxy = os.getenv("PROXY_URL")
+            if proxy:
+                self._session.proxies = {"http": proxy, "https": proxy}
+        r = self._session.get(f"{_default_base_url()}/v5/market/time", timeout=10)
+        r.raise_for_status()
+        res = r.json().get("result", {}) or {}
+        if res.get("timeNano"):
+            return int(res["timeNano"]) // 1_000_000
+        return int(res.get("timeSecond", 0)) * 1000
+
+    # --- оценка ---
+
+    def _sample(self) -> Tuple[float, float]:
+        t0 = self._clock()
+        server_ms = self._fetch()
+        t1 = self._clock()
+        return server_ms - (t0 + t1) * 500.0, (t1 - t0) * 1000.0
+
+    def sync(self, reason: str = "manual") -> float:
+        """Замерить смещение заново, раздать его клиентам; возвращает offset_ms (server − local)."""
+        samples: List[Tuple[float, float]] = []
+        err: Optional[Exception] = None
+        for _ in range(self.samples):
+            try:
+                samples.append(self._sample())
+            except Exception as e:
+                err = e
+        if not samples:
+            log_event(log, "CLOCK_SYNC_ERR", logging.WARNING, reason=reason, error=str(err))
+            raise err  # type: ignore[misc]
+        offset, rtt = min(samples, key=lambda s: s[1])
+        now = self._clock()
+        with self._lock:
+            if self.offset_ms is not None and self.synced_at is not None and now > self.synced_at:
+                self.drift_ms_per_hour = (offset - self.offset_ms) * 3600.0 / (now - self.synced_at)
+                CLOCK_DRIFT.set(self.drift_ms_per_hour)
+            self.offset_ms, self.rtt_ms, self.synced_at = offset, rtt, now
+            clients = list(self._clients)
+        CLOCK_OFFSET.set(offset)
+        CLOCK_RTT.set(rtt)
+        CLOCK_SYNCS.labels(reason).inc()
+        for ex in clients:
+            self._apply(ex)
+        log_event(log, "CLOCK_SYNC", reason=reason, offset_ms=round(offset, 1), rtt_ms=round(rtt, 1),
+                  drift_ms_per_hour=None if self.drift_ms_per_hour is None else round(self.drift_ms_per_hour, 1),
+                  samples=len(samples), clients=len(clients))
+        return offset
+
+    def ensure(self) -> float:
+        """Смещение, замеренное хотя бы раз (первый вызов делает sync)."""
+        offset = self.offset_ms
+        return self.sync("startup") if offset is None else offset
+
+    def age_s(self) -> Optional[float]:
+        return None if self.synced_at is None else self._clock() - self.synced_at
+
+    def server_ms(self) -> int:
+        """Оценка текущего серверного времени без сетевого запроса."""
+        return int(self._clock() * 1000.0 + self.ensure())
+
+    # --- клиенты ---
+
+    def _apply(self, exchange) -> None:
+        # ccxt: nonce = milliseconds() - timeDifference, timeDifference = local - server
+        exchange.options["timeDifference"] = int(round(-(self.offset_ms or 0.0)))
+        exchange.options["adjustForTimeDifference"] = False
+
+    def attach(self, exchange) -> None:
+        """Подписать клиента ccxt на общее смещение (сразу и при каждой пересинхронизации)."""
+        try:
+            self.ensure()
+        except Exception as e:
+            log_event(log, "CLOCK_SYNC_ERR", logging.WARNING, reason="attach", error=str(e))
+        with self._lock:
+            self._clients.add(exchange)
+        self._apply(exchange)
+
+    def on_time_error(self) -> bool:
+        """
+        Биржа ответила 10002 (timestamp вне recv_window): внеочередной sync.
+        True — смещение обновлено и запрос можно повторить. Чаще min_resync_s не синхронизируемся,
+        чтобы пачка одновременных 10002 не превратилась в пачку запросов времени.
+        """
+        age = self.age_s()
+        if age is not None and age < self.min_resync_s:
+            return True
+        try:
+            self.sync("10002")
+            return True
+        except Exception:
+            return False
+
+    # --- расписание ---
+
+    def start(self) -> None:
+        """Фоновая пересинхронизация раз в interval_s (daemon-поток; interval_s <= 0 — выключено)."""
+        if self.interval_s <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="clock-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.sync("schedule")
+            except Exception:
+                pass  # уже залогировано в sync; следующая попытка — через interval_s
+
+
+_CLOCK: Optional[ClockSync] = None
+_CLOCK_LOCK = threading.Lock()
+
+
+def get_clock() -> ClockSync:
+    """Общий ClockSync процесса."""
+    global _CLOCK
+    with _CLOCK_LOCK:
+        if _CLOCK is None:
+            _CLOCK = ClockSync()
+        return _CLOCK
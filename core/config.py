@@ -0,0 +1,480 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from .scheduler import timeframe_seconds
+
+log = logging.getLogger(__name__)
+
+_TRUE = ("1", "true", "yes", "on")
+_FALSE = ("0", "false", "no", "off")
+
+
+class ConfigError(ValueError):
+    """Невалидная конфигурация: все ошибки разом, чтобы поправить .env за один заход."""
+
+    def __init__(self, errors: List[str]) -> None:
+        self.errors = errors
+        super().__init__("invalid config: " + "; ".join(errors))
+
+
+class _Reader:
+    """Парсер значений env с накоплением ошибок вместо исключения на первой."""
+
+    def __init__(self, env: Mapping[str, str]) -> None:
+        self.env = env
+        self.errors: List[str] = []
+
+    def _raw(self, key: str) -> Optional[str]:
+        v = self.env.get(key)
+        if v is None:
+            return None
+        v = str(v).strip()
+        return v or None
+
+    def _num(self, key: str, default, conv: Callable, lo=None, hi=None):
+        raw = self._raw(key)
+        if raw is None:
+            return default
+        try:
+            v = conv(raw)
+        except ValueError:
+            self.errors.append(f"{key}={raw!r}: ожидается {conv.__name__}")
+            return default
+        if (lo is not None and v < lo) or (hi is not None and v > hi):
+            self.errors.append(f"{key}={raw!r}: вне диапазона [{lo}, {hi}]")
+            return default
+        return v
+
+    def float(self, key: str, default: float, lo: Optional[float] = None, hi: Optional[float] = None) -> float:
+        return self._num(key, default, float, lo, hi)
+
+    def int(self, key: str, default: int, lo: Optional[int] = None, hi: Optional[int] = None) -> int:
+        return self._num(key, default, int, lo, hi)
+
+    def bool(self, key: str, default: bool) -> bool:
+        raw = self._raw(key)
+        if raw is None:
+            return default
+        if raw.lower() in _TRUE:
+            return True
+        if raw.lower() in _FALSE:
+            return False
+        self.errors.append(f"{key}={raw!r}: ожидается 1/0, true/false, on/off")
+        return default
+
+    def choice(self, key: str, default: str, allowed: Tuple[str, ...]) -> str:
+        raw = self._raw(key)
+        if raw is None:
+            return default
+        if raw.lower() not in allowed:
+            self.errors.append(f"{key}={raw!r}: допустимо {'|'.join(allowed)}")
+            return default
+        return raw.lower()
+
+    def timeframe(self, key: str, default: str) -> str:
+        raw = self._raw(key) or default
+        try:
+            timeframe_seconds(raw)
+        except ValueError as e:
+            self.errors.append(f"{key}: {e}")
+            return default
+        return raw
+
+    def str(self, key: str, default: str) -> str:
+        return self._raw(key) or default
+
+    def list(self, key: str, default: Tuple[str, ...] = ()) -> Tuple[str, ...]:
+        raw = self._raw(key)
+        if raw is None:
+            return default
+        return tuple(s.strip() for s in raw.split(",") if s.strip())
+
+
+@dataclass(frozen=True)
+class TrailingConfig:
+    enabled: bool = True                # USE_TRAILING_STOP
+    activation_mode: str = "atr"        # TS_ACTIVATION_MODE: atr | pct
+    atr_timeframe: str = "5m"           # ATR_TIMEFRAME
+    atr_period: int = 14                # ATR_PERIOD
+    activation_atr_k: float = 1.0       # TS_ACTIVATION_ATR_K
+    up_pct: float = 0.003               # TS_ACTIVATION_UP_PCT
+    down_pct: float = 0.003             # TS_ACTIVATION_DOWN_PCT
+    min_up_pct: float = 0.001           # TS_ACTIVATION_MIN_UP_PCT
+    min_down_pct: float = 0.001         # TS_ACTIVATION_MIN_DOWN_PCT
+    callback_auto: bool = False         # TS_CALLBACK_RATE_AUTO
+    callback_atr_k: float = 0.75        # TS_CALLBACK_RATE_ATR_K
+    callback_rate: float = 1.0          # TS_CALLBACK_RATE (%)
+
+
+@dataclass(frozen=True)
+class BreakevenConfig:
+    enabled: bool = True                # ENABLE_BREAKEVEN
+    mode: str = "atr"                   # BE_MODE: atr | pct
+    atr_timeframe: str = "5m"           # ATR_TIMEFRAME
+    atr_period: int = 14                # ATR_PERIOD
+    atr_k: float = 0.5                  # BE_ATR_K
+    trigger_pct: float = 0.004          # BE_TRIGGER_PCT
+    offset_pct: float = 0.0005          # BE_OFFSET_PCT
+
+
+@dataclass(frozen=True)
+class EntryConfig:
+    timeframe: str = "5m"               # TIMEFRAME
+    conf_threshold: float = 0.65        # CONF_THRESHOLD
+    leverage: int = 3                   # LEVERAGE
+    atr_period: int = 14                # ATR_PERIOD
+    sl_atr_mult: float = 1.8            # SL_ATR_MULT
+    tp_atr_mult: float = 2.2            # TP_ATR_MULT
+    risk_pct: float = 0.007             # RISK_PCT — доля депозита на сделку
+    maker: bool = False                 # MAKER_ENTRY
+    batch: bool = False                 # BATCH_ENTRY
+    batch_order_max: int = 10           # BATCH_ORDER_MAX
+
+
+@dataclass(frozen=True)
+class RiskConfig:
+    min_balance_usdt: float = 5.0       # MIN_BALANCE_USDT
+    daily_loss_limit: float = 0.0       # DAILY_LOSS_LIMIT (0 — выключен)
+    max_open_trades: int = 0            # MAX_OPEN_TRADES (0 — выключен)
+
+
+@dataclass(frozen=True)
+class MakerConfig:
+    slippage_bps: float = 5.0           # LIMIT_SLIPPAGE_BPS
+    timeout_s: float = 20.0             # MAKER_TIMEOUT_S
+    fallback: str = "ioc"               # MAKER_FALLBACK: ioc | market
+    amend_rps: float = 5.0              # MAKER_AMEND_RPS
+    book_stream: bool = True            # MAKER_BOOK_STREAM
+    poll_ms: float = 250.0              # MAKER_POLL_MS
+
+
+@dataclass(frozen=True)
+class MonitorConfig:
+    enabled: bool = True                # POSITION_MONITOR
+    rps: float = 5.0                    # MONITOR_RPS
+    workers: int = 4                    # MONITOR_WORKERS
+
+
+@dataclass(frozen=True)
+class DaemonConfig:
+    align_to_bar: bool = True           # ALIGN_TO_BAR
+    bar_close_delay_s: float = 1.5      # BAR_CLOSE_DELAY_S
+    pair_stagger_s: float = 0.2         # PAIR_STAGGER_MS / 1000
+    check_interval_s: float = 60.0      # CHECK_INTERVAL
+    debug_indicators: bool = False      # DEBUG_INDICATORS
+    config_reload: bool = True          # CONFIG_RELOAD (перечитка .env перед каждым циклом)
+    metrics_port: int = 0               # METRICS_PORT (0 — без /metrics)
+    metrics_host: str = "127.0.0.1"     # METRICS_HOST (0.0.0.0 — наружу, только за файрволом)
+    workers: int = 1                    # GUARD_WORKERS
+    train_limit: int = 3000             # TRAIN_LIMIT (свечей на обучение модели)
+
+
+@dataclass(frozen=True)
+class RetryConfig:
+    retries: int = 3                    # EXCHANGE_RETRIES
+    base_s: float = 0.25                # RETRY_BASE_S
+    max_s: float = 4.0                  # RETRY_MAX_S
+    cb_failures: int = 5                # CB_FAILURES
+    cb_cooldown_s: float = 30.0         # CB_COOLDOWN_S
+
+
+@dataclass(frozen=True)
+class ScanConfig:
+    enabled: bool = False               # SCAN_UNIVERSE
+    top_n: int = 20                     # SCAN_TOP_N
+    exit_rank: int = 40                 # SCAN_EXIT_RANK (0 — 2·SCAN_TOP_N)
+    min_turnover: float = 5_000_000.0   # SCAN_MIN_TURNOVER — USDT оборота за 24ч
+    max_spread_bps: float = 10.0        # SCAN_MAX_SPREAD_BPS
+    w_volume: float = 1.0               # SCAN_W_VOLUME
+    w_volatility: float = 1.0           # SCAN_W_VOLATILITY
+    w_spread: float = 0.5               # SCAN_W_SPREAD
+    require_model: bool = True          # SCAN_REQUIRE_MODEL — только пары с models/model_<ID>.pkl
+
+
+@dataclass(frozen=True)
+class AccountConfig:
+    """
+    Доп. аккаунт Bybit (ACCOUNTS=sub1,sub2): ключи — BYBIT_API_KEY__SUB1 / BYBIT_SECRET_KEY__SUB1,
+    размер и лимиты — те же переменные с суффиксом __SUB1 (без него — как у основного).
+    """
+
+    name: str
+    risk_pct: float                     # RISK_PCT__<NAME>
+    leverage: int                       # LEVERAGE__<NAME>
+    min_balance_usdt: float             # MIN_BALANCE_USDT__<NAME>
+    daily_loss_limit: float             # DAILY_LOSS_LIMIT__<NAME>
+    max_open_trades: int                # MAX_OPEN_TRADES__<NAME>
+
+
+_ACCOUNT_NAME = re.compile(r"^[A-Za-z0-9_]+$")
+
+
+def _accounts(r: _Reader, entry: "EntryConfig", risk: "RiskConfig") -> Tuple[AccountConfig, ...]:
+    out: List[AccountConfig] = []
+    for name in r.list("ACCOUNTS"):
+        if not _ACCOUNT_NAME.match(name) or name.lower() == "main" or any(a.name == name for a in out):
+            r.errors.append(f"ACCOUNTS: недопустимое или повторное имя {name!r}")
+            continue
+        sfx = f"__{name.upper()}"
+        for key in ("BYBIT_API_KEY", "BYBIT_SECRET_KEY"):
+            if r._raw(key + sfx) is None:
+                r.errors.append(f"{key}{sfx}: не задан ключ аккаунта {name}")
+        out.append(AccountConfig(
+            name=name,
+            risk_pct=r.float("RISK_PCT" + sfx, entry.risk_pct, 0.0, 1.0),
+            leverage=r.int("LEVERAGE" + sfx, entry.leverage, 1, 125),
+            min_balance_usdt=r.float("MIN_BALANCE_USDT" + sfx, risk.min_balance_usdt, 0.0),
+            daily_loss_limit=r.float("DAILY_LOSS_LIMIT" + sfx, risk.daily_loss_limit, 0.0),
+            max_open_trades=r.int("MAX_OPEN_TRADES" + sfx, risk.max_open_trades, 0),
+        ))
+    return tuple(out)
+
+
+def _scan(r: _Reader) -> ScanConfig:
+    top_n = r.int("SCAN_TOP_N", 20, 1, 1000)
+    exit_rank = r.int("SCAN_EXIT_RANK", 0, 0) or 2 * top_n
+    if exit_rank < top_n:
+        r.errors.append(f"SCAN_EXIT_RANK={exit_rank}: должен быть не меньше SCAN_TOP_N={top_n}")
+        exit_rank = top_n
+    return ScanConfig(
+        enabled=r.bool("SCAN_UNIVERSE", False),
+        top_n=top_n,
+        exit_rank=exit_rank,
+        min_turnover=r.float("SCAN_MIN_TURNOVER", 5_000_000.0, 0.0),
+        max_spread_bps=r.float("SCAN_MAX_SPREAD_BPS", 10.0, 0.0),
+        w_volume=r.float("SCAN_W_VOLUME", 1.0, 0.0),
+        w_volatility=r.float("SCAN_W_VOLATILITY", 1.0, 0.0),
+        w_spread=r.float("SCAN_W_SPREAD", 0.5, 0.0),
+        require_model=r.bool("SCAN_REQUIRE_MODEL", True),
+    )
+
+
+@dataclass(frozen=True)
+class Config:
+    """
+    Неизменяемый снимок настроек торгового пути. Разбирается и проверяется один раз
+    (Config.from_env), дальше передаётся по конвейеру; перечитка .env — новый объект целиком.
+    """
+
+    pairs: Tuple[str, ...] = ()
+    trailing: TrailingConfig = field(default_factory=TrailingConfig)
+    breakeven: BreakevenConfig = field(default_factory=BreakevenConfig)
+    entry: EntryConfig = field(default_factory=EntryConfig)
+    risk: RiskConfig = field(default_factory=RiskConfig)
+    maker: MakerConfig = field(default_factory=MakerConfig)
+    monitor: MonitorConfig = field(default_factory=MonitorConfig)
+    daemon: DaemonConfig = field(default_factory=DaemonConfig)
+    retry: RetryConfig = field(default_factory=RetryConfig)
+    scan: ScanConfig = field(default_factory=ScanConfig)
+    accounts: Tuple[AccountConfig, ...] = ()
+    version: int = 0
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str], version: int = 0) -> "Config":
+        r = _Reader(env)
+        atr_tf = r.timeframe("ATR_TIMEFRAME", "5m")
+        atr_period = r.int("ATR_PERIOD", 14, 1, 1000)
+        cfg = cls(
+            pairs=r.list("PAIRS"),
+            trailing=TrailingConfig(
+                enabled=r.bool("USE_TRAILING_STOP", True),
+                activation_mode=r.choice("TS_ACTIVATION_MODE", "atr", ("atr", "pct")),
+                atr_timeframe=atr_tf,
+                atr_period=atr_period,
+                activation_atr_k=r.float("TS_ACTIVATION_ATR_K", 1.0, 0.0),
+                up_pct=r.float("TS_ACTIVATION_UP_PCT", 0.003, 0.0, 1.0),
+                down_pct=r.float("TS_ACTIVATION_DOWN_PCT", 0.003, 0.0, 1.0),
+                min_up_pct=r.float("TS_ACTIVATION_MIN_UP_PCT", 0.001, 0.0, 1.0),
+                min_down_pct=r.float("TS_ACTIVATION_MIN_DOWN_PCT", 0.001, 0.0, 1.0),
+                callback_auto=r.bool("TS_CALLBACK_RATE_AUTO", False),
+                callback_atr_k=r.float("TS_CALLBACK_RATE_ATR_K", 0.75, 0.0),
+                callback_rate=r.float("TS_CALLBACK_RATE", 1.0, 0.01, 50.0),
+            ),
+            breakeven=BreakevenConfig(
+                enabled=r.bool("ENABLE_BREAKEVEN", True),
+                mode=r.choice("BE_MODE", "atr", ("atr", "pct")),
+                atr_timeframe=atr_tf,
+                atr_period=atr_period,
+                atr_k=r.float("BE_ATR_K", 0.5, 0.0),
+                trigger_pct=r.float("BE_TRIGGER_PCT", 0.004, 0.0, 1.0),
+                offset_pct=r.float("BE_OFFSET_PCT", 0.0005, 0.0, 0.1),
+            ),
+            entry=EntryConfig(
+                timeframe=r.timeframe("TIMEFRAME", "5m"),
+                conf_threshold=r.float("CONF_THRESHOLD", 0.65, 0.0, 1.0),
+                leverage=r.int("LEVERAGE", 3, 1, 125),
+                atr_period=atr_period,
+                sl_atr_mult=r.float("SL_ATR_MULT", 1.8, 0.0),
+                tp_atr_mult=r.float("TP_ATR_MULT", 2.2, 0.0),
+                risk_pct=r.float("RISK_PCT", 0.007, 0.0, 1.0),
+                maker=r.bool("MAKER_ENTRY", False),
+                batch=r.bool("BATCH_ENTRY", False),
+                batch_order_max=r.int("BATCH_ORDER_MAX", 10, 1, 20),
+            ),
+            risk=RiskConfig(
+                min_balance_usdt=r.float("MIN_BALANCE_USDT", 5.0, 0.0),
+                daily_loss_limit=r.float("DAILY_LOSS_LIMIT", 0.0, 0.0),
+                max_open_trades=r.int("MAX_OPEN_TRADES", 0, 0),
+            ),
+            maker=MakerConfig(
+                slippage_bps=r.float("LIMIT_SLIPPAGE_BPS", 5.0, 0.0, 1000.0),
+                timeout_s=r.float("MAKER_TIMEOUT_S", 20.0, 0.0),
+                fallback=r.choice("MAKER_FALLBACK", "ioc", ("ioc", "market")),
+                amend_rps=r.float("MAKER_AMEND_RPS", 5.0, 0.1),
+                book_stream=r.bool("MAKER_BOOK_STREAM", True),
+                poll_ms=r.float("MAKER_POLL_MS", 250.0, 10.0),
+            ),
+            monitor=MonitorConfig(
+                enabled=r.bool("POSITION_MONITOR", True),
+                rps=r.float("MONITOR_RPS", 5.0, 0.1),
+                workers=r.int("MONITOR_WORKERS", 4, 1, 64),
+            ),
+            daemon=DaemonConfig(
+                align_to_bar=r.bool("ALIGN_TO_BAR", True),
+                bar_close_delay_s=r.float("BAR_CLOSE_DELAY_S", 1.5, 0.0),
+                pair_stagger_s=r.float("PAIR_STAGGER_MS", 200.0, 0.0) / 1000.0,
+                check_interval_s=r.float("CHECK_INTERVAL", 60.0, 1.0),
+                debug_indicators=r.bool("DEBUG_INDICATORS", False),
+                config_reload=r.bool("CONFIG_RELOAD", True),
+                metrics_port=r.int("METRICS_PORT", 0, 0, 65535),
+                metrics_host=r.str("METRICS_HOST", "127.0.0.1"),
+                workers=r.int("GUARD_WORKERS", 1, 1, 64),
+                train_limit=r.int("TRAIN_LIMIT", 3000, 100, 100_000),
+            ),
+            retry=RetryConfig(
+                retries=r.int("EXCHANGE_RETRIES", 3, 0, 20),
+                base_s=r.float("RETRY_BASE_S", 0.25, 0.0),
+                max_s=r.float("RETRY_MAX_S", 4.0, 0.0),
+                cb_failures=r.int("CB_FAILURES", 5, 1),
+                cb_cooldown_s=r.float("CB_COOLDOWN_S", 30.0, 0.0),
+            ),
+            scan=_scan(r),
+            version=version,
+        )
+        cfg = dataclasses.replace(cfg, accounts=_accounts(r, cfg.entry, cfg.risk))
+        if r.errors:
+            raise ConfigError(r.errors)
+        return cfg
+
+    def for_account(self, name: Optional[str]) -> "Config":
+        """Снимок для исполнения на аккаунте name: свой размер позиции и лимиты риска."""
+        acc = next((a for a in self.accounts if a.name == name), None)
+        if acc is None:
+            return self
+        return dataclasses.replace(
+            self,
+            entry=dataclasses.replace(self.entry, risk_pct=acc.risk_pct, leverage=acc.leverage),
+            risk=RiskConfig(
+                min_balance_usdt=acc.min_balance_usdt,
+                daily_loss_limit=acc.daily_loss_limit,
+                max_open_trades=acc.max_open_trades,
+            ),
+        )
+
+    def diff(self, other: "Config") -> Dict[str, Tuple[Any, Any]]:
+        """Изменившиеся поля: {"entry.leverage": (старое, новое)}."""
+        a, b = dataclasses.asdict(self), dataclasses.asdict(other)
+        out: Dict[str, Tuple[Any, Any]] = {}
+        for sec, val in a.items():
+            if sec == "version":
+                continue
+            if isinstance(val, dict):
+                for k, v in val.items():
+                    if b[sec][k] != v:
+                        out[f"{sec}.{k}"] = (v, b[sec][k])
+            elif b[sec] != val:
+                out[sec] = (val, b[sec])
+        return out
+
+
+# --- текущий снимок и перечитка .env ---
+
+_CONFIG: Optional[Config] = None
+_LOCK = threading.Lock()
+_ENV_FILE: Optional[Path] = None
+_ENV_MTIME: Optional[float] = None
+# окружение процесса до подгрузки .env: оно приоритетнее файла (как load_dotenv без override)
+_BASE_ENV: Optional[Dict[str, str]] = None
+
+
+def _file_env(path: Path) -> Dict[str, str]:
+    from dotenv import dotenv_values
+
+    return {k: v for k, v in dotenv_values(path).items() if v is not None}
+
+
+def _mtime(path: Optional[Path]) -> Optional[float]:
+    try:
+        return path.stat().st_mtime if path is not None else None
+    except OSError:
+        return None
+
+
+def load_config(env_file: str = ".env", base_env: Optional[Mapping[str, str]] = None) -> Config:
+    """
+    Стартовая загрузка: .env + окружение процесса (base_env — env до load_dotenv).
+    ConfigError — сразу, до первого запроса к бирже.
+    """
+    global _CONFIG, _ENV_FILE, _ENV_MTIME, _BASE_ENV
+    path = Path(env_file)
+    base = dict(base_env if base_env is not None else os.environ)
+    env = {**(_file_env(path) if path.exists() else {}), **base}
+    cfg = Config.from_env(env, version=1)
+    with _LOCK:
+        _CONFIG, _ENV_FILE, _ENV_MTIME, _BASE_ENV = cfg, path, _mtime(path), base
+    return cfg
+
+
+def base_env() -> Dict[str, str]:
+    """Окружение процесса до подгрузки .env (его наследуют дочерние процессы, .env они читают сами)."""
+    with _LOCK:
+        return dict(_BASE_ENV if _BASE_ENV is not None else os.environ)
+
+
+def get_config() -> Config:
+    """Текущий снимок (ссылка меняется атомарно при перечитке). Без load_config — из os.environ."""
+    cfg = _CONFIG
+    if cfg is None:
+        with _LOCK:
+            if _CONFIG is None:
+                globals()["_CONFIG"] = Config.from_env(os.environ)
+            cfg = _CONFIG
+    return cfg
+
+
+def reload_config(force: bool = False) -> Optional[Config]:
+    """
+    Перечитать .env, если файл изменился (или force). Новый снимок подменяет старый целиком;
+    при ошибках валидации остаётся старый, ошибки — в лог. Возвращает новый Config или None.
+    """
+    global _CONFIG, _ENV_MTIME
+    path = _ENV_FILE
+    if path is None:
+        return None
+    mtime = _mtime(path)
+    if not force and (mtime is None or mtime == _ENV_MTIME):
+        return None
+    old = get_config()
+    try:
+        env = {**(_file_env(path) if path.exists() else {}), **(_BASE_ENV or {})}
+        new = Config.from_env(env, version=old.version + 1)
+    except ConfigError as e:
+        _ENV_MTIME = mtime  # тот же битый файл не разбираем каждый цикл
+        log.error("[CONFIG] %s не применён: %s", path, "; ".join(e.errors))
+        return None
+    with _LOCK:
+        _CONFIG, _ENV_MTIME = new, mtime
+    changes = old.diff(new)
+    log.info("[CONFIG] reload v%d: %s", new.version,
+             ", ".join(f"{k} {a!r}→{b!r}" for k, (a, b) in changes.items()) or "без изменений",
+             extra={"fields": {"changed": sorted(changes), "at": time.time()}})
+    return new
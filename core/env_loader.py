@@ -1,11 +1,20 @@
 import os
-from typing import Any, Dict, Iterable, Optional
+from typing import Iterable, Optional
 
-from dotenv import load_dotenv
+from dotenv import find_dotenv, load_dotenv
 
+from .config import Config, load_config
 
-def load_and_check_env(required_keys: Optional[Iterable[str]] = None) -> Dict[str, Any]:
-    load_dotenv()
+
+def load_and_check_env(required_keys: Optional[Iterable[str]] = None, env_file: Optional[str] = None) -> Config:
+    """
+    Подгружает .env в окружение и возвращает проверенный снимок настроек (core.config.Config).
+    Ошибки значений (ConfigError) — здесь, на старте, а не посреди выставления ордера.
+    """
+    base_env = dict(os.environ)
+    # как раньше load_dotenv(): ищем .env вверх от пакета; этот же файл потом перечитывается
+    env_file = env_file or find_dotenv() or ".env"
+    load_dotenv(env_file)
     proxy_url = os.getenv("PROXY_URL", "").strip()
     if proxy_url:
         os.environ.setdefault("HTTP_PROXY", proxy_url)
@@ -16,23 +25,7 @@ def load_and_check_env(required_keys: Optional[Iterable[str]] = None) -> Dict[st
         if missing:
             raise ValueError(f"Missing required env keys: {', '.join(missing)}")
 
-    cfg = {
-        "API_KEY": os.getenv("BYBIT_API_KEY", ""),
-        "API_SECRET": os.getenv("BYBIT_SECRET_KEY", ""),
-        "DOMAIN": os.getenv("DOMAIN", "bybit"),
-        "PROXY_URL": proxy_url,
-        "PAIRS": [
-            p.strip()
-            for p in os.getenv("PAIRS", os.getenv("PAIR", "TON/USDT")).split(",")
-            if p.strip()
-        ],
-        "LEVERAGE": int(os.getenv("LEVERAGE", "3")),
-        "AMOUNT": float(os.getenv("AMOUNT", "5")),
-        "RISK_FRACTION": float(os.getenv("RISK_FRACTION", "0.05")),
-        "RECV_WINDOW": int(os.getenv("RECV_WINDOW", "15000")),
-        "DRY_RUN": os.getenv("DRY_RUN", "true").lower() in ("1", "true", "yes"),
-    }
-    return cfg
+    return load_config(env_file, base_env=base_env)
 
 
 def normalize_symbol(pair: str) -> str:
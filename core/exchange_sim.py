@@ -0,0 +1,1022 @@
+from __future__ import annotations
+
+import csv
+import gzip
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from .logging_setup import log_event
+from .rate_limiter import TokenBucket
+
+log = logging.getLogger(__name__)
+
+# interval Bybit v5 /market/kline → миллисекунды
+_INTERVALS = {
+    "1": 60_000, "3": 180_000, "5": 300_000, "15": 900_000, "30": 1_800_000, "60": 3_600_000,
+    "120": 7_200_000, "240": 14_400_000, "360": 21_600_000, "720": 43_200_000,
+    "D": 86_400_000, "W": 604_800_000,
+}
+_DAY_MS = 86_400_000
+
+# Лимиты на UID (запросов в секунду) по эндпоинтам — порядок величин из документации Bybit v5
+_UID_LIMITS = {
+    "/v5/order/create": 10.0,
+    "/v5/order/amend": 10.0,
+    "/v5/order/cancel": 10.0,
+    "/v5/order/create-batch": 10.0,
+    "/v5/order/realtime": 50.0,
+    "/v5/order/history": 50.0,
+    "/v5/position/list": 50.0,
+    "/v5/position/trading-stop": 10.0,
+    "/v5/position/set-leverage": 10.0,
+    "/v5/position/closed-pnl": 50.0,
+    "/v5/account/wallet-balance": 50.0,
+}
+# Лимит на IP: 600 запросов за 5 секунд, сверх — HTTP 429
+_IP_RATE, _IP_BURST = 120.0, 600.0
+
+_OPEN = ("New", "PartiallyFilled", "Untriggered")
+
+# Стартовые цены синтетики для частых символов (чтобы размеры ордеров были правдоподобными)
+_SYNTH_PRICES = {"BTC": 60000.0, "ETH": 3000.0, "SOL": 150.0, "BNB": 550.0, "XRP": 0.6, "DOGE": 0.15, "TON": 5.0}
+
+
+class SimError(Exception):
+    """Ответ симулятора с retCode != 0 (коды и тексты — как у Bybit v5)."""
+
+    def __init__(self, code: int, msg: str) -> None:
+        super().__init__(msg)
+        self.code = code
+        self.msg = msg
+
+
+def _s(x: float) -> str:
+    """Число → строка v5 (без экспоненты и хвостовых нулей)."""
+    if x is None or x == 0:
+        return "0"
+    out = f"{x:.10f}".rstrip("0").rstrip(".")
+    return out if out not in ("", "-0") else "0"
+
+
+def _f(v: Any, default: float = 0.0) -> float:
+    try:
+        return float(v) if v not in (None, "") else default
+    except (TypeError, ValueError):
+        return default
+
+
+def _step(x: float) -> float:
+    return 10.0 ** math.floor(math.log10(x)) if x > 0 else 1.0
+
+
+def _round_to(x: float, step: float) -> float:
+    return round(round(x / step) * step, 10)
+
+
+# ---------------------------------------------------------------------
+# Свечи
+# ---------------------------------------------------------------------
+class Series:
+    """
+    Свечи одного символа [ts, o, h, l, c, v], «переставленные» во времени симулятора:
+    бар номер warmup открывается в момент старта, всё до него — история.
+    Внутри бара цена идёт по пути o→l→h→c (растущий бар) или o→h→l→c (падающий).
+    """
+
+    def __init__(self, symbol: str, candles: List[List[float]], interval_ms: int) -> None:
+        if not candles:
+            raise ValueError(f"no candles for {symbol}")
+        self.symbol = symbol
+        self.candles = [[float(x) for x in c[:6]] for c in candles]
+        self.interval_ms = int(interval_ms)
+        self.ts0 = 0
+        self._stats: Tuple[int, Tuple[float, float, float, float, float]] = (-1, (0.0, 0.0, 0.0, 0.0, 0.0))
+
+    def rebase(self, start_ms: int, warmup: int) -> None:
+        warmup = max(0, min(warmup, len(self.candles) - 1))
+        self.ts0 = (start_ms // self.interval_ms) * self.interval_ms - warmup * self.interval_ms
+
+    def index(self, t: int) -> int:
+        return int((t - self.ts0) // self.interval_ms)
+
+    def _path(self, i: int) -> List[float]:
+        _, o, h, l, c, _ = self.candles[i]
+        return [o, l, h, c] if c >= o else [o, h, l, c]
+
+    def price_at(self, t: int) -> float:
+        i = self.index(t)
+        if i < 0:
+            return self.candles[0][1]
+        if i >= len(self.candles):
+            return self.candles[-1][4]
+        frac = (t - self.ts0 - i * self.interval_ms) / self.interval_ms
+        path = self._path(i)
+        x = frac * 3.0
+        k = min(int(x), 2)
+        return path[k] + (path[k + 1] - path[k]) * (x - k)
+
+    def vertices(self, t0: int, t1: int) -> List[float]:
+        """Цены в t0, во всех вершинах пути внутри (t0, t1) и в t1 — для сопоставления ордеров."""
+        out = [self.price_at(t0)]
+        step = self.interval_ms / 3.0
+        first = max(self.index(t0), 0)
+        last = min(self.index(t1), len(self.candles) - 1)
+        for i in range(first, last + 1):
+            base = self.ts0 + i * self.interval_ms
+            for k in (1, 2, 3):
+                tv = base + k * step
+                if t0 < tv < t1:
+                    out.append(self._path(i)[k])
+        out.append(self.price_at(t1))
+        return out
+
+    def bar(self, i: int, now: int) -> Optional[List[float]]:
+        """Бар i на момент now: закрытый целиком, формирующийся — до текущей цены."""
+        if i < 0 or i >= len(self.candles):
+            return None
+        start = self.ts0 + i * self.interval_ms
+        if start > now:
+            return None
+        if now >= start + self.interval_ms:
+            return [start] + self.candles[i][1:6]
+        frac = (now - start) / self.interval_ms
+        path = self._path(i)
+        seen = path[: min(int(frac * 3.0), 2) + 1] + [self.price_at(now)]
+        return [start, path[0], max(seen), min(seen), seen[-1], self.candles[i][5] * frac]
+
+    def bars(
+        self, interval_ms: int, now: int, start: Optional[int], end: Optional[int], limit: int
+    ) -> List[List[float]]:
+        """Бары interval_ms (кратного базовому), новые первыми, как в /v5/market/kline."""
+        k = max(1, interval_ms // self.interval_ms)
+        end = min(now, end) if end is not None else now
+        last = min(self.index(end), len(self.candles) - 1)
+        out: List[List[float]] = []
+        g_start = ((self.ts0 + last * self.interval_ms) // interval_ms) * interval_ms
+        while len(out) < limit:
+            if start is not None and g_start + interval_ms <= start:
+                break
+            group = [self.bar(self.index(g_start) + j, now) for j in range(k)]
+            group = [b for b in group if b is not None]
+            if not group:
+                break
+            out.append([
+                g_start, group[0][1], max(b[2] for b in group), min(b[3] for b in group), group[-1][4],
+                sum(b[5] for b in group),
+            ])
+            g_start -= interval_ms
+        return out
+
+    def stats24h(self, now: int) -> Tuple[float, float, float, float, float]:
+        """(high, low, volume, turnover, цена 24ч назад) за последние сутки."""
+        i = self.index(now)
+        if self._stats[0] != i:
+            n = max(1, _DAY_MS // self.interval_ms)
+            bars = [self.bar(j, now) for j in range(max(i - n, 0), i)]
+            bars = [b for b in bars if b is not None]
+            if bars:
+                self._stats = (i, (max(b[2] for b in bars), min(b[3] for b in bars), sum(b[5] for b in bars),
+                                   sum(b[5] * b[4] for b in bars), bars[0][1]))
+            else:
+                c = self.candles[0]
+                self._stats = (i, (c[2], c[3], 0.0, 0.0, c[1]))
+        hi, lo, vol, to, prev = self._stats[1]
+        cur = self.bar(i, now)
+        if cur is not None:
+            hi, lo, vol, to = max(hi, cur[2]), min(lo, cur[3]), vol + cur[5], to + cur[5] * cur[4]
+        return hi, lo, vol, to, prev
+
+
+def synthetic_candles(
+    symbol: str, n: int, interval_ms: int, seed: int = 0, price: Optional[float] = None
+) -> List[List[float]]:
+    """Случайное блуждание (GBM) для символа: воспроизводимо по seed и имени."""
+    rng = random.Random(f"{seed}:{symbol}")
+    p = price or _SYNTH_PRICES.get(symbol[:-4] if symbol.endswith("USDT") else symbol) or 10.0 ** rng.uniform(-1.0, 4.5)
+    sigma = 0.004 * math.sqrt(interval_ms / 3_600_000)
+    out = []
+    for i in range(n):
+        o = p
+        c = o * math.exp(rng.gauss(0.0, sigma))
+        h = max(o, c) * (1.0 + abs(rng.gauss(0.0, sigma / 2)))
+        low = min(o, c) * (1.0 - abs(rng.gauss(0.0, sigma / 2)))
+        v = rng.lognormvariate(math.log(2e6 / o), 0.5)
+        out.append([i * interval_ms, o, h, low, c, v])
+        p = c
+    return out
+
+
+def load_csv_dir(path: str) -> Dict[str, List[List[float]]]:
+    """<dir>/<SYMBOL>.csv: ts(ms),open,high,low,close,volume; строка-заголовок допускается."""
+    out: Dict[str, List[List[float]]] = {}
+    for f in sorted(Path(path).glob("*.csv")):
+        rows = []
+        with open(f, encoding="utf-8") as fh:
+            for row in csv.reader(fh):
+                try:
+                    rows.append([float(x) for x in row[:6]])
+                except (ValueError, IndexError):
+                    continue
+        if rows:
+            out[f.stem.upper()] = sorted(rows)
+    return out
+
+
+def load_cassette_klines(path: str) -> Dict[str, List[List[float]]]:
+    """Свечи из кассеты core.cassette: все ответы /v5/market/kline, меньший таймфрейм символа."""
+    per: Dict[Tuple[str, int], Dict[float, List[float]]] = {}
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as fh:
+        for line in fh:
+            e = json.loads(line) if line.strip() else {}
+            if e.get("p") != "/v5/market/kline" or not e.get("b"):
+                continue
+            q = dict(parse_qsl(e.get("q", "")))
+            iv = _INTERVALS.get(q.get("interval", ""))
+            try:
+                rows = (json.loads(e["b"]).get("result") or {}).get("list") or []
+            except ValueError:
+                continue
+            if iv and q.get("symbol"):
+                bucket = per.setdefault((q["symbol"], iv), {})
+                for r in rows:
+                    bucket[float(r[0])] = [float(x) for x in r[:6]]
+    out: Dict[str, List[List[float]]] = {}
+    for (sym, iv) in sorted(per, key=lambda k: k[1], reverse=True):
+        out[sym] = sorted(per[(sym, iv)].values())  # меньший интервал перезаписывает больший
+    return out
+
+
+def _interval_of(candles: List[List[float]], default: int) -> int:
+    diffs = [b[0] - a[0] for a, b in zip(candles, candles[1:]) if b[0] > a[0]]
+    return int(min(diffs)) if diffs else default
+
+
+# ---------------------------------------------------------------------
+# Аккаунт
+# ---------------------------------------------------------------------
+@dataclass
+class SimPosition:
+    symbol: str
+    side: str = ""  # Buy | Sell | ""
+    size: float = 0.0
+    avg: float = 0.0
+    leverage: float = 10.0
+    tp: float = 0.0
+    sl: float = 0.0
+    trailing: float = 0.0
+    active_price: float = 0.0
+    peak: float = 0.0  # экстремум для трейлинга (после активации)
+    realised: float = 0.0
+    created: int = 0
+    updated: int = 0
+
+
+@dataclass
+class SimAccount:
+    uid: str
+    wallet: float
+    positions: Dict[str, SimPosition] = field(default_factory=dict)
+    orders: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    leverage: Dict[str, float] = field(default_factory=dict)
+    fills: int = 0
+    closed_pnl: List[Dict[str, Any]] = field(default_factory=list)  # как /v5/position/closed-pnl, старые первыми
+
+    def position(self, symbol: str) -> SimPosition:
+        pos = self.positions.get(symbol)
+        if pos is None:
+            pos = self.positions[symbol] = SimPosition(symbol, leverage=self.leverage.get(symbol, 10.0))
+        return pos
+
+
+# ---------------------------------------------------------------------
+# Биржа
+# ---------------------------------------------------------------------
+class BybitSim:
+    """
+    Упрощённая Bybit v5 (category=linear, one-way, UNIFIED/USDT) над воспроизводимыми свечами.
+
+    Время симулятора: start + (wall − wall0) × speed; speed=0 — только /sim/advance (детерминированно).
+    Каждый запрос сначала «прокручивает» рынок до текущего момента: лимитные ордера, условные
+    ордера и TP/SL/трейлинг позиций исполняются по пути цены внутри баров. Рыночные ордера —
+    по bid/ask = цена ∓ spread/2, комиссии taker/maker. Аккаунт — по API-ключу (X-BAPI-API-KEY).
+    """
+
+    def __init__(
+        self,
+        series: Dict[str, Series],
+        *,
+        balance: float = 10_000.0,
+        speed: float = 1.0,
+        start_ms: Optional[int] = None,
+        warmup: int = 1000,
+        spread_bps: float = 2.0,
+        taker_fee: float = 0.00055,
+        maker_fee: float = 0.0002,
+        max_leverage: float = 50.0,
+        check_recv_window: bool = True,
+    ) -> None:
+        self.series = series
+        self.balance = balance
+        self.speed = speed
+        self.spread = spread_bps / 1e4
+        self.taker_fee = taker_fee
+        self.maker_fee = maker_fee
+        self.max_leverage = max_leverage
+        self.check_recv_window = check_recv_window
+        self.start_ms = int(start_ms if start_ms is not None else time.time() * 1000)
+        for s in series.values():
+            s.rebase(self.start_ms, warmup)
+        self._wall0 = time.time()
+        self._manual_ms = 0
+        self._t = self.start_ms
+        self._lock = threading.RLock()
+        self._accounts: Dict[str, SimAccount] = {}
+        self._ids = itertools.count(1)
+        self._specs = {sym: self._spec(s) for sym, s in series.items()}
+
+    # --- время ---
+
+    def now_ms(self) -> int:
+        return self.start_ms + int((time.time() - self._wall0) * 1000.0 * self.speed) + self._manual_ms
+
+    def advance(self, ms: int) -> int:
+        """Сдвинуть время симулятора вперёд (режим speed=0 и ручная перемотка)."""
+        with self._lock:
+            self._manual_ms += max(0, int(ms))
+            self._sync()
+            return self._t
+
+    def _spec(self, s: Series) -> Dict[str, float]:
+        px = s.candles[min(len(s.candles) - 1, max(0, s.index(self.start_ms)))][4]
+        qty_step = max(_step(5.0 / px), 1e-6) if px > 0 else 1.0
+        tick = _step(px) / 1e5 if px > 0 else 1e-4
+        return {"tick": tick, "qty_step": qty_step, "min_qty": qty_step, "min_notional": 5.0}
+
+    # --- цены ---
+
+    def price(self, symbol: str) -> float:
+        return self.series[symbol].price_at(self._t)
+
+    def quote(self, symbol: str) -> Tuple[float, float]:
+        p, tick = self.price(symbol), self._specs[symbol]["tick"]
+        half = max(p * self.spread / 2.0, tick)
+        return _round_to(p - half, tick), _round_to(p + half, tick)
+
+    # --- аккаунты ---
+
+    def account(self, uid: str) -> SimAccount:
+        acc = self._accounts.get(uid)
+        if acc is None:
+            acc = self._accounts[uid] = SimAccount(uid, self.balance)
+        return acc
+
+    def _equity(self, acc: SimAccount) -> Tuple[float, float, float, float]:
+        """(equity, uPnL, IM позиций, IM ордеров)."""
+        upnl = pos_im = ord_im = 0.0
+        for pos in acc.positions.values():
+            if pos.size > 0:
+                px = self.price(pos.symbol)
+                upnl += (px - pos.avg) * pos.size * (1 if pos.side == "Buy" else -1)
+                pos_im += pos.avg * pos.size / pos.leverage
+        for o in acc.orders.values():
+            if o["orderStatus"] in _OPEN and not o["reduceOnly"]:
+                left = o["qty"] - o["cumExecQty"]
+                ord_im += left * (o["price"] or self.price(o["symbol"])) / acc.leverage.get(o["symbol"], 10.0)
+        return acc.wallet + upnl, upnl, pos_im, ord_im
+
+    # --- исполнение ---
+
+    def _fill(self, acc: SimAccount, o: Dict[str, Any], px: float, maker: bool) -> None:
+        sym, qty = o["symbol"], o["qty"] - o["cumExecQty"]
+        pos = acc.position(sym)
+        if o["reduceOnly"]:
+            qty = min(qty, pos.size)  # reduce-only не переворачивает позицию
+            o["qty"] = o["cumExecQty"] + qty
+        fee = px * qty * (self.maker_fee if maker else self.taker_fee)
+        acc.wallet -= fee
+        sign = 1 if o["side"] == "Buy" else -1
+        cur = pos.size * (1 if pos.side == "Buy" else -1)
+        new = cur + sign * qty
+        if cur != 0 and (cur > 0) != (sign > 0):
+            closed = min(abs(cur), qty)
+            pnl = (px - pos.avg) * closed * (1 if cur > 0 else -1)
+            acc.wallet += pnl
+            pos.realised += pnl - fee
+            acc.closed_pnl.append({
+                "symbol": sym, "orderId": o["orderId"], "side": o["side"], "qty": _s(o["qty"]),
+                "orderPrice": _s(o["price"]), "orderType": o["orderType"], "execType": "Trade",
+                "closedSize": _s(closed), "avgEntryPrice": _s(pos.avg), "cumEntryValue": _s(pos.avg * closed),
+                "avgExitPrice": _s(px), "cumExitValue": _s(px * closed), "closedPnl": _s(pnl - fee),
+                "fillCount": "1", "leverage": _s(pos.leverage),
+                "createdTime": str(o["createdTime"]), "updatedTime": str(self._t),
+            })
+            if abs(new) < 1e-12 or (new > 0) != (cur > 0):
+                pos.avg = px if abs(new) > 1e-12 else 0.0
+                pos.tp = pos.sl = pos.trailing = pos.active_price = pos.peak = 0.0
+        else:
+            pos.avg = (pos.avg * abs(cur) + px * qty) / abs(new) if new else 0.0
+            pos.realised -= fee
+        pos.size = abs(new)
+        pos.side = "" if pos.size < 1e-12 else ("Buy" if new > 0 else "Sell")
+        if pos.size > 0 and pos.created == 0:
+            pos.created = self._t
+        if pos.size < 1e-12:
+            pos.size, pos.created = 0.0, 0
+        if pos.size > 0 and not o["reduceOnly"]:
+            if o.get("takeProfit"):
+                pos.tp = o["takeProfit"]
+            if o.get("stopLoss"):
+                pos.sl = o["stopLoss"]
+        pos.updated = self._t
+        o.update(
+            cumExecQty=o["qty"], avgPrice=px, cumExecFee=o["cumExecFee"] + fee,
+            orderStatus="Filled", updatedTime=self._t,
+        )
+        acc.fills += 1
+
+    def _close_position(self, acc: SimAccount, pos: SimPosition, px: float, kind: str) -> None:
+        px = _round_to(px, self._specs[pos.symbol]["tick"])
+        o = self._new_order(acc, {
+            "symbol": pos.symbol, "side": "Sell" if pos.side == "Buy" else "Buy", "orderType": "Market",
+            "qty": pos.size, "reduceOnly": True, "stopOrderType": kind,
+        })
+        self._fill(acc, o, px, maker=False)
+        log_event(log, "SIM_TRIGGER", uid=acc.uid, symbol=pos.symbol, kind=kind, price=px)
+
+    def _match_segment(self, acc: SimAccount, sym: str, a: float, b: float) -> None:
+        lo, hi = min(a, b), max(a, b)
+        for o in list(acc.orders.values()):
+            if o["symbol"] != sym or o["orderStatus"] not in _OPEN:
+                continue
+            if o["orderStatus"] == "Untriggered":
+                tp = o["triggerPrice"]
+                rising = o["triggerDirection"] == 1 and b >= a
+                falling = o["triggerDirection"] == 2 and b <= a
+                if lo <= tp <= hi and (rising or falling):
+                    o["orderStatus"] = "New"
+                    if o["orderType"] == "Market":
+                        self._fill(acc, o, tp, maker=False)
+                continue
+            if o["orderType"] == "Limit" and lo <= o["price"] <= hi:
+                self._fill(acc, o, o["price"], maker=True)
+        pos = acc.positions.get(sym)
+        if pos is None or pos.size <= 0:
+            return
+        long = pos.side == "Buy"
+        down = b < a
+        # TP/SL: на падающем отрезке у лонга первым достигается SL, на растущем — TP (у шорта наоборот)
+        checks = [("StopLoss", pos.sl), ("TakeProfit", pos.tp)]
+        if down != long:
+            checks.reverse()
+        for kind, level in checks:
+            if level and lo <= level <= hi:
+                self._close_position(acc, pos, level, kind)
+                return
+        if pos.trailing > 0:
+            if pos.peak == 0.0 and (hi >= pos.active_price if long else lo <= pos.active_price):
+                pos.peak = pos.active_price
+            if pos.peak:
+                pos.peak = max(pos.peak, hi) if long else min(pos.peak, lo)
+                stop = pos.peak - pos.trailing if long else pos.peak + pos.trailing
+                if (b <= stop) if long else (b >= stop):
+                    self._close_position(acc, pos, stop, "TrailingStop")
+
+    def _sync(self) -> None:
+        t1 = self.now_ms()
+        if t1 <= self._t:
+            return
+        t0, self._t = self._t, t1
+        for acc in self._accounts.values():
+            active = {o["symbol"] for o in acc.orders.values() if o["orderStatus"] in _OPEN}
+            active |= {s for s, p in acc.positions.items() if p.size > 0}
+            for sym in active:
+                pts = self.series[sym].vertices(t0, t1)
+                for a, b in zip(pts, pts[1:]):
+                    self._match_segment(acc, sym, a, b)
+
+    # --- ордера ---
+
+    def _new_order(self, acc: SimAccount, p: Dict[str, Any]) -> Dict[str, Any]:
+        oid = f"sim-{next(self._ids):08d}"
+        o = {
+            "orderId": oid, "orderLinkId": p.get("orderLinkId") or "", "symbol": p["symbol"], "side": p["side"],
+            "orderType": p["orderType"], "price": _f(p.get("price")), "qty": _f(p.get("qty")), "cumExecQty": 0.0,
+            "avgPrice": 0.0, "cumExecFee": 0.0, "orderStatus": "New", "timeInForce": p.get("timeInForce") or "GTC",
+            "reduceOnly": str(p.get("reduceOnly")).lower() in ("true", "1"), "takeProfit": _f(p.get("takeProfit")),
+            "stopLoss": _f(p.get("stopLoss")), "triggerPrice": _f(p.get("triggerPrice")),
+            "triggerDirection": int(_f(p.get("triggerDirection"))), "stopOrderType": p.get("stopOrderType") or "",
+            "rejectReason": "EC_NoError", "createdTime": self._t, "updatedTime": self._t,
+        }
+        acc.orders[oid] = o
+        return o
+
+    def place(self, acc: SimAccount, p: Dict[str, Any]) -> Dict[str, Any]:
+        sym = p.get("symbol")
+        if sym not in self.series:
+            raise SimError(10001, f"params error: symbol invalid {sym}")
+        spec = self._specs[sym]
+        side = p.get("side")
+        if side not in ("Buy", "Sell"):
+            raise SimError(10001, "params error: side invalid")
+        qty = _f(p.get("qty"))
+        if qty < spec["min_qty"] or abs(_round_to(qty, spec["qty_step"]) - qty) > 1e-9:
+            raise SimError(
+                10001, f"The number of contracts exceeds minimum limit allowed (qtyStep {_s(spec['qty_step'])})"
+            )
+        if p.get("orderLinkId") and any(o["orderLinkId"] == p["orderLinkId"] for o in acc.orders.values()):
+            raise SimError(110072, "OrderLinkedID is duplicate")
+        otype = p.get("orderType", "Market")
+        bid, ask = self.quote(sym)
+        ref = _f(p.get("price")) if otype == "Limit" else (ask if side == "Buy" else bid)
+        reduce = str(p.get("reduceOnly")).lower() in ("true", "1")
+        pos = acc.positions.get(sym)
+        if reduce:
+            if pos is None or pos.size <= 0 or pos.side == side:
+                raise SimError(110017, "current position is zero, cannot fix reduce-only order qty")
+        elif ref * qty < spec["min_notional"]:
+            raise SimError(110094, "Order does not meet minimum order value 5USDT")
+        else:
+            equity, _, pos_im, ord_im = self._equity(acc)
+            need = ref * qty / acc.leverage.get(sym, 10.0) + ref * qty * self.taker_fee
+            if need > equity - pos_im - ord_im:
+                raise SimError(110007, "ab not enough for new order")
+        o = self._new_order(acc, p)
+        if o["triggerPrice"]:
+            o["orderStatus"] = "Untriggered"
+            if not o["triggerDirection"]:
+                o["triggerDirection"] = 1 if o["triggerPrice"] > self.price(sym) else 2
+            return o
+        tif = str(o["timeInForce"]).upper()
+        crosses = otype == "Market" or (o["price"] >= ask if side == "Buy" else o["price"] <= bid)
+        if crosses:
+            if tif in ("POSTONLY", "PO"):
+                o.update(orderStatus="Cancelled", rejectReason="EC_PostOnlyWillTakeLiquidity")
+            else:
+                self._fill(acc, o, ask if side == "Buy" else bid, maker=False)
+        elif tif in ("IOC", "FOK"):
+            o.update(orderStatus="Cancelled", rejectReason="EC_CancelForNoFullFill")
+        return o
+
+    def _find(self, acc: SimAccount, p: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if p.get("orderId"):
+            return acc.orders.get(p["orderId"])
+        if p.get("orderLinkId"):
+            return next((o for o in acc.orders.values() if o["orderLinkId"] == p["orderLinkId"]), None)
+        return None
+
+    def cancel(self, acc: SimAccount, p: Dict[str, Any]) -> Dict[str, Any]:
+        o = self._find(acc, p)
+        if o is None or o["orderStatus"] not in _OPEN:
+            raise SimError(110001, "order not exists or too late to cancel")
+        o.update(orderStatus="Cancelled", updatedTime=self._t)
+        return o
+
+    def amend(self, acc: SimAccount, p: Dict[str, Any]) -> Dict[str, Any]:
+        o = self._find(acc, p)
+        if o is None or o["orderStatus"] not in _OPEN:
+            raise SimError(110001, "order not exists or too late to replace")
+        for k in ("price", "qty", "takeProfit", "stopLoss", "triggerPrice"):
+            if p.get(k) not in (None, ""):
+                o[k] = _f(p[k])
+        o["updatedTime"] = self._t
+        bid, ask = self.quote(o["symbol"])
+        if o["orderType"] == "Limit" and o["orderStatus"] != "Untriggered" and (
+            o["price"] >= ask if o["side"] == "Buy" else o["price"] <= bid
+        ):
+            if str(o["timeInForce"]).upper() in ("POSTONLY", "PO"):
+                o.update(orderStatus="Cancelled", rejectReason="EC_PostOnlyWillTakeLiquidity")
+            else:
+                self._fill(acc, o, ask if o["side"] == "Buy" else bid, maker=False)
+        return o
+
+    def set_leverage(self, acc: SimAccount, p: Dict[str, Any]) -> None:
+        sym = p.get("symbol")
+        if sym not in self.series:
+            raise SimError(10001, f"params error: symbol invalid {sym}")
+        lev = _f(p.get("buyLeverage"))
+        if lev < 1 or lev > self.max_leverage or lev != _f(p.get("sellLeverage")):
+            raise SimError(10001, "leverage invalid")
+        if acc.leverage.get(sym, 10.0) == lev:
+            raise SimError(110043, "leverage not modified")
+        acc.leverage[sym] = lev
+        acc.position(sym).leverage = lev
+
+    def trading_stop(self, acc: SimAccount, p: Dict[str, Any]) -> None:
+        pos = acc.positions.get(p.get("symbol"))
+        if pos is None or pos.size <= 0:
+            raise SimError(10001, "can not set tp/sl/ts for zero position")
+        before = (pos.tp, pos.sl, pos.trailing, pos.active_price)
+        if p.get("takeProfit") not in (None, ""):
+            pos.tp = _f(p["takeProfit"])
+        if p.get("stopLoss") not in (None, ""):
+            pos.sl = _f(p["stopLoss"])
+        if p.get("trailingStop") not in (None, ""):
+            pos.trailing = _f(p["trailingStop"])
+            pos.active_price = _f(p.get("activePrice"))
+            # без activePrice трейлинг ведётся сразу от текущей цены
+            pos.peak = 0.0 if pos.active_price else self.price(pos.symbol)
+        if (pos.tp, pos.sl, pos.trailing, pos.active_price) == before:
+            raise SimError(34040, "not modified")
+        pos.updated = self._t
+
+    # --- представления v5 ---
+
+    def _order_row(self, o: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "orderId": o["orderId"], "orderLinkId": o["orderLinkId"], "symbol": o["symbol"], "side": o["side"],
+            "orderType": o["orderType"], "price": _s(o["price"]), "qty": _s(o["qty"]),
+            "cumExecQty": _s(o["cumExecQty"]), "leavesQty": _s(o["qty"] - o["cumExecQty"]),
+            "cumExecValue": _s(o["cumExecQty"] * o["avgPrice"]), "cumExecFee": _s(o["cumExecFee"]),
+            "avgPrice": _s(o["avgPrice"]) if o["avgPrice"] else "", "orderStatus": o["orderStatus"],
+            "timeInForce": o["timeInForce"], "reduceOnly": o["reduceOnly"], "closeOnTrigger": False,
+            "takeProfit": _s(o["takeProfit"]), "stopLoss": _s(o["stopLoss"]), "triggerPrice": _s(o["triggerPrice"]),
+            "triggerDirection": o["triggerDirection"], "stopOrderType": o["stopOrderType"], "positionIdx": 0,
+            "tpslMode": "Full", "rejectReason": o["rejectReason"], "category": "linear", "isLeverage": "",
+            "createdTime": str(o["createdTime"]), "updatedTime": str(o["updatedTime"]),
+        }
+
+    def _position_row(self, pos: SimPosition) -> Dict[str, Any]:
+        px = self.price(pos.symbol)
+        upnl = (px - pos.avg) * pos.size * (1 if pos.side == "Buy" else -1) if pos.size else 0.0
+        return {
+            "positionIdx": 0, "symbol": pos.symbol, "side": pos.side or "", "size": _s(pos.size),
+            "avgPrice": _s(pos.avg), "positionValue": _s(pos.avg * pos.size), "leverage": _s(pos.leverage),
+            "markPrice": _s(px), "liqPrice": "", "bustPrice": "", "positionIM": _s(pos.avg * pos.size / pos.leverage),
+            "positionMM": _s(pos.avg * pos.size * 0.005), "takeProfit": _s(pos.tp), "stopLoss": _s(pos.sl),
+            "trailingStop": _s(pos.trailing), "activePrice": _s(pos.active_price), "unrealisedPnl": _s(upnl),
+            "curRealisedPnl": _s(pos.realised), "cumRealisedPnl": _s(pos.realised), "tpslMode": "Full",
+            "tradeMode": 0, "riskId": 1, "autoAddMargin": 0, "positionStatus": "Normal", "isReduceOnly": False,
+            "seq": pos.updated, "createdTime": str(pos.created or self._t), "updatedTime": str(pos.updated or self._t),
+        }
+
+    def _instrument(self, sym: str) -> Dict[str, Any]:
+        spec = self._specs[sym]
+        return {
+            "symbol": sym, "contractType": "LinearPerpetual", "status": "Trading", "baseCoin": sym[:-4],
+            "quoteCoin": "USDT", "settleCoin": "USDT", "launchTime": "1600000000000", "deliveryTime": "0",
+            "deliveryFeeRate": "", "priceScale": str(max(0, -int(round(math.log10(spec["tick"]))))),
+            "leverageFilter": {"minLeverage": "1", "maxLeverage": _s(self.max_leverage), "leverageStep": "0.01"},
+            "priceFilter": {"minPrice": _s(spec["tick"]), "maxPrice": "1999999", "tickSize": _s(spec["tick"])},
+            "lotSizeFilter": {
+                "maxOrderQty": _s(spec["qty_step"] * 1e7), "minOrderQty": _s(spec["min_qty"]),
+                "qtyStep": _s(spec["qty_step"]), "postOnlyMaxOrderQty": _s(spec["qty_step"] * 1e7),
+                "maxMktOrderQty": _s(spec["qty_step"] * 1e6), "minNotionalValue": _s(spec["min_notional"]),
+            },
+            "unifiedMarginTrade": True, "fundingInterval": 480, "copyTrading": "both", "isPreListing": False,
+        }
+
+    def _ticker(self, sym: str) -> Dict[str, Any]:
+        s = self.series[sym]
+        px = self.price(sym)
+        bid, ask = self.quote(sym)
+        hi, lo, vol, turnover, prev = s.stats24h(self._t)
+        return {
+            "symbol": sym, "lastPrice": _s(px), "indexPrice": _s(px), "markPrice": _s(px),
+            "prevPrice24h": _s(prev), "price24hPcnt": _s((px / prev - 1.0) if prev else 0.0),
+            "highPrice24h": _s(max(hi, px)), "lowPrice24h": _s(min(lo, px)), "prevPrice1h": _s(px),
+            "openInterest": _s(vol / 10.0), "openInterestValue": _s(turnover / 10.0), "turnover24h": _s(turnover),
+            "volume24h": _s(vol), "fundingRate": "0.0001",
+            "nextFundingTime": str((self._t // 28_800_000 + 1) * 28_800_000),
+            "bid1Price": _s(bid), "bid1Size": _s(vol / 1000.0), "ask1Price": _s(ask), "ask1Size": _s(vol / 1000.0),
+        }
+
+    # --- маршрутизация ---
+
+    def handle(self, method: str, path: str, p: Dict[str, Any], uid: Optional[str]) -> Any:
+        """Запрос v5 → result (dict); SimError — ответ с retCode."""
+        with self._lock:
+            self._sync()
+            route = self._routes().get((method, path))
+            if route is None:
+                raise SimError(10001, f"simulator: {method} {path} is not implemented")
+            if not path.startswith("/v5/market/") and uid is None:
+                raise SimError(10003, "API key is invalid.")
+            return route(p, self.account(uid) if uid else None)
+
+    def _routes(self) -> Dict[Tuple[str, str], Callable[[Dict[str, Any], Optional[SimAccount]], Any]]:
+        return {
+            ("GET", "/v5/market/time"): lambda p, a: {
+                "timeSecond": str(int(time.time())), "timeNano": str(time.time_ns())},
+            ("GET", "/v5/market/instruments-info"): self._r_instruments,
+            ("GET", "/v5/market/tickers"): self._r_tickers,
+            ("GET", "/v5/market/kline"): self._r_kline,
+            ("GET", "/v5/user/query-api"): lambda p, a: {
+                "id": a.uid, "readOnly": 0, "unified": 1, "uta": 1, "isMaster": True, "permissions": {}},
+            ("GET", "/v5/account/info"): lambda p, a: {"unifiedMarginStatus": 6, "marginMode": "REGULAR_MARGIN"},
+            ("GET", "/v5/asset/coin/query-info"): lambda p, a: {"rows": [
+                {"name": "USDT", "coin": "USDT", "remainAmount": "1000000", "chains": []}]},
+            ("GET", "/v5/account/wallet-balance"): self._r_wallet,
+            ("GET", "/v5/position/list"): self._r_positions,
+            ("GET", "/v5/order/realtime"): self._r_open_orders,
+            ("GET", "/v5/order/history"): self._r_history,
+            ("GET", "/v5/position/closed-pnl"): self._r_closed_pnl,
+            ("POST", "/v5/order/create"): lambda p, a: self._ack(self.place(a, p)),
+            ("POST", "/v5/order/create-batch"): self._r_batch,
+            ("POST", "/v5/order/cancel"): lambda p, a: self._ack(self.cancel(a, p)),
+            ("POST", "/v5/order/amend"): lambda p, a: self._ack(self.amend(a, p)),
+            ("POST", "/v5/position/set-leverage"): lambda p, a: self.set_leverage(a, p) or {},
+            ("POST", "/v5/position/trading-stop"): lambda p, a: self.trading_stop(a, p) or {},
+        }
+
+    @staticmethod
+    def _ack(o: Dict[str, Any]) -> Dict[str, Any]:
+        return {"orderId": o["orderId"], "orderLinkId": o["orderLinkId"]}
+
+    def _r_instruments(self, p, a):
+        syms = [p["symbol"]] if p.get("symbol") else sorted(self.series)
+        rows = [self._instrument(s) for s in syms if s in self.series] if p.get("category") == "linear" else []
+        return {"category": p.get("category", ""), "list": rows, "nextPageCursor": ""}
+
+    def _r_tickers(self, p, a):
+        if p.get("category") != "linear":
+            return {"category": p.get("category", ""), "list": []}
+        syms = [p["symbol"]] if p.get("symbol") else sorted(self.series)
+        return {"category": "linear", "list": [self._ticker(s) for s in syms if s in self.series]}
+
+    def _r_kline(self, p, a):
+        sym, iv = p.get("symbol"), _INTERVALS.get(str(p.get("interval")))
+        if sym not in self.series:
+            raise SimError(10001, f"params error: symbol invalid {sym}")
+        s = self.series[sym]
+        if iv is None or iv < s.interval_ms or iv % s.interval_ms:
+            raise SimError(10001, f"simulator: interval {p.get('interval')} is not a multiple of the replayed candles")
+        limit = max(1, min(int(_f(p.get("limit"), 200)), 1000))
+        start = int(_f(p["start"])) if p.get("start") else None
+        end = int(_f(p["end"])) if p.get("end") else None
+        bars = s.bars(iv, self._t, start, end, limit)
+        return {"category": "linear", "symbol": sym, "list": [
+            [str(int(b[0])), _s(b[1]), _s(b[2]), _s(b[3]), _s(b[4]), _s(b[5]), _s(b[5] * b[4])] for b in bars]}
+
+    def _r_wallet(self, p, a):
+        equity, upnl, pos_im, ord_im = self._equity(a)
+        avail = equity - pos_im - ord_im
+        coin = {
+            "coin": "USDT", "equity": _s(equity), "usdValue": _s(equity), "walletBalance": _s(a.wallet),
+            "unrealisedPnl": _s(upnl), "cumRealisedPnl": _s(sum(x.realised for x in a.positions.values())),
+            "totalPositionIM": _s(pos_im), "totalOrderIM": _s(ord_im), "locked": "0", "borrowAmount": "0",
+            "availableToWithdraw": _s(max(avail, 0.0)), "marginCollateral": True, "collateralSwitch": True,
+        }
+        return {"list": [{
+            "accountType": "UNIFIED", "totalEquity": _s(equity), "totalWalletBalance": _s(a.wallet),
+            "totalMarginBalance": _s(equity), "totalAvailableBalance": _s(max(avail, 0.0)),
+            "totalPerpUPL": _s(upnl), "totalInitialMargin": _s(pos_im + ord_im),
+            "totalMaintenanceMargin": _s(pos_im * 0.05),
+            "accountIMRate": _s((pos_im + ord_im) / equity if equity else 0.0), "accountMMRate": "0", "coin": [coin],
+        }]}
+
+    def _r_positions(self, p, a):
+        if p.get("symbol"):
+            rows = [self._position_row(a.position(p["symbol"]))] if p["symbol"] in self.series else []
+        else:
+            rows = [self._position_row(x) for x in a.positions.values() if x.size > 0]
+        return {"category": "linear", "list": rows, "nextPageCursor": ""}
+
+    def _orders(self, a: SimAccount, p: Dict[str, Any], pred: Callable[[Dict[str, Any]], bool]) -> Dict[str, Any]:
+        one = self._find(a, p)
+        if p.get("orderId") or p.get("orderLinkId"):
+            rows = [one] if one is not None else []
+        else:
+            rows = [o for o in a.orders.values() if pred(o) and (not p.get("symbol") or o["symbol"] == p["symbol"])]
+        rows = sorted(rows, key=lambda o: o["createdTime"], reverse=True)[: int(_f(p.get("limit"), 50))]
+        return {"category": "linear", "list": [self._order_row(o) for o in rows], "nextPageCursor": ""}
+
+    def _r_open_orders(self, p, a):
+        return self._orders(a, p, lambda o: o["orderStatus"] in _OPEN)
+
+    def _r_history(self, p, a):
+        return self._orders(a, p, lambda o: o["orderStatus"] not in _OPEN)
+
+    def _r_closed_pnl(self, p, a):
+        start, end = int(_f(p.get("startTime"))), int(_f(p.get("endTime"), self._t))
+        rows = [
+            r for r in reversed(a.closed_pnl)
+            if start <= int(r["updatedTime"]) <= end and (not p.get("symbol") or r["symbol"] == p["symbol"])
+        ]
+        limit = max(1, min(int(_f(p.get("limit"), 50)), 100))
+        off = int(_f(p.get("cursor"))) if p.get("cursor") else 0
+        page = rows[off:off + limit]
+        cursor = str(off + limit) if off + limit < len(rows) else ""
+        return {"category": "linear", "list": page, "nextPageCursor": cursor}
+
+    def _r_batch(self, p, a):
+        rows, infos = [], []
+        for req in p.get("request") or []:
+            try:
+                o = self.place(a, req)
+                rows.append({"category": "linear", "symbol": o["symbol"], "orderId": o["orderId"],
+                             "orderLinkId": o["orderLinkId"], "createAt": str(o["createdTime"])})
+                infos.append({"code": 0, "msg": "OK"})
+            except SimError as e:
+                rows.append({"category": "linear", "symbol": req.get("symbol", ""), "orderId": "",
+                             "orderLinkId": req.get("orderLinkId", ""), "createAt": ""})
+                infos.append({"code": e.code, "msg": e.msg})
+        return {"list": rows}, {"list": infos}
+
+    def state(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sync()
+            return {
+                "now_ms": self._t,
+                "symbols": len(self.series),
+                "accounts": {
+                    uid: {
+                        "equity": round(self._equity(acc)[0], 4),
+                        "positions": {
+                            s: f"{x.side} {_s(x.size)} @ {_s(x.avg)}" for s, x in acc.positions.items() if x.size > 0
+                        },
+                        "open_orders": sum(1 for o in acc.orders.values() if o["orderStatus"] in _OPEN),
+                        "fills": acc.fills,
+                    }
+                    for uid, acc in self._accounts.items()
+                },
+            }
+
+
+# ---------------------------------------------------------------------
+# HTTP
+# ---------------------------------------------------------------------
+@dataclass
+class Faults:
+    """Задержка и инъекция ошибок: latency_ms + экспоненциальный хвост jitter_ms; доли 10006 / HTTP 429."""
+
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    p_10006: float = 0.0
+    p_429: float = 0.0
+    seed: int = 0
+    rate_limits: bool = True
+    _rng: random.Random = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._rng = random.Random(self.seed)
+        self._lock = threading.Lock()
+
+    def draw(self) -> Tuple[float, float]:
+        with self._lock:
+            delay = self.latency_ms + (self._rng.expovariate(1.0 / self.jitter_ms) if self.jitter_ms > 0 else 0.0)
+            return delay / 1000.0, self._rng.random()
+
+
+class SimServer:
+    """HTTP-обёртка BybitSim: ThreadingHTTPServer, клиенты ccxt ходят через BYBIT_API_URL=<url>."""
+
+    def __init__(self, sim: BybitSim, faults: Optional[Faults] = None, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.sim = sim
+        self.faults = faults or Faults()
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._ip = TokenBucket(_IP_RATE, _IP_BURST)
+        self._blk = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "SimServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="bybit-sim", daemon=True)
+        self._thread.start()
+        log_event(log, "SIM_START", url=self.url, symbols=len(self.sim.series), speed=self.sim.speed)
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _limited(self, uid: Optional[str], path: str) -> Optional[Dict[str, str]]:
+        """None — в лимите; иначе заголовки ответа 10006."""
+        rate = _UID_LIMITS.get(path)
+        if not self.faults.rate_limits or uid is None or rate is None:
+            return None
+        with self._blk:
+            b = self._buckets.get((uid, path))
+            if b is None:
+                b = self._buckets[(uid, path)] = TokenBucket(rate, rate)
+        if b.try_acquire():
+            return None
+        return {"X-Bapi-Limit": str(int(rate)), "X-Bapi-Limit-Status": "0",
+                "X-Bapi-Limit-Reset-Timestamp": str(int(time.time() * 1000) + 1000)}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _send(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+                body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _dispatch(self, method: str) -> None:
+                parts = urlsplit(self.path)
+                params: Dict[str, Any] = dict(parse_qsl(parts.query, keep_blank_values=True))
+                if method == "POST":
+                    n = int(self.headers.get("Content-Length") or 0)
+                    raw = self.rfile.read(n) if n else b""
+                    try:
+                        params.update(json.loads(raw or b"{}"))
+                    except ValueError:
+                        return self._send(200, {"retCode": 10001, "retMsg": "request body is not JSON", "result": {}})
+                path = parts.path
+                with server._blk:
+                    server.requests[path] = server.requests.get(path, 0) + 1
+                if path.startswith("/sim/"):
+                    return self._control(method, path, params)
+
+                delay, roll = server.faults.draw()
+                if delay > 0:
+                    time.sleep(delay)
+                now = int(time.time() * 1000)
+                if not server._ip.try_acquire() or roll < server.faults.p_429:
+                    return self._send(429, {"retCode": 10006, "retMsg": "Too many visits!", "result": {}})
+                uid = self.headers.get("X-BAPI-API-KEY")
+                ts = self.headers.get("X-BAPI-TIMESTAMP")
+                window = _f(self.headers.get("X-BAPI-RECV-WINDOW"), 5000)
+                if uid and ts and server.sim.check_recv_window and not (now - window <= int(_f(ts)) < now + 1000):
+                    return self._send(200, {
+                        "retCode": 10002, "time": now, "result": {},
+                        "retMsg": f"invalid request, please check your server timestamp or recv_window param. "
+                                  f"req_timestamp[{ts}],server_timestamp[{now}],recv_window[{int(window)}]",
+                    })
+                limited = server._limited(uid, path)
+                if limited is not None or (uid and roll < server.faults.p_429 + server.faults.p_10006):
+                    return self._send(200, {"retCode": 10006, "retMsg": "Too many visits!", "result": {}, "time": now},
+                                      limited)
+                try:
+                    result = server.sim.handle(method, path, params, uid)
+                except SimError as e:
+                    return self._send(
+                        200, {"retCode": e.code, "retMsg": e.msg, "result": {}, "retExtInfo": {}, "time": now}
+                    )
+                except Exception as e:  # баг симулятора — 500, как у биржи при внутренней ошибке
+                    log.exception("[SIM] %s %s: %s", method, path, e)
+                    return self._send(500, {"retCode": 10016, "retMsg": f"simulator error: {e}", "result": {}})
+                ext: Dict[str, Any] = {}
+                if isinstance(result, tuple):
+                    result, ext = result
+                self._send(200, {"retCode": 0, "retMsg": "OK", "result": result, "retExtInfo": ext, "time": now})
+
+            def _control(self, method: str, path: str, params: Dict[str, Any]) -> None:
+                if method == "GET" and path == "/sim/state":
+                    return self._send(200, {**server.sim.state(), "requests": dict(server.requests)})
+                if method == "POST" and path == "/sim/advance":
+                    bars = _f(params.get("bars"))
+                    base_ms = min((s.interval_ms for s in server.sim.series.values()), default=0)
+                    ms = _f(params.get("ms")) + bars * base_ms
+                    return self._send(200, {"now_ms": server.sim.advance(int(ms))})
+                self._send(404, {"error": f"unknown control endpoint {path}"})
+
+            def do_GET(self) -> None:
+                self._dispatch("GET")
+
+            def do_POST(self) -> None:
+                self._dispatch("POST")
+
+        return Handler
+
+
+def build_series(
+    symbols: Iterable[str] = (),
+    candles: Optional[str] = None,
+    interval: str = "60",
+    bars: int = 5000,
+    seed: int = 0,
+) -> Dict[str, Series]:
+    """
+    Свечи для симулятора: candles — папка *.csv или кассета core.cassette (*.jsonl[.gz]);
+    символы без данных (и всё, если candles не задан) — синтетика с фиксированным seed.
+    """
+    default_iv = _INTERVALS[interval]
+    loaded: Dict[str, List[List[float]]] = {}
+    if candles:
+        loaded = load_csv_dir(candles) if os.path.isdir(candles) else load_cassette_klines(candles)
+    out = {sym: Series(sym, rows, _interval_of(rows, default_iv)) for sym, rows in loaded.items()}
+    for sym in symbols:
+        sym = sym.strip().upper().replace("/", "").split(":", 1)[0]
+        if sym and sym not in out:
+            out[sym] = Series(sym, synthetic_candles(sym, bars, default_iv, seed), default_iv)
+    return out
@@ -1,46 +1,179 @@
 import base64
+import gzip
+import hashlib
+import json
+import logging
 import os
-from datetime import datetime
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
 
 import requests
 
+from .trade_log import FIELDS, flush_trade_log
 
-def upload_trades_to_github(file_path: str = "logs/trades.csv") -> None:
-    """Заливает trades.csv в GitHub через Contents API (без git push)."""
+log = logging.getLogger(__name__)
+
+_LEGACY_HEADER = "ts,pair,signal,confidence,price,tp,sl,dry_run"
+_NEW_HEADER = ",".join(FIELDS)
+
+
+def _row_day(line: str) -> Optional[str]:
+    """UTC-день строки trades.csv (ts — epoch в новом формате, ISO в старом); None — заголовок/мусор."""
+    head = line.split(",", 1)[0].strip()
+    if not head or head == "ts":
+        return None
+    try:
+        dt = datetime.fromtimestamp(float(head), tz=timezone.utc)
+    except ValueError:
+        try:
+            dt = datetime.fromisoformat(head)
+        except ValueError:
+            return None
+    return dt.strftime("%Y-%m-%d")
+
+
+def split_daily_segments(file_path: str) -> Dict[str, bytes]:
+    """
+    Режет trades.csv на суточные сегменты {YYYY-MM-DD: csv-байты с заголовком}.
+    Строки с переносами внутри кавычек приклеиваются к своей записи.
+    """
+    days: Dict[str, List[str]] = {}
+    current: Optional[List[str]] = None
+    with open(file_path, encoding="utf-8", newline="") as f:
+        for line in f:
+            day = _row_day(line)
+            if day is None:
+                if current is not None and line.strip() and not line.startswith("ts,"):
+                    current.append(line)  # продолжение многострочного поля
+                continue
+            current = days.setdefault(day, [])
+            current.append(line)
+    out = {}
+    for day, lines in days.items():
+        first = lines[0].split(",", 1)[0]
+        header = _NEW_HEADER if _is_float(first) else _LEGACY_HEADER
+        out[day] = (header + "\r\n" + "".join(lines)).encode("utf-8")
+    return out
+
+
+def _is_float(v: str) -> bool:
+    try:
+        float(v)
+        return True
+    except ValueError:
+        return False
+
+
+class GitHubUploader:
+    """
+    Выгрузка trade-log в репозиторий через Contents API суточными gzip-сегментами.
+    Локальный кэш (hash содержимого + sha файла в GitHub) позволяет пропускать неизменившиеся
+    сегменты и не делать GET за sha перед PUT. Обычно перезаливается только сегмент текущих суток.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        repo: str,
+        *,
+        branch: str = "main",
+        api_url: Optional[str] = None,
+        remote_dir: Optional[str] = None,
+        cache_path: Optional[str] = None,
+        session: Optional[requests.Session] = None,
+    ) -> None:
+        self.repo = repo
+        self.branch = branch
+        self.api_url = (api_url or os.getenv("GITHUB_API_URL", "https://api.github.com")).rstrip("/")
+        self.remote_dir = (remote_dir or os.getenv("GITHUB_UPLOAD_DIR", "logs/segments")).strip("/")
+        self.cache_path = Path(cache_path or os.getenv("GITHUB_UPLOAD_CACHE", "logs/.github_upload.json"))
+        self.session = session or requests.Session()
+        self.session.headers.update({"Authorization": f"token {token}", "Accept": "application/vnd.github+json"})
+        self._cache = self._load_cache()
+
+    def _load_cache(self) -> Dict[str, Dict[str, str]]:
+        try:
+            return json.loads(self.cache_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_cache(self) -> None:
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._cache, indent=1, sort_keys=True), encoding="utf-8")
+        os.replace(tmp, self.cache_path)
+
+    def _url(self, remote: str) -> str:
+        return f"{self.api_url}/repos/{self.repo}/contents/{remote}"
+
+    def _remote_sha(self, remote: str) -> Optional[str]:
+        r = self.session.get(self._url(remote), params={"ref": self.branch}, timeout=20)
+        return r.json().get("sha") if r.status_code == 200 else None
+
+    def put(self, remote: str, payload: bytes, sha: Optional[str]) -> Optional[str]:
+        """PUT файла; при устаревшем/неизвестном sha (409/422) — один GET за актуальным и повтор."""
+        data = {
+            "message": f"update({remote}) {datetime.now(timezone.utc).isoformat()}",
+            "content": base64.b64encode(payload).decode("ascii"),
+            "branch": self.branch,
+        }
+        for attempt in range(2):
+            if sha:
+                data["sha"] = sha
+            else:
+                data.pop("sha", None)
+            r = self.session.put(self._url(remote), json=data, timeout=30)
+            if r.status_code in (200, 201):
+                return (r.json().get("content") or {}).get("sha")
+            if r.status_code in (409, 422) and attempt == 0:
+                sha = self._remote_sha(remote)
+                continue
+            log.error("❌ upload error %s %s: %s", remote, r.status_code, r.text[:300])
+            return None
+        return None
+
+    def upload_file(self, file_path: str) -> Dict[str, List[str]]:
+        uploaded, skipped, failed = [], [], []
+        for day, raw in sorted(split_daily_segments(file_path).items()):
+            remote = f"{self.remote_dir}/{Path(file_path).stem}-{day}.csv.gz"
+            digest = hashlib.sha256(raw).hexdigest()
+            entry = self._cache.get(remote) or {}
+            if entry.get("hash") == digest:
+                skipped.append(remote)
+                continue
+            # mtime=0 — одинаковое содержимое даёт одинаковый gzip
+            sha = self.put(remote, gzip.compress(raw, mtime=0), entry.get("sha"))
+            if sha is None:
+                failed.append(remote)
+                continue
+            self._cache[remote] = {"hash": digest, "sha": sha}
+            uploaded.append(remote)
+            self._save_cache()
+        return {"uploaded": uploaded, "skipped": skipped, "failed": failed}
+
+
+def upload_trades_to_github(file_path: str = "logs/trades.csv") -> Optional[Dict[str, List[str]]]:
+    """
+    Заливает trades.csv в GitHub через Contents API (без git push) суточными gzip-сегментами:
+    неизменившиеся сегменты пропускаются по hash, sha берётся из локального кэша.
+    """
     token = os.getenv("GITHUB_TOKEN")
     repo = os.getenv("GITHUB_REPO")
     branch = os.getenv("GITHUB_BRANCH", "main")
 
     if not token or not repo:
-        print("❌ GITHUB_TOKEN или GITHUB_REPO не заданы — пропуск загрузки")
-        return
+        log.warning("❌ GITHUB_TOKEN или GITHUB_REPO не заданы — пропуск загрузки")
+        return None
+
+    # фоновый писатель trade-log мог ещё не дописать очередь
+    flush_trade_log()
 
     if not os.path.exists(file_path):
-        print(f"⚠️ Файл {file_path} не найден — пропуск")
-        return
-
-    url = f"https://api.github.com/repos/{repo}/contents/{file_path}"
-    headers = {"Authorization": f"token {token}"}
-
-    # читаем локальный файл
-    with open(file_path, "rb") as f:
-        content = f.read()
-    encoded = base64.b64encode(content).decode("utf-8")
-
-    # получаем sha, если файл уже есть
-    r = requests.get(url, headers=headers, timeout=20)
-    sha = r.json().get("sha") if r.status_code == 200 else None
-
-    data = {
-        "message": f"update({file_path}) {datetime.utcnow().isoformat()}",
-        "content": encoded,
-        "branch": branch,
-    }
-    if sha:
-        data["sha"] = sha
-
-    r = requests.put(url, headers=headers, json=data, timeout=30)
-    if r.status_code in (200, 201):
-        print(f"✅ {file_path} загружен в GitHub")
-    else:
-        print(f"❌ upload error {r.status_code}: {r.text}")
+        log.warning("⚠️ Файл %s не найден — пропуск", file_path)
+        return None
+
+    res = GitHubUploader(token, repo, branch=branch).upload_file(file_path)
+    log.info("✅ %s → GitHub: uploaded=%d skipped=%d failed=%d",
+             file_path, len(res["uploaded"]), len(res["skipped"]), len(res["failed"]))
+    return res
@@ -1,5 +1,6 @@
 from typing import Dict, List
-from core.bybit_exchange import create_exchange
+from core.bybit_exchange import get_exchange
+from core.candle_cache import fetch_ohlcv_cached
 
 
 def _sma(values: List[float], period: int) -> float:
@@ -119,8 +120,8 @@ def compute_snapshot(symbol: str, timeframe: str = "5m", limit: int = 200) -> Di
     Возвращает краткий набор индикаторов для дальнейшего анализа или логирования:
     EMA12, EMA26, MACD, MACD‑signal (по сигнальной EMA9), RSI14, Bollinger Bands и текущее закрытие.
     """
-    ex = create_exchange()
-    ohlcv = ex.fetch_ohlcv(symbol, timeframe=timeframe, limit=limit)
+    ex = get_exchange()
+    ohlcv = fetch_ohlcv_cached(ex, symbol, timeframe, limit)
     closes = [float(c[4]) for c in ohlcv]
 
     if len(closes) < 60:
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .accounts import ACCOUNT
+
+# Корреляция: id цикла guard'а и текущая пара (контекст потока, попадает в каждую запись)
+CYCLE_ID: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("cycle_id", default=None)
+PAIR: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("pair", default=None)
+
+_CYCLE_SEQ = itertools.count(1)
+_RESERVED = frozenset({"ts", "level", "logger", "msg", "cycle", "pair", "account", "sampled", "exc"})
+_LISTENER: Optional[logging.handlers.QueueListener] = None
+_SETUP_LOCK = threading.Lock()
+
+
+def new_cycle_id() -> str:
+    """Новый id цикла (pid-номер), ставится в контекст; пара сбрасывается."""
+    cid = f"{os.getpid():x}-{next(_CYCLE_SEQ)}"
+    CYCLE_ID.set(cid)
+    PAIR.set(None)
+    return cid
+
+
+def bind_pair(symbol: Optional[str]) -> None:
+    PAIR.set(symbol)
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, **fields: Any) -> None:
+    """Структурная запись: event — короткое имя (TS_CALL, ENTRY_STATS), поля — в JSON как есть."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который в потоке вызывающего делает минимум: подставляет аргументы в строку,
+    снимает контекст (cycle/pair/account) и кладёт запись в очередь. JSON и I/O — в потоке listener'а.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.cycle_id = CYCLE_ID.get()
+        record.pair = PAIR.get()
+        record.account = ACCOUNT.get()
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SampleFilter(logging.Filter):
+    """
+    Прореживание частых DEBUG-строк: из каждых every записей с одним и тем же шаблоном
+    (logger + msg) пропускается одна. INFO и выше не трогаются.
+    """
+
+    def __init__(self, every: int = 10) -> None:
+        super().__init__()
+        self.every = max(1, int(every))
+        self._seen: Dict[tuple, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.every == 1:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else id(record.msg))
+        n = self._seen.get(key, 0)
+        self._seen[key] = n + 1
+        if n % self.every:
+            return False
+        if n:
+            record.sampled = self.every
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out: Dict[str, Any] = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        cid = getattr(record, "cycle_id", None)
+        if cid:
+            out["cycle"] = cid
+        pair = getattr(record, "pair", None)
+        if pair:
+            out["pair"] = pair
+        account = getattr(record, "account", None)
+        if account:
+            out["account"] = account
+        fields = getattr(record, "fields", None)
+        if fields:
+            for k, v in fields.items():
+                out[f"field_{k}" if k in _RESERVED else k] = v
+        if getattr(record, "sampled", None):
+            out["sampled"] = record.sampled
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Человекочитаемый вариант для локального запуска (LOG_FORMAT=text)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        parts = [time.strftime("%H:%M:%S", time.localtime(record.created)), record.getMessage()]
+        fields = getattr(record, "fields", None)
+        if fields:
+            parts.append(" ".join(f"{k}={v}" for k, v in fields.items()))
+        pair = getattr(record, "pair", None)
+        if pair:
+            parts.insert(1, f"[{pair}]")
+        account = getattr(record, "account", None)
+        if account:
+            parts.insert(1, f"<{account}>")
+        if record.exc_text:
+            parts.append("\n" + record.exc_text)
+        return " ".join(parts)
+
+
+def setup_logging(
+    *,
+    level: Optional[str] = None,
+    fmt: Optional[str] = None,
+    log_file: Optional[str] = None,
+    stream=None,
+) -> logging.Logger:
+    """
+    Корневой логгер → QueueHandler; один QueueListener пишет в stdout (JSON или text)
+    и в один RotatingFileHandler (LOG_FILE, по умолчанию logs/guard.log; пусто — без файла).
+    Повторный вызов ничего не делает.
+    """
+    global _LISTENER
+    root = logging.getLogger()
+    with _SETUP_LOCK:
+        if _LISTENER is not None:
+            return root
+        level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+        fmt = (fmt or os.getenv("LOG_FORMAT", "json")).lower()
+        log_file = os.getenv("LOG_FILE", "logs/guard.log") if log_file is None else log_file
+
+        handlers = []
+        console = logging.StreamHandler(stream or sys.stdout)
+        console.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+        handlers.append(console)
+        if log_file:
+            Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+            fh = logging.handlers.RotatingFileHandler(
+                log_file,
+                maxBytes=int(os.getenv("LOG_FILE_MAX_MB", "20")) * 1024 * 1024,
+                backupCount=int(os.getenv("LOG_FILE_BACKUPS", "5")),
+                encoding="utf-8",
+            )
+            fh.setFormatter(JsonFormatter())
+            handlers.append(fh)
+
+        q: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        qh = _ContextQueueHandler(q)
+        qh.addFilter(SampleFilter(int(os.getenv("LOG_DEBUG_SAMPLE", "10"))))
+        for h in list(root.handlers):
+            root.removeHandler(h)
+        root.addHandler(qh)
+        root.setLevel(level)
+        # болтливые библиотеки — только предупреждения
+        for noisy in ("urllib3", "ccxt", "ccxt.base.exchange"):
+            logging.getLogger(noisy).setLevel(logging.WARNING)
+
+        _LISTENER = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+        _LISTENER.start()
+        atexit.register(shutdown_logging)
+    return root
+
+
+def shutdown_logging() -> None:
+    """Дописать очередь и остановить listener (вызывается при выходе)."""
+    global _LISTENER
+    with _SETUP_LOCK:
+        listener, _LISTENER = _LISTENER, None
+    if listener is not None:
+        listener.stop()
+        for h in listener.handlers:
+            try:
+                h.flush()
+                h.close()
+            except Exception:
+                pass
@@ -0,0 +1,457 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .cassette import offline
+from .config import get_config
+from .logging_setup import log_event
+from .order_prep import OrderPlan
+from .order_tracker import OrderTracker
+from .rate_limiter import TokenBucket
+from .rounding import get_rounding_table, round_price
+
+log = logging.getLogger(__name__)
+
+# Сколько ждать финального статуса лимита после отмены, прежде чем добирать остаток
+_CANCEL_SETTLE_S = 5.0
+
+# (bid, ask) — лучшая цена на покупку/продажу
+Touch = Tuple[float, float]
+
+
+# ---------------------------------------------------------------------
+# Источники стакана (top of book)
+# ---------------------------------------------------------------------
+class BookSource:
+    """Поток обновлений лучших цен. next_update ждёт следующее изменение (или None по таймауту)."""
+
+    def start(self, symbol: str) -> None:
+        pass
+
+    def next_update(self, timeout: float) -> Optional[Touch]:
+        raise NotImplementedError
+
+    def stop(self) -> None:
+        pass
+
+
+class CcxtProBookSource(BookSource):
+    """watch_order_book (ccxt.pro) в фоне: событие на каждое изменение лучших цен."""
+
+    def __init__(self, depth: int = 1) -> None:
+        self.depth = depth
+        self._q: "queue.Queue[Touch]" = queue.Queue()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    async def _run(self, symbol: str) -> None:
+        import ccxt.pro as ccxtpro  # type: ignore
+
+        ex = ccxtpro.bybit({"options": {"defaultType": "swap"}})
+        last: Optional[Touch] = None
+        try:
+            while not self._stop.is_set():
+                ob = await ex.watch_order_book(symbol, limit=max(self.depth, 1))
+                if not ob.get("bids") or not ob.get("asks"):
+                    continue
+                touch = (float(ob["bids"][0][0]), float(ob["asks"][0][0]))
+                if touch != last:
+                    last = touch
+                    self._q.put(touch)
+        finally:
+            await ex.close()
+
+    def start(self, symbol: str) -> None:
+        def _target():
+            try:
+                asyncio.run(self._run(symbol))
+            except Exception as e:
+                log.warning("[MAKER] book stream stopped: %s", e)
+
+        self._thread = threading.Thread(target=_target, name="maker-book", daemon=True)
+        self._thread.start()
+
+    def next_update(self, timeout: float) -> Optional[Touch]:
+        try:
+            touch = self._q.get(timeout=max(timeout, 0.0))
+        except queue.Empty:
+            return None
+        # Догоняем очередь: нужна только самая свежая цена
+        while True:
+            try:
+                touch = self._q.get_nowait()
+            except queue.Empty:
+                return touch
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+class PollingBookSource(BookSource):
+    """Фолбэк без WS: fetch_ticker не чаще раза в interval_s; отдаёт только изменившиеся цены."""
+
+    def __init__(self, ex, interval_s: float = 0.25) -> None:
+        self.ex = ex
+        self.interval_s = interval_s
+        self._symbol = ""
+        self._last: Optional[Touch] = None
+        self._next = 0.0
+
+    def start(self, symbol: str) -> None:
+        self._symbol = symbol
+        self._next = 0.0
+
+    def next_update(self, timeout: float) -> Optional[Touch]:
+        deadline = time.time() + timeout
+        while True:
+            wait_s = self._next - time.time()
+            if wait_s > 0:
+                if time.time() + wait_s > deadline:
+                    time.sleep(max(deadline - time.time(), 0.0))
+                    return None
+                time.sleep(wait_s)
+            self._next = time.time() + self.interval_s
+            t = self.ex.fetch_ticker(self._symbol)
+            bid, ask = t.get("bid"), t.get("ask")
+            if bid and ask:
+                touch = (float(bid), float(ask))
+                if touch != self._last:
+                    self._last = touch
+                    return touch
+            if time.time() >= deadline:
+                return None
+
+
+# ---------------------------------------------------------------------
+# Локальный симулятор стакана + исполнения (для тестов и офлайна)
+# ---------------------------------------------------------------------
+class LocalBookSim(BookSource):
+    """
+    Проигрывает заданную последовательность (bid, ask) и исполняет ордера против неё:
+    лимитный buy по p исполняется, когда ask <= p; sell — когда bid >= p.
+    Post-only, который пересёк бы спред, отклоняется (status=canceled), IOC исполняется
+    сразу или отменяется, market — по текущей лучшей цене.
+    Реализует нужную движку часть API биржи: create/edit/cancel/fetch_order, markets.
+    """
+
+    def __init__(self, symbol: str, updates: Iterable[Touch], *, tick: float = 0.01, step: float = 0.001,
+                 step_s: float = 0.0, on_order_update=None) -> None:
+        self.symbol = symbol
+        self._updates = list(updates)
+        self._pos = 0
+        self.bid, self.ask = self._updates[0]
+        self.step_s = step_s
+        self.on_order_update = on_order_update
+        self.orders: Dict[str, Dict[str, Any]] = {}
+        self.calls: List[str] = []
+        self._ids = itertools.count(1)
+        self.markets = {
+            symbol: {
+                "id": symbol.split("/")[0] + "USDT",
+                "symbol": symbol,
+                "linear": True,
+                "swap": True,
+                "settle": "USDT",
+                "precision": {"price": tick, "amount": step},
+                "limits": {"amount": {"min": step}, "cost": {"min": 0}},
+            }
+        }
+
+    # --- BookSource ---
+    def next_update(self, timeout: float) -> Optional[Touch]:
+        if self._pos + 1 >= len(self._updates):
+            time.sleep(min(timeout, 0.01))
+            return None
+        if self.step_s:
+            time.sleep(min(self.step_s, timeout))
+        self._pos += 1
+        self.bid, self.ask = self._updates[self._pos]
+        self._match()
+        return self.bid, self.ask
+
+    # --- исполнение ---
+    def _emit(self, o: Dict[str, Any]) -> None:
+        if self.on_order_update is not None:
+            self.on_order_update(dict(o))
+
+    def _fill(self, o: Dict[str, Any], px: float) -> None:
+        o.update(status="closed", filled=o["amount"], remaining=0.0, average=px)
+        self._emit(o)
+
+    def _match(self) -> None:
+        for o in self.orders.values():
+            if o["status"] != "open" or o["type"] != "limit":
+                continue
+            if o["side"] == "buy" and self.ask <= o["price"]:
+                self._fill(o, o["price"])
+            elif o["side"] == "sell" and self.bid >= o["price"]:
+                self._fill(o, o["price"])
+
+    def market(self, symbol: str) -> Dict[str, Any]:
+        return self.markets[symbol]
+
+    def price_to_precision(self, symbol: str, price: float) -> str:
+        return str(round_price(self, symbol, price))
+
+    def create_order(self, symbol, type, side, amount, price=None, params=None):
+        self.calls.append("create")
+        params = params or {}
+        tif = str(params.get("timeInForce") or "").upper()
+        oid = str(next(self._ids))
+        o = {"id": oid, "symbol": symbol, "type": type, "side": side, "amount": float(amount),
+             "price": price, "filled": 0.0, "remaining": float(amount), "status": "open", "average": None}
+        self.orders[oid] = o
+        crosses = (side == "buy" and price is not None and price >= self.ask) or (
+            side == "sell" and price is not None and price <= self.bid
+        )
+        if type == "market":
+            self._fill(o, self.ask if side == "buy" else self.bid)
+        elif params.get("postOnly") or tif in ("PO", "POSTONLY"):
+            if crosses:
+                o["status"] = "canceled"
+                self._emit(o)
+            else:
+                self._emit(o)
+        elif tif == "IOC":
+            if crosses:
+                self._fill(o, self.ask if side == "buy" else self.bid)
+            else:
+                o["status"] = "canceled"
+                self._emit(o)
+        else:
+            self._match()
+        return dict(o)
+
+    def edit_order(self, id, symbol, type, side, amount=None, price=None, params=None):
+        self.calls.append("amend")
+        o = self.orders[id]
+        if o["status"] != "open":
+            raise RuntimeError(f"order {id} not open: {o['status']}")
+        o["price"] = price
+        if (side == "buy" and price >= self.ask) or (side == "sell" and price <= self.bid):
+            # post-only, который стал бы тейкером, биржа отменяет
+            o["status"] = "canceled"
+            self._emit(o)
+        return dict(o)
+
+    def cancel_order(self, id, symbol=None, params=None):
+        self.calls.append("cancel")
+        o = self.orders[id]
+        if o["status"] == "open":
+            o["status"] = "canceled"
+            self._emit(o)
+        return dict(o)
+
+    def fetch_order(self, id, symbol=None, params=None):
+        self.calls.append("fetch_order")
+        return dict(self.orders[id])
+
+
+# ---------------------------------------------------------------------
+# Движок maker-входа
+# ---------------------------------------------------------------------
+def _bound(ex, plan: OrderPlan, slippage_bps: float) -> float:
+    """Худшая допустимая цена входа относительно цены сигнала."""
+    k = slippage_bps / 10_000.0
+    if plan.side == "buy":
+        return round_price(ex, plan.symbol, plan.price * (1.0 + k), "down")
+    return round_price(ex, plan.symbol, plan.price * (1.0 - k), "up")
+
+
+def _floor_qty(ex, sym: str, qty: float) -> float:
+    rules = get_rounding_table(ex).get(sym)
+    return rules.floor_qty(qty) if rules is not None else float(ex.amount_to_precision(sym, qty))
+
+
+def maker_entry(
+    ex,
+    plan: OrderPlan,
+    book: BookSource,
+    *,
+    tracker: Optional[OrderTracker] = None,
+    slippage_bps: Optional[float] = None,
+    timeout_s: Optional[float] = None,
+    amend_bucket: Optional[TokenBucket] = None,
+    fallback: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Post-only лимит на лучшей цене своей стороны (bid для buy, ask для sell) и перестановка
+    на каждое обновление стакана, пока ордер не исполнится или цена не уйдёт за
+    LIMIT_SLIPPAGE_BPS от цены сигнала. Затем остаток добирается IOC по границе
+    (MAKER_FALLBACK=ioc) или рынком (market).
+    Перестановки ограничены amend_bucket (MAKER_AMEND_RPS), статус ордера берём из потока
+    трекера, а без потока — опросом не чаще раза в секунду.
+    """
+    sym = plan.symbol
+    side = plan.side
+    buy = side == "buy"
+    mc = get_config().maker
+    slippage_bps = mc.slippage_bps if slippage_bps is None else slippage_bps
+    timeout_s = mc.timeout_s if timeout_s is None else timeout_s
+    fallback = (fallback or mc.fallback).lower()
+    if amend_bucket is None:
+        amend_bucket = TokenBucket(rate=mc.amend_rps, burst=2)
+
+    bound = _bound(ex, plan, slippage_bps)
+    params = {"takeProfit": plan.tp, "stopLoss": plan.sl}
+    stats = {"reprices": 0, "rejects": 0, "placed": 0}
+
+    order: Optional[Dict[str, Any]] = None  # текущий живой лимит
+    order_qty = 0.0  # его полный объём при выставлении (amend v5 принимает qty целиком, не остаток)
+    last_order: Optional[Dict[str, Any]] = None
+    done = False
+    our_px: Optional[float] = None
+    filled = 0.0
+    notional = 0.0
+    last_poll = 0.0
+    touch: Optional[Touch] = None
+    deadline = time.time() + timeout_s
+
+    def _refresh(force: bool = False) -> None:
+        nonlocal last_poll
+        if order is None:
+            return
+        oid = order["id"]
+        st = tracker.last(oid) if (tracker is not None and tracker.streaming) else None
+        if st is None and (force or time.time() - last_poll >= 1.0):
+            last_poll = time.time()
+            try:
+                st = ex.fetch_order(oid, sym)
+            except Exception:
+                st = None
+        _apply(st)
+
+    def _apply(st: Optional[Dict[str, Any]]) -> None:
+        nonlocal order, last_order, done, filled, notional
+        if not st or order is None:
+            return
+        order = {**order, **{k: v for k, v in st.items() if v is not None}}  # ответ amend — неполный
+        status = str(order.get("status") or "").lower()
+        if status in ("closed", "filled", "canceled", "cancelled", "rejected", "expired"):
+            # финальный статус учитываем ровно один раз и отпускаем ордер
+            f = float(order.get("filled") or 0.0)
+            filled += f
+            notional += f * float(order.get("average") or our_px or 0.0)
+            if status in ("closed", "filled"):
+                done = True
+            elif f <= 0:
+                stats["rejects"] += 1
+            last_order, order = order, None
+
+    def _remaining() -> float:
+        return max(plan.qty - filled, 0.0)
+
+    book.start(sym)
+    try:
+        while time.time() < deadline:
+            upd = book.next_update(timeout=min(0.5, max(deadline - time.time(), 0.0)))
+            if upd is not None:
+                touch = upd
+            _refresh()  # без потока — опрос не чаще раза в секунду, даже когда стакан молчит
+            if done or _remaining() <= 0:
+                break
+            if touch is None:
+                continue
+
+            target = touch[0] if buy else touch[1]
+            if (buy and target > bound) or (not buy and target < bound):
+                log.info("[MAKER] %s touch %s за границей %s — фолбэк", sym, target, bound)
+                break
+
+            if order is None:
+                qty = _floor_qty(ex, sym, _remaining())
+                if qty <= 0:
+                    break
+                o = ex.create_order(sym, "limit", side, qty, target, {**params, "postOnly": True, "timeInForce": "PO"})
+                stats["placed"] += 1
+                order, our_px, order_qty = dict(o), target, qty
+                if str(o.get("status") or "").lower() in ("canceled", "rejected"):
+                    # post-only отклонён — пробуем на следующем обновлении
+                    stats["rejects"] += 1
+                    last_order, order = order, None
+            elif target != our_px and amend_bucket.try_acquire():
+                try:
+                    o = ex.edit_order(order["id"], sym, "limit", side, order_qty, target)
+                except Exception as e:
+                    # обычно ордер уже исполнен или снят, а статус ещё не дошёл: сверяемся и больше
+                    # не переставляем — живой ордер снимет и досчитает хвост
+                    _refresh(force=True)
+                    if order is not None:
+                        log.warning("[MAKER] amend failed: %s", e)
+                        break
+                    continue
+                our_px = target
+                stats["reprices"] += 1
+                _apply(o)  # amend мог сразу вернуть финальный статус (post-only отменён)
+    finally:
+        book.stop()
+
+    # Хвост: снять висящий лимит и добрать остаток агрессивно
+    if order is not None:
+        try:
+            ex.cancel_order(order["id"], sym)
+        except Exception as e:
+            log.warning("[MAKER] cancel failed: %s", e)
+        # подтверждение отмены приходит не сразу (поток может ещё отдавать «open») — ждём
+        # финальный статус и только потом считаем остаток
+        if tracker is not None:
+            _apply(tracker.wait(ex, sym, order["id"], timeout_s=_CANCEL_SETTLE_S))
+        else:
+            settle_by = time.time() + _CANCEL_SETTLE_S
+            _refresh(force=True)
+            while order is not None and time.time() < settle_by:
+                time.sleep(0.2)
+                _refresh(force=True)
+        if order is not None:
+            # статус так и не стал финальным — остаток не добираем, чтобы не задвоить позицию
+            log.warning("[MAKER] статус лимита после отмены неизвестен — фолбэк пропущен")
+            return {"status": "unknown", "order": order, "filled": filled, "average": None,
+                    "maker_fallback": False, **stats}
+
+    used_fallback = False
+    rest = _remaining()
+    if rest > 0:
+        used_fallback = True
+        rest_q = _floor_qty(ex, sym, rest)
+        if rest_q > 0:
+            if fallback == "market":
+                o = ex.create_order(sym, "market", side, rest_q, None, params)
+            else:
+                o = ex.create_order(sym, "limit", side, rest_q, bound, {**params, "timeInForce": "IOC"})
+            last_order = o
+            if str(o.get("status") or "").lower() not in ("closed", "canceled"):
+                o = ex.fetch_order(o["id"], sym) or o
+            f = float(o.get("filled") or 0.0)
+            filled += f
+            notional += f * float(o.get("average") or bound)
+
+    avg = notional / filled if filled > 0 else None
+    status = "closed" if filled >= plan.qty - 1e-12 else ("partial" if filled > 0 else "canceled")
+    log_event(log, "MAKER", symbol=sym, status=status, filled=filled, avg=avg, fallback=used_fallback, **stats)
+    return {
+        "status": status,
+        "order": last_order or {},
+        "filled": filled,
+        "average": avg,
+        "maker_fallback": used_fallback,
+        **stats,
+    }
+
+
+def make_book_source(ex) -> BookSource:
+    """WS-стакан через ccxt.pro, если доступен (MAKER_BOOK_STREAM!=off, не replay), иначе опрос тикера."""
+    mc = get_config().maker
+    if mc.book_stream and not offline():
+        try:
+            import ccxt.pro  # noqa: F401
+
+            return CcxtProBookSource()
+        except Exception:
+            pass
+    return PollingBookSource(ex, interval_s=mc.poll_ms / 1000.0)
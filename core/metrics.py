@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .tracing import span
+
+log = logging.getLogger(__name__)
+
+# Границы латентности (секунды): от миллисекунд REST до десятков секунд ожидания fill
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _fmt_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values, **kw):
+        key = tuple(str(kw[n]) for n in self.label_names) if kw else tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._new_child()
+                    self._children[key] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        return self.labels()
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1.0) -> None:
+        with self._lock:
+            self.value += n
+
+    def set(self, v: float) -> None:
+        self.value = float(v)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, n: float = 1.0) -> None:
+        self._default().inc(n)
+
+    def samples(self):
+        for key, c in list(self._children.items()):
+            yield f"{self.name}{_fmt_labels(self.label_names, key)} {_num(c.value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, v: float) -> None:
+        self._default().set(v)
+
+
+class _Hist:
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, v: float) -> None:
+        i = bisect.bisect_left(self.bounds, v)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += v
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _Hist(self.buckets)
+
+    def observe(self, v: float) -> None:
+        self._default().observe(v)
+
+    def samples(self):
+        for key, h in list(self._children.items()):
+            with h._lock:
+                counts, total, n = list(h.counts), h.sum, h.count
+            acc = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le = _fmt_labels(self.label_names, key, f'le="{_num(bound)}"')
+                yield f"{self.name}_bucket{le} {acc}"
+            lbl = _fmt_labels(self.label_names, key)
+            yield f"{self.name}_sum{lbl} {_num(total)}"
+            yield f"{self.name}_count{lbl} {n}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kw):
+        with self._lock:
+            m = self._metrics.get(name)
+            if m is None:
+                m = cls(name, help, labels, **kw)
+                self._metrics[name] = m
+            return m
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(
+        self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (exposition format 0.0.4)."""
+        lines: List[str] = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- метрики guard'а ---
+STAGE_SECONDS = REGISTRY.histogram("guard_stage_seconds", "Latency of guard pipeline stages", ["stage"])
+CYCLE_SECONDS = REGISTRY.histogram("guard_cycle_seconds", "Full guard cycle duration")
+CYCLES = REGISTRY.counter("guard_cycles_total", "Guard cycles completed")
+LAST_CYCLE_TS = REGISTRY.gauge("guard_last_cycle_timestamp_seconds", "Unix time of the last finished cycle")
+REST_REQUESTS = REGISTRY.counter(
+    "bybit_rest_requests_total", "REST requests sent, per endpoint (each attempt)", ["endpoint"]
+)
+REST_SECONDS = REGISTRY.histogram("bybit_rest_seconds", "REST request latency incl. throttle and retries", ["endpoint"])
+REST_ERRORS = REGISTRY.counter(
+    "bybit_rest_errors_total", "REST calls that raised, per endpoint and error class", ["endpoint", "error"]
+)
+REST_RETRIES = REGISTRY.counter("bybit_rest_retries_total", "Retries made by the resilience layer", ["endpoint"])
+THROTTLE_SECONDS = REGISTRY.histogram(
+    "bybit_throttle_wait_seconds", "Time spent in the client-side rate limiter before a request",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """
+    with stage_timer("predict"): ... — латентность стадии в guard_stage_seconds{stage}
+    и span стадии в трассе цикла (core.tracing), если она идёт.
+    """
+    h = STAGE_SECONDS.labels(stage)
+    t0 = time.perf_counter()
+    try:
+        with span(stage):
+            yield
+    finally:
+        h.observe(time.perf_counter() - t0)
+
+
+def timed(stage: str):
+    """Декоратор-вариант stage_timer."""
+
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return deco
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_SERVER: Optional[ThreadingHTTPServer] = None
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Поднимает /metrics в фоновом потоке (один раз на процесс); по умолчанию — только localhost."""
+    global _SERVER
+    if _SERVER is None:
+        _SERVER = ThreadingHTTPServer((host, port), _Handler)
+        threading.Thread(target=_SERVER.serve_forever, name="metrics-http", daemon=True).start()
+        log.info("[METRICS] http://%s:%s/metrics", host, _SERVER.server_address[1])
+    return _SERVER
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Optional
+
+from .accounts import current_account
+from .bybit_exchange import normalize_symbol
+from .candle_cache import fetch_ohlcv_cached
+from .config import Config, get_config
+from .indicators import atr_latest_from_ohlcv
+from .market_info import adjust_qty_price
+from .resilience import classify_error
+from .rounding import round_price
+from utils.error_handler import BybitNotModified
+
+log = logging.getLogger(__name__)
+
+# Плечо, уже применённое на бирже: (аккаунт, symbol) -> leverage. set_leverage шлём только при изменении.
+_LEVERAGE_APPLIED: Dict[tuple, int] = {}
+_LEV_LOCK = threading.Lock()
+
+# Свечи для ATR на входе считаем свежими в пределах этого окна (их только что тянул predict)
+_ATR_MAX_AGE_S = 30.0
+
+
+@dataclass
+class CycleSnapshot:
+    """
+    Состояние цикла guard'а, общее для всех входов: баланс, тикеры, ATR.
+    Снимается один раз (баланс + bulk-тикеры), ATR досчитывается лениво из кэша свечей.
+    positions_synced — монитор в этом цикле сверил position_state аккаунта с биржей
+    (флаги трейлинга — из bulk position/list), входу не нужно перепроверять позицию.
+    """
+
+    balance_usdt: float
+    tickers: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    atr: Dict[str, float] = field(default_factory=dict)
+    taken_at: float = field(default_factory=time.time)
+    positions_synced: bool = False
+
+    @classmethod
+    def capture(
+        cls, ex, symbols: Iterable[str], tickers: Optional[Dict[str, Dict[str, Any]]] = None
+    ) -> "CycleSnapshot":
+        """tickers — уже полученные в этом цикле (сканер вселенной): запрашиваются только недостающие."""
+        syms = [normalize_symbol(s) for s in symbols]
+        bal = ex.fetch_balance()
+        usdt = float(bal.get("USDT", {}).get("free", 0.0) or 0.0)
+        have = dict(tickers or {})
+        missing = [s for s in syms if s not in have]
+        if missing:
+            have.update(ex.fetch_tickers(missing) or {})
+        return cls(balance_usdt=usdt, tickers=have)
+
+    def for_account(self, ex) -> "CycleSnapshot":
+        """Снимок другого аккаунта: свой баланс (один запрос), тикеры и ATR — общие с этим."""
+        bal = ex.fetch_balance()
+        usdt = float(bal.get("USDT", {}).get("free", 0.0) or 0.0)
+        return CycleSnapshot(balance_usdt=usdt, tickers=self.tickers, atr=self.atr, taken_at=self.taken_at)
+
+    def price(self, ex, sym: str) -> float:
+        t = self.tickers.get(sym)
+        if t is None:
+            t = ex.fetch_ticker(sym)
+            self.tickers[sym] = t
+        return float(t.get("last") or t.get("close") or 0.0)
+
+    def atr_for(self, ex, sym: str, timeframe: str, period: int) -> float:
+        key = f"{sym}|{timeframe}|{period}"
+        if key not in self.atr:
+            ohlcv = fetch_ohlcv_cached(ex, sym, timeframe, max(period + 1, 200), max_age_s=_ATR_MAX_AGE_S)
+            self.atr[key], _ = atr_latest_from_ohlcv(ohlcv, period=period)
+        return self.atr[key]
+
+
+@dataclass
+class OrderPlan:
+    """Готовый к отправке вход: всё округлено, TP/SL посчитаны."""
+
+    symbol: str
+    side: str  # buy | sell
+    qty: float
+    qty_raw: float
+    price: float
+    tp: float
+    sl: float
+    leverage: int
+    atr: float
+    balance: float
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return {"takeProfit": self.tp, "stopLoss": self.sl}
+
+
+def ensure_leverage(ex, sym: str, leverage: int) -> bool:
+    """
+    Выставляет плечо, только если для символа оно ещё не применялось в этом процессе
+    (или изменилось). 110043 = already set — тоже считаем применённым.
+    Возвращает True, если был REST-вызов.
+    """
+    key = (current_account(), sym)
+    with _LEV_LOCK:
+        if _LEVERAGE_APPLIED.get(key) == leverage:
+            return False
+    try:
+        ex.set_leverage(leverage, sym)
+    except Exception as e:
+        if not isinstance(classify_error(e, "v5/position/set-leverage"), BybitNotModified):
+            log.warning("⚠️ set_leverage: %s", e)
+            return True
+    with _LEV_LOCK:
+        _LEVERAGE_APPLIED[key] = leverage
+    return True
+
+
+def prepare_entry(
+    ex,
+    symbol: str,
+    side: str,
+    snapshot: CycleSnapshot,
+    price: Optional[float] = None,
+    cfg: Optional[Config] = None,
+) -> Optional[OrderPlan]:
+    """
+    Считает вход по ATR-риску из снимка цикла, без лишних round-trip'ов:
+    цена — из bulk-тикеров, ATR — из кэша свечей, округление — локально по метаданным рынка.
+    Параметры риска — из cfg.entry. Возвращает None, если после округления qty <= 0.
+    """
+    e = (cfg or get_config()).entry
+    sym = normalize_symbol(symbol)
+    if price is None:
+        price = snapshot.price(ex, sym)
+
+    order_side = "buy" if side.lower() == "long" else "sell"
+    leverage = e.leverage
+
+    tf = e.timeframe
+    atr_period = e.atr_period
+    sl_mult = e.sl_atr_mult
+    tp_mult = e.tp_atr_mult
+    risk_pct = e.risk_pct  # 0.7% от депозита по умолчанию
+
+    atr = snapshot.atr_for(ex, sym, tf, atr_period)
+    stop_dist = max(atr * sl_mult, 1e-9)
+
+    risk_usdt = max(1e-6, snapshot.balance_usdt * risk_pct)
+    qty_raw = risk_usdt / stop_dist if stop_dist > 0 else 0.0
+
+    qty, px, _ = adjust_qty_price(sym, qty_raw, price, ex=ex)
+    if qty <= 0:
+        return None
+
+    if order_side == "buy":
+        sl_price = round_price(ex, sym, px - stop_dist)
+        tp_price = round_price(ex, sym, px + tp_mult * atr)
+    else:
+        sl_price = round_price(ex, sym, px + stop_dist)
+        tp_price = round_price(ex, sym, px - tp_mult * atr)
+
+    return OrderPlan(
+        symbol=sym,
+        side=order_side,
+        qty=qty,
+        qty_raw=qty_raw,
+        price=px,
+        tp=tp_price,
+        sl=sl_price,
+        leverage=leverage,
+        atr=atr,
+        balance=snapshot.balance_usdt,
+    )
@@ -0,0 +1,363 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import ccxt
+
+from .accounts import PerAccount, account_env, current_account
+from .cassette import offline
+from utils.error_handler import BybitAPIError
+
+log = logging.getLogger(__name__)
+
+# Финальные статусы: unified ccxt + «сырые» Bybit v5 (топик order)
+_TERMINAL = {
+    "closed",
+    "canceled",
+    "cancelled",
+    "rejected",
+    "expired",
+    "filled",
+    "deactivated",
+    "partiallyfilledcanceled",
+}
+
+# Bybit v5 orderStatus -> unified ccxt status
+_BYBIT_STATUS = {
+    "new": "open",
+    "partiallyfilled": "open",
+    "untriggered": "open",
+    "filled": "closed",
+    "cancelled": "canceled",
+    "partiallyfilledcanceled": "canceled",
+    "deactivated": "canceled",
+    "rejected": "rejected",
+}
+
+# Сколько последних финальных статусов помним: событие fill может прийти по WS
+# раньше, чем create_order вернёт id и кто-то начнёт его ждать
+_RECENT_MAX = 512
+# Последние статусы (в т.ч. ордеров, которые никто не ждёт) — LRU, чтобы поток не раздувал память
+_LAST_MAX = 2048
+
+
+def _normalize(msg: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Приводит сообщение транспорта к списку unified-ордеров.
+    Принимает кадр Bybit v5 ({"topic": "order", "data": [...]}) или уже unified-ордер ccxt.
+    """
+    if "topic" in msg:
+        if not str(msg.get("topic", "")).startswith(("order", "execution")):
+            return []
+        out = []
+        for d in msg.get("data") or []:
+            raw_status = str(d.get("orderStatus") or "").lower()
+            out.append(
+                {
+                    "id": str(d.get("orderId") or ""),
+                    "clientOrderId": d.get("orderLinkId"),
+                    "symbol": d.get("symbol"),
+                    "status": _BYBIT_STATUS.get(raw_status, raw_status or None),
+                    "average": float(d.get("avgPrice") or 0.0) or None,
+                    "filled": float(d.get("cumExecQty") or d.get("execQty") or 0.0),
+                    "info": d,
+                }
+            )
+        return out
+    if msg.get("id"):
+        return [msg]
+    return []
+
+
+def _is_terminal(order: Dict[str, Any]) -> bool:
+    return str(order.get("status") or "").lower() in _TERMINAL
+
+
+class OrderStreamTransport:
+    """
+    Источник событий по ордерам. Реализация вызывает on_message(dict) из своего потока
+    для каждого кадра и выставляет connected, пока подписка жива.
+    """
+
+    connected = False
+
+    def start(self, on_message: Callable[[Dict[str, Any]], None]) -> None:
+        raise NotImplementedError
+
+    def stop(self) -> None:
+        pass
+
+
+class CcxtProOrderStream(OrderStreamTransport):
+    """Приватный поток ордеров Bybit через ccxt.pro watch_orders (в отдельном потоке с asyncio)."""
+
+    def __init__(self, exchange_factory: Optional[Callable[[], Any]] = None) -> None:
+        self._factory = exchange_factory
+        self._account = current_account()  # ключи аккаунта, для которого поднят поток
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop = threading.Event()
+
+    def _make_exchange(self):
+        if self._factory is not None:
+            return self._factory()
+        import ccxt.pro as ccxtpro  # type: ignore
+
+        from .clock_sync import get_clock
+
+        ex = ccxtpro.bybit(
+            {
+                "apiKey": os.getenv(account_env("BYBIT_API_KEY", self._account)),
+                "secret": os.getenv(account_env("BYBIT_SECRET_KEY", self._account)),
+                "options": {"defaultType": "swap"},
+            }
+        )
+        get_clock().attach(ex)  # его REST-запросы подписываются тем же смещением
+        return ex
+
+    async def _run(self, on_message) -> None:
+        ex = self._make_exchange()
+        try:
+            while not self._stop.is_set():
+                try:
+                    orders = await ex.watch_orders()
+                    self.connected = True
+                    for o in orders:
+                        on_message(o)
+                except Exception as e:
+                    self.connected = False
+                    log.warning("[ORDER_STREAM] reconnect after error: %s", e)
+                    await asyncio.sleep(1.0)
+        finally:
+            self.connected = False
+            await ex.close()
+
+    def start(self, on_message) -> None:
+        def _target():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._run(on_message))
+
+        self._thread = threading.Thread(target=_target, name="order-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.connected = False
+
+
+class LocalOrderStream(OrderStreamTransport):
+    """
+    Локальная замена websocket для тестов/офлайна: кадры (dict или JSON-строки в формате
+    Bybit v5 private topic "order") кладутся через push() и доставляются из фонового потока,
+    как это делал бы WS-клиент.
+    """
+
+    def __init__(self, latency_s: float = 0.0) -> None:
+        self.latency_s = latency_s
+        self._q: "queue.Queue[Any]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def push(self, frame: Any) -> None:
+        self._q.put(frame)
+
+    def start(self, on_message) -> None:
+        def _target():
+            self.connected = True
+            while True:
+                frame = self._q.get()
+                if frame is None:
+                    break
+                if self.latency_s:
+                    time.sleep(self.latency_s)
+                on_message(json.loads(frame) if isinstance(frame, (str, bytes)) else frame)
+            self.connected = False
+
+        self._thread = threading.Thread(target=_target, name="local-order-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._q.put(None)
+
+
+class OrderTracker:
+    """
+    Ожидание исполнения ордеров: future на каждый order_id, которые резолвит поток событий.
+    Если поток не подключён (или молчит), падаем на опрос fetch_order с адаптивным бэкоффом.
+    Ордер уже принят биржей, поэтому ожидание не бросает исключений: сбои опроса логируются,
+    а без финального статуса возвращается последний известный или status="unknown".
+    """
+
+    def __init__(
+        self,
+        transport: Optional[OrderStreamTransport] = None,
+        *,
+        poll_min_s: float = 0.1,
+        poll_max_s: float = 2.0,
+        stream_grace_s: float = 1.0,
+    ) -> None:
+        self.transport = transport
+        self.poll_min_s = poll_min_s
+        self.poll_max_s = poll_max_s
+        self.stream_grace_s = stream_grace_s
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+        self._last: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._recent_final: Dict[str, Dict[str, Any]] = {}
+
+    # --- поток событий ---
+    def start(self) -> "OrderTracker":
+        if self.transport is not None:
+            self.transport.start(self.on_message)
+        return self
+
+    def stop(self) -> None:
+        if self.transport is not None:
+            self.transport.stop()
+
+    @property
+    def streaming(self) -> bool:
+        return bool(self.transport is not None and self.transport.connected)
+
+    def on_message(self, msg: Dict[str, Any]) -> None:
+        for o in _normalize(msg):
+            self._update(o)
+
+    def _update(self, order: Dict[str, Any]) -> None:
+        oid = str(order.get("id") or "")
+        if not oid:
+            return
+        with self._lock:
+            self._last[oid] = order
+            self._last.move_to_end(oid)
+            if len(self._last) > _LAST_MAX:
+                self._last.popitem(last=False)
+            fut = self._futures.get(oid)
+            if _is_terminal(order):
+                self._recent_final[oid] = order
+                if len(self._recent_final) > _RECENT_MAX:
+                    self._recent_final.pop(next(iter(self._recent_final)))
+        if fut is not None and _is_terminal(order) and not fut.done():
+            fut.set_result(order)
+
+    # --- ожидание ---
+    def track(self, order_id: str) -> Future:
+        oid = str(order_id)
+        with self._lock:
+            fut = self._futures.get(oid)
+            if fut is None:
+                fut = Future()
+                self._futures[oid] = fut
+            final = self._recent_final.get(oid)
+        if final is not None and not fut.done():
+            fut.set_result(final)
+        return fut
+
+    def last(self, order_id: str) -> Optional[Dict[str, Any]]:
+        """Последний известный статус ордера из потока/опроса (без сетевых вызовов)."""
+        with self._lock:
+            return self._last.get(str(order_id))
+
+    def _forget(self, oid: str) -> Dict[str, Any]:
+        with self._lock:
+            self._futures.pop(oid, None)
+            self._recent_final.pop(oid, None)
+            return self._last.pop(oid, {})
+
+    def _poll(self, ex, sym: str, oid: str) -> None:
+        try:
+            o = ex.fetch_order(oid, sym)
+        except ccxt.NetworkError:
+            # разовые сбои сети/таймауты — просто ждём следующей попытки
+            return
+        except (ccxt.BaseError, BybitAPIError) as e:
+            # ошибка запроса (или открытый предохранитель) не исправится повтором —
+            # видно в логе, ожидание уходит в таймаут
+            log.warning("[ORDER_POLL] fetch_order %s %s: %s: %s", sym, oid, type(e).__name__, e)
+            return
+        if o:
+            o = dict(o)
+            o.setdefault("id", oid)
+            self._update(o)
+
+    def wait_many(self, ex, orders: Iterable[Tuple[str, str]], timeout_s: float = 8.0) -> Dict[str, Dict[str, Any]]:
+        """
+        Ждёт несколько ордеров одновременно. orders — пары (symbol, order_id).
+        Возвращает {order_id: последний известный статус}; без единого статуса — status="unknown".
+        """
+        pending = {str(oid): sym for sym, oid in orders if oid}
+        symbols = dict(pending)
+        futs = {oid: self.track(oid) for oid in pending}
+        try:
+            self._wait(ex, pending, futs, timeout_s)
+        except Exception as e:
+            log.warning("[ORDER_WAIT] %s: %s", type(e).__name__, e)
+        return self._collect(futs, symbols)
+
+    def _wait(self, ex, pending: Dict[str, str], futs: Dict[str, Future], timeout_s: float) -> None:
+        t0 = time.time()
+        deadline = t0 + timeout_s
+        delay = self.poll_min_s
+
+        while pending:
+            left = deadline - time.time()
+            if left <= 0:
+                break
+            # Пока поток жив — даём ему шанс (stream_grace_s), опрос лишь страховка
+            in_grace = self.streaming and time.time() - t0 < self.stream_grace_s
+            step = (t0 + self.stream_grace_s - time.time()) if in_grace else delay
+            wait([futs[o] for o in pending], timeout=max(0.0, min(left, step)), return_when=FIRST_COMPLETED)
+            for oid in [o for o in pending if futs[o].done()]:
+                pending.pop(oid)
+            if not pending or time.time() >= deadline:
+                break
+            if not self.streaming or time.time() - t0 >= self.stream_grace_s:
+                for oid, sym in list(pending.items()):
+                    self._poll(ex, sym, oid)
+                    if futs[oid].done():
+                        pending.pop(oid)
+                delay = min(delay * 2.0, self.poll_max_s)
+
+    def _collect(self, futs: Dict[str, Future], symbols: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+        out = {}
+        for oid, fut in futs.items():
+            last = self._forget(oid)
+            if fut.done():
+                out[oid] = fut.result()
+            else:
+                out[oid] = last or {"id": oid, "symbol": symbols.get(oid), "status": "unknown"}
+        return out
+
+    def wait(self, ex, sym: str, order_id: str, timeout_s: float = 8.0) -> Dict[str, Any]:
+        return self.wait_many(ex, [(sym, order_id)], timeout_s).get(str(order_id), {})
+
+
+_TRACKERS: PerAccount[OrderTracker] = PerAccount(lambda acc: OrderTracker())
+
+
+def get_order_tracker() -> OrderTracker:
+    """Трекер текущего аккаунта. Без запущенного потока работает как адаптивный опрос."""
+    return _TRACKERS.get()
+
+
+def start_order_tracker(transport: Optional[OrderStreamTransport] = None) -> OrderTracker:
+    """
+    Поднимает поток событий для трекера текущего аккаунта. По умолчанию — ccxt.pro watch_orders,
+    ORDER_STREAM=off (и replay из кассеты) оставляет только опрос.
+    """
+    if transport is None and (os.getenv("ORDER_STREAM", "ccxtpro").lower() in ("off", "0", "false") or offline()):
+        return get_order_tracker()
+    old = _TRACKERS.peek()
+    if old is not None:
+        old.stop()
+    tracker = OrderTracker(transport or CcxtProOrderStream()).start()
+    _TRACKERS.set(tracker)
+    return tracker
@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from .accounts import PerAccount
+from .logging_setup import log_event
+from .config import Config, get_config
+from .metrics import stage_timer
+from .order_prep import CycleSnapshot
+from .profiling import get_profiler
+from .position_state import PositionState, PositionStateStore, get_state_store
+from .rate_limiter import TokenBucket
+from .rounding import round_price
+from .scheduler import last_bar_close
+from .trade_log import append_trade_event
+from .trailing_stop import compute_atr, set_stop_loss_only, update_trailing_for_symbol
+
+log = logging.getLogger(__name__)
+
+# Общий лимитер для trading-stop запросов монитора (Bybit: ~10 rps на /v5/position/trading-stop)
+# Лимитер trading-stop на аккаунт: у каждого аккаунта Bybit свой лимит запросов
+_BUCKETS: PerAccount[Optional[TokenBucket]] = PerAccount(lambda acc: None)
+
+
+def _bucket(rps: float) -> TokenBucket:
+    b = _BUCKETS.get()
+    if b is None or b.rate != rps:
+        b = TokenBucket(rps, burst=max(1.0, rps))
+        _BUCKETS.set(b)
+    return b
+
+
+def _nonzero(v) -> float:
+    try:
+        return float(v or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+@dataclass
+class OpenPosition:
+    """Позиция из одного bulk fetch_positions: ровно то, что нужно монитору."""
+
+    symbol: str
+    side: str  # long | short
+    entry: float
+    contracts: float
+    stop_loss: float
+    trailing_stop: float
+    position_idx: int
+
+    @classmethod
+    def from_ccxt(cls, p: Dict[str, Any]) -> Optional["OpenPosition"]:
+        size = _nonzero(p.get("contracts") or p.get("size"))
+        if abs(size) <= 0:
+            return None
+        info = p.get("info") or {}
+        side = str(p.get("side") or info.get("side") or "").lower()
+        side = "long" if side in ("long", "buy") else "short"
+        return cls(
+            symbol=p.get("symbol"),
+            side=side,
+            entry=_nonzero(p.get("entryPrice") or info.get("avgPrice")),
+            contracts=abs(size),
+            stop_loss=_nonzero(p.get("stopLossPrice") or info.get("stopLoss")),
+            trailing_stop=_nonzero(info.get("trailingStop")),
+            position_idx=int(_nonzero(info.get("positionIdx"))),
+        )
+
+
+def be_trigger_price(
+    exchange, st: PositionState, cfg: Optional[Config] = None, snapshot: Optional[CycleSnapshot] = None
+) -> float:
+    """
+    Цена срабатывания безубытка (BE_MODE=atr|pct). В режиме atr ATR пересчитывается
+    не чаще одного раза за бар ATR_TIMEFRAME; результат пишется в st (сохраняет вызывающий).
+    snapshot — снимок цикла: ATR берётся из него (общий кэш свечей), а не отдельным запросом.
+    """
+    be = (cfg or get_config()).breakeven
+    long_ = st.side == "long"
+    if be.mode == "atr":
+        tf = be.atr_timeframe
+        if st.be_trigger > 0 and st.atr_ts >= last_bar_close(tf):
+            return st.be_trigger
+        if snapshot is not None:
+            atr = snapshot.atr_for(exchange, st.symbol, tf, be.atr_period)
+        else:
+            atr, _ = compute_atr(exchange, st.symbol, tf, be.atr_period)
+        if atr <= 0:
+            return 0.0
+        st.atr, st.atr_ts = atr, time.time()
+        st.be_trigger = st.entry + be.atr_k * atr if long_ else st.entry - be.atr_k * atr
+    elif st.be_trigger <= 0:
+        st.be_trigger = st.entry * (1 + be.trigger_pct) if long_ else st.entry * (1 - be.trigger_pct)
+    return st.be_trigger
+
+
+def _sync_state(store: PositionStateStore, positions: List[OpenPosition]) -> Dict[tuple, PositionState]:
+    """Сверяет локальное состояние с биржей: новые позиции заводим, флаги берём из payload позиции."""
+    known = store.snapshot()
+    out = {}
+    for p in positions:
+        key = (p.symbol, p.side)
+        st = known.get(key)
+        if st is None or (p.entry > 0 and abs(st.entry - p.entry) > 1e-12 * max(1.0, p.entry)):
+            st = PositionState(symbol=p.symbol, side=p.side, entry=p.entry, opened_ts=time.time())
+        st.qty = p.contracts
+        # trailingStop/stopLoss приходят в том же ответе position/list — отдельный verify не нужен
+        st.trailing_set = st.trailing_set or p.trailing_stop > 0
+        if p.stop_loss > 0:
+            st.last_sl = p.stop_loss
+        out[key] = st
+    return out
+
+
+def _closed(
+    store: PositionStateStore, live: Dict[tuple, PositionState], tickers: Dict[str, Dict],
+    owns: Optional[Callable[[str], bool]] = None,
+) -> List[PositionState]:
+    """Позиции, которые есть в локальном состоянии, но уже закрыты на бирже (SL/TP/трейлинг/руками)."""
+    gone = []
+    for key, st in store.snapshot().items():
+        if key in live or (owns is not None and not owns(st.symbol)):
+            continue
+        store.delete(st.symbol, st.side)
+        t = tickers.get(st.symbol) or {}
+        last = _nonzero(t.get("last") or t.get("close"))
+        sign = 1.0 if st.side == "long" else -1.0
+        pnl = sign * (last - st.entry) * st.qty if last > 0 and st.entry > 0 else 0.0
+        append_trade_event(
+            {
+                "ts": time.time(),
+                "event": "position_closed",
+                "symbol": st.symbol,
+                "side": st.side,
+                "qty": st.qty,
+                "price": last,
+                "sl": st.last_sl or "",
+                "extra": f"entry={st.entry} pnl_est={pnl:.6f}",
+            }
+        )
+        gone.append(st)
+    return gone
+
+
+def monitor_positions(
+    exchange,
+    *,
+    tickers: Optional[Dict[str, Dict]] = None,
+    snapshot: Optional[CycleSnapshot] = None,
+    store: Optional[PositionStateStore] = None,
+    bucket: Optional[TokenBucket] = None,
+    max_workers: Optional[int] = None,
+    set_sl: Callable = set_stop_loss_only,
+    set_trailing: Callable = update_trailing_for_symbol,
+    cfg: Optional[Config] = None,
+    owns: Optional[Callable[[str], bool]] = None,
+) -> Dict[str, Any]:
+    """
+    Стадия монитора позиций (каждый цикл): один fetch_positions, один fetch_tickers для
+    недостающих символов, векторная проверка BE/трейлинга по всем позициям и параллельная
+    отправка только нужных trading-stop запросов под общим лимитером.
+    snapshot — снимок цикла (CycleSnapshot): его тикеры и ATR (BE и трейлинг в режиме atr),
+    чтобы не тянуть их второй раз; tickers — только тикеры, без снимка.
+    owns — фильтр символов (позиции своего шарда): чужие позиции и их состояние не трогаем.
+    """
+    cfg = cfg or get_config()
+    store = store or get_state_store()
+    bucket = bucket or _bucket(cfg.monitor.rps)
+    workers = max_workers or cfg.monitor.workers
+    use_be = cfg.breakeven.enabled
+    use_ts = cfg.trailing.enabled
+
+    raw = exchange.fetch_positions() or []
+    positions = [
+        p for p in (OpenPosition.from_ccxt(x) for x in raw)
+        if p is not None and p.symbol and (owns is None or owns(p.symbol))
+    ]
+    live = _sync_state(store, positions)
+
+    if tickers is None and snapshot is not None:
+        tickers = snapshot.tickers
+    tickers = dict(tickers or {})
+    need = sorted({p.symbol for p in positions} | {s.symbol for s in store.all() if owns is None or owns(s.symbol)})
+    missing = [s for s in need if s not in tickers]
+    if missing:
+        tickers.update(exchange.fetch_tickers(missing) or {})
+
+    closed = _closed(store, live, tickers, owns)
+    summary = {"positions": len(positions), "closed": len(closed), "be": 0, "trailing": 0, "errors": 0}
+    if not positions:
+        return summary
+
+    states = [live[(p.symbol, p.side)] for p in positions]
+    now = time.time()
+    for st in states:
+        st.last_check = now
+        if use_be and not st.be_applied and st.entry > 0:
+            be_trigger_price(exchange, st, cfg, snapshot)
+
+    # --- векторная оценка условий ---
+    sign = np.array([1.0 if st.side == "long" else -1.0 for st in states])
+    entry = np.array([st.entry for st in states])
+    quotes = [tickers.get(st.symbol) or {} for st in states]
+    last = np.array([_nonzero(t.get("last") or t.get("close")) for t in quotes])
+    trigger = np.array([st.be_trigger for st in states])
+    cur_sl = np.array([st.last_sl for st in states])
+    be_done = np.array([st.be_applied for st in states], dtype=bool)
+    has_ts = np.array([st.trailing_set for st in states], dtype=bool)
+
+    offset = cfg.breakeven.offset_pct
+    be_px = entry * (1.0 + sign * offset)
+    # SL уже не хуже безубытка (выставлен вручную/прошлым запуском) — считаем BE сделанным без запроса
+    sl_at_be = (cur_sl > 0) & (sign * (cur_sl - be_px) >= 0)
+    crossed = (trigger > 0) & (last > 0) & (sign * (last - trigger) >= 0)
+    do_be = use_be & ~be_done & ~sl_at_be & crossed
+    do_ts = use_ts & ~has_ts & (entry > 0)
+
+    for i in np.flatnonzero(sl_at_be & ~be_done):
+        states[i].be_applied = True
+
+    # Запросы по одной позиции идут последовательно (один и тот же trading-stop), разные позиции — параллельно
+    jobs: Dict[int, List[str]] = {}
+    for i in np.flatnonzero(do_ts):
+        jobs.setdefault(int(i), []).append("trailing")
+    for i in np.flatnonzero(do_be):
+        jobs.setdefault(int(i), []).append("be")
+
+    def _trailing_atr(sym: str) -> Optional[float]:
+        t = cfg.trailing
+        if snapshot is None or t.activation_mode.lower() != "atr":
+            return None
+        return snapshot.atr_for(exchange, sym, t.atr_timeframe, t.atr_period)
+
+    def _run(i: int, kinds: List[str]):
+        p, st = positions[i], states[i]
+        out = []
+        with get_profiler().thread(p.symbol):
+            for kind in kinds:
+                bucket.acquire()
+                try:
+                    if kind == "trailing":
+                        with stage_timer("trailing_set"):
+                            set_trailing(exchange, p.symbol, p.entry, p.side, cfg=cfg, atr=_trailing_atr(p.symbol))
+                        st.trailing_set = True
+                    else:
+                        px = round_price(exchange, p.symbol, float(be_px[i]))
+                        with stage_timer("breakeven_set"):
+                            set_sl(exchange, p.symbol, px, position_idx=p.position_idx)
+                        st.be_applied, st.last_sl = True, px
+                        log_event(log, "MONITOR_BE", symbol=p.symbol, side=p.side, sl=px)
+                    out.append((kind, None))
+                except Exception as e:
+                    log.error("[MONITOR_ERR] %s %s: %s", kind, p.symbol, e)
+                    out.append((kind, e))
+        return out
+
+    if jobs:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(jobs))), thread_name_prefix="monitor") as pool:
+            # контекст (id цикла, текущий span трассы) — в каждый поток пула, своей копией на задачу
+            futs = [pool.submit(contextvars.copy_context().run, _run, i, kinds) for i, kinds in jobs.items()]
+            for f in futs:
+                for kind, err in f.result():
+                    if err is not None:
+                        summary["errors"] += 1
+                    else:
+                        summary[kind] += 1
+
+    for st in states:
+        store.put(st)
+    return summary
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .accounts import PerAccount, account_path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS positions (
+    symbol       TEXT NOT NULL,
+    side         TEXT NOT NULL,
+    entry        REAL NOT NULL DEFAULT 0,
+    qty          REAL NOT NULL DEFAULT 0,
+    trailing_set INTEGER NOT NULL DEFAULT 0,
+    be_applied   INTEGER NOT NULL DEFAULT 0,
+    be_trigger   REAL NOT NULL DEFAULT 0,
+    last_sl      REAL NOT NULL DEFAULT 0,
+    atr          REAL NOT NULL DEFAULT 0,
+    atr_ts       REAL NOT NULL DEFAULT 0,
+    opened_ts    REAL NOT NULL DEFAULT 0,
+    last_check   REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (symbol, side)
+)
+"""
+
+
+def _side_key(side: str) -> str:
+    """long/buy -> long, short/sell -> short."""
+    return "long" if (side or "").lower() in ("long", "buy") else "short"
+
+
+@dataclass
+class PositionState:
+    """Локальное состояние позиции: что уже сделано (трейлинг, BE) и последние известные уровни."""
+
+    symbol: str
+    side: str
+    entry: float = 0.0
+    qty: float = 0.0
+    trailing_set: bool = False
+    be_applied: bool = False
+    be_trigger: float = 0.0  # цена, при пересечении которой переносим SL в BE (0 = ещё не посчитана)
+    last_sl: float = 0.0
+    atr: float = 0.0
+    atr_ts: float = 0.0
+    opened_ts: float = 0.0
+    last_check: float = 0.0
+
+
+_COLUMNS = [f.name for f in fields(PositionState)]
+
+
+class PositionStateStore:
+    """
+    Долговременное хранилище состояния позиций (SQLite, WAL): переживает перезапуски
+    --once и daemon-процесса, поэтому guard отвечает на «есть ли что делать?» локально.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or os.getenv("POSITION_STATE_DB", "logs/state.db")
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(_SCHEMA)
+
+    def _row(self, r) -> PositionState:
+        d = dict(zip(_COLUMNS, r))
+        d["trailing_set"] = bool(d["trailing_set"])
+        d["be_applied"] = bool(d["be_applied"])
+        return PositionState(**d)
+
+    def get(self, symbol: str, side: str) -> Optional[PositionState]:
+        with self._lock:
+            r = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM positions WHERE symbol=? AND side=?",
+                (symbol, _side_key(side)),
+            ).fetchone()
+        return self._row(r) if r else None
+
+    def all(self) -> List[PositionState]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM positions").fetchall()
+        return [self._row(r) for r in rows]
+
+    def put(self, st: PositionState) -> None:
+        st.side = _side_key(st.side)
+        d = asdict(st)
+        d["trailing_set"] = int(d["trailing_set"])
+        d["be_applied"] = int(d["be_applied"])
+        cols = ", ".join(_COLUMNS)
+        marks = ", ".join("?" for _ in _COLUMNS)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO positions ({cols}) VALUES ({marks})",
+                [d[c] for c in _COLUMNS],
+            )
+
+    def update(self, symbol: str, side: str, **changes) -> None:
+        """Точечное обновление полей; запись создаётся, если её ещё нет."""
+        unknown = set(changes) - set(_COLUMNS)
+        if unknown:
+            raise KeyError(f"Unknown position state fields: {sorted(unknown)}")
+        st = self.get(symbol, side) or PositionState(symbol=symbol, side=_side_key(side))
+        for k, v in changes.items():
+            setattr(st, k, v)
+        self.put(st)
+
+    def open(self, symbol: str, side: str, entry: float, qty: float = 0.0) -> PositionState:
+        """Новая позиция (или новый вход): флаги сбрасываются, BE/трейлинг считаются заново."""
+        st = PositionState(symbol=symbol, side=_side_key(side), entry=float(entry), qty=float(qty),
+                           opened_ts=time.time(), last_check=time.time())
+        self.put(st)
+        return st
+
+    def delete(self, symbol: str, side: Optional[str] = None) -> None:
+        with self._lock:
+            if side is None:
+                self._conn.execute("DELETE FROM positions WHERE symbol=?", (symbol,))
+            else:
+                self._conn.execute("DELETE FROM positions WHERE symbol=? AND side=?", (symbol, _side_key(side)))
+
+    def snapshot(self) -> Dict[tuple, PositionState]:
+        return {(s.symbol, s.side): s for s in self.all()}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# Состояние позиций на аккаунт (core.accounts): logs/state.db, logs/state.sub1.db, ...
+_STORES: PerAccount[PositionStateStore] = PerAccount(
+    lambda acc: PositionStateStore(account_path(os.getenv("POSITION_STATE_DB", "logs/state.db"), acc))
+)
+
+
+def get_state_store() -> PositionStateStore:
+    return _STORES.get()
@@ -1,4 +1,5 @@
 # core/predict.py
+import logging
 import os
 from pathlib import Path
 from typing import Any, Dict, Optional, Tuple
@@ -8,7 +9,14 @@ import numpy as np
 import pandas as pd
 from xgboost import XGBClassifier
 
-from .bybit_exchange import create_exchange, normalize_symbol
+from .bybit_exchange import get_exchange, normalize_symbol
+from .candle_cache import fetch_ohlcv_cached
+from .metrics import stage_timer
+
+log = logging.getLogger(__name__)
+
+# Загруженные модели: путь -> (mtime, model). Перезагружаем только при смене файла.
+_MODEL_CACHE: Dict[str, Tuple[float, Any]] = {}
 
 
 def pair_key(symbol: str) -> str:
@@ -16,11 +24,14 @@ def pair_key(symbol: str) -> str:
 
 
 def _fetch_ohlcv(
-    symbol: str, timeframe: str = "15m", limit: int = 2000
+    symbol: str, timeframe: str = "15m", limit: int = 2000, *, cached: bool = False
 ) -> pd.DataFrame:
-    ex = create_exchange()
+    ex = get_exchange()
     sym = normalize_symbol(symbol)
-    raw = ex.fetch_ohlcv(sym, timeframe=timeframe, limit=limit)
+    if cached:
+        raw = fetch_ohlcv_cached(ex, sym, timeframe, limit)
+    else:
+        raw = ex.fetch_ohlcv(sym, timeframe=timeframe, limit=limit)
     df = pd.DataFrame(
         raw, columns=["timestamp", "open", "high", "low", "close", "volume"]
     )
@@ -59,6 +70,18 @@ def compute_macd(
     return macd, sig, hist
 
 
+def _load_model(model_path: Path):
+    """joblib.load с кэшем по mtime: в daemon-режиме модель читается с диска один раз."""
+    key = str(model_path)
+    mtime = model_path.stat().st_mtime
+    hit = _MODEL_CACHE.get(key)
+    if hit is not None and hit[0] == mtime:
+        return hit[1]
+    model = joblib.load(model_path)
+    _MODEL_CACHE[key] = (mtime, model)
+    return model
+
+
 def train_model_for_pair(
     symbol: str, timeframe: str = "5m", limit: int = 3000, model_dir: str = "models"
 ) -> float:
@@ -100,7 +123,7 @@ def train_model_for_pair(
     Path(model_dir).mkdir(parents=True, exist_ok=True)
     out_path = Path(model_dir) / f"model_{pair_key(symbol)}.pkl"
     joblib.dump(model, out_path)
-    print(f"✅ {normalize_symbol(symbol)} trained, val_acc={acc:.3f} → {out_path}")
+    log.info("✅ %s trained, val_acc=%.3f → %s", normalize_symbol(symbol), acc, out_path)
     return acc
 
 
@@ -111,7 +134,7 @@ def train_many(pairs, timeframe="5m", limit=3000, model_dir="models"):
                 p, timeframe=timeframe, limit=limit, model_dir=model_dir
             )
         except Exception as e:
-            print(f"⚠️ {p}: {e}")
+            log.warning("⚠️ %s: %s", p, e)
 
 
 def predict_trend(
@@ -128,8 +151,8 @@ def predict_trend(
             "proba": {"LONG": 0.0, "SHORT": 0.0},
         }
 
-    model = joblib.load(model_path)
-    df = _fetch_ohlcv(symbol, timeframe=tf, limit=limit)
+    model = _load_model(model_path)
+    df = _fetch_ohlcv(symbol, timeframe=tf, limit=limit, cached=True)
     if df.empty:
         return {
             "signal": "hold",
@@ -137,16 +160,18 @@ def predict_trend(
             "proba": {"LONG": 0.0, "SHORT": 0.0},
         }
 
-    df["ema"] = df["close"].ewm(span=50, adjust=False).mean()
-    df["rsi"] = compute_rsi(df["close"], period=14)
-    macd, sig, _hist = compute_macd(df["close"])
-    df["macd"] = macd
-    df["signal"] = sig
-    df = df.dropna().reset_index(drop=True)
+    with stage_timer("feature_build"):
+        df["ema"] = df["close"].ewm(span=50, adjust=False).mean()
+        df["rsi"] = compute_rsi(df["close"], period=14)
+        macd, sig, _hist = compute_macd(df["close"])
+        df["macd"] = macd
+        df["signal"] = sig
+        df = df.dropna().reset_index(drop=True)
 
-    feats = df[["close", "ema", "rsi", "macd", "signal"]].values[-1:].astype(float)
+        feats = df[["close", "ema", "rsi", "macd", "signal"]].values[-1:].astype(float)
     try:
-        proba = model.predict_proba(feats)[0]
+        with stage_timer("predict"):
+            proba = model.predict_proba(feats)[0]
         p_short, p_long = float(proba[0]), float(proba[1])  # [SHORT, LONG]
         signal = "long" if p_long >= p_short else "short"
         conf = max(p_long, p_short)
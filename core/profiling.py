@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import cProfile
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})"
+
+
+class WallClockSampler:
+    """
+    Семплер стеков потоков цикла по настенным часам (включая ожидание сети/сна, чего cProfile
+    не показывает). Копит collapsed stacks: "root;f1;f2 count" — формат flamegraph.pl/speedscope.
+    thread_id — поток guard'а; рабочие потоки (пулы аккаунтов, монитора) добавляются watch().
+    Тег потока (пара, аккаунт) становится корнем стека, чтобы разнести время по парам.
+    Семплы пишутся только пока поднят active (внутри цикла): сон daemon'а между барами не попадает.
+    """
+
+    def __init__(self, thread_id: int, interval_s: float = 0.005) -> None:
+        self.thread_id = thread_id
+        self.interval_s = interval_s
+        self.stacks: Counter = Counter()
+        self.tags: Dict[int, str] = {thread_id: "cycle"}
+        self.active = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, thread_id: int, tag: str) -> None:
+        self.tags[thread_id] = tag
+
+    def unwatch(self, thread_id: int) -> None:
+        if thread_id != self.thread_id:
+            self.tags.pop(thread_id, None)
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            if not self.active.is_set():
+                continue
+            frames = sys._current_frames()
+            for tid, tag in list(self.tags.items()):
+                frame = frames.get(tid)
+                if frame is None or tid == me:
+                    continue
+                names = []
+                while frame is not None:
+                    names.append(_frame_name(frame))
+                    frame = frame.f_back
+                names.append(tag)
+                self.stacks[";".join(reversed(names))] += 1
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="wall-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+
+    def write(self, path: Path) -> None:
+        with path.open("w", encoding="utf-8") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+
+class CycleProfiler:
+    """
+    Профилирование следующих N циклов guard'а по запросу: cProfile (.prof для snakeviz),
+    tracemalloc (топ аллокаторов, .txt) и wall-clock семплинг (.collapsed для flamegraph).
+    Включается arm(): из PROFILE_CYCLES, флага --profile N или сигналом SIGUSR1 daemon'у.
+    cProfile видит только включивший его поток — задачи пулов цикла оборачиваются в thread():
+    у потока свой cProfile, при записи он сливается в общий .prof.
+    """
+
+    def __init__(self, out_dir: str = "logs", sample_ms: float = 5.0, top: int = 30) -> None:
+        self.out_dir = Path(out_dir)
+        self.sample_s = sample_ms / 1000.0
+        self.top = top
+        self._pending = 0
+        self._left = 0
+        self._prof: Optional[cProfile.Profile] = None
+        self._sampler: Optional[WallClockSampler] = None
+        self._thread_profs: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self._stamp = ""
+        self._started_tracemalloc = False
+
+    @property
+    def active(self) -> bool:
+        return self._left > 0
+
+    def arm(self, cycles: int) -> None:
+        """Запросить профиль следующих cycles циклов (можно вызывать из обработчика сигнала)."""
+        self._pending = max(self._pending, int(cycles))
+
+    def tag(self, name: str) -> None:
+        sampler = self._sampler
+        if sampler is not None:
+            tid = threading.get_ident()
+            if tid in sampler.tags:
+                sampler.tags[tid] = name
+
+    @contextmanager
+    def thread(self, tag: str):
+        """Задача рабочего потока цикла (пул аккаунтов, монитора): профилируется вместе с циклом."""
+        sampler = self._sampler
+        tid = threading.get_ident()
+        if not self._left or sampler is None or tid == sampler.thread_id:
+            yield
+            return
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:  # Python 3.12+: cProfile цикла уже один на все потоки
+            prof = None
+        sampler.watch(tid, tag)
+        try:
+            yield
+        finally:
+            sampler.unwatch(tid)
+            if prof is not None:
+                prof.disable()
+                with self._lock:
+                    self._thread_profs.append(prof)
+
+    def _begin(self) -> None:
+        self._left, self._pending = self._pending, 0
+        self._stamp = time.strftime("%Y%m%d-%H%M%S")
+        self._prof = cProfile.Profile()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            self._started_tracemalloc = True
+        self._sampler = WallClockSampler(threading.get_ident(), self.sample_s)
+        self._sampler.start()
+        log.info("[PROFILE] start: next %d cycle(s)", self._left)
+
+    def _finish(self) -> None:
+        self._sampler.stop()
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        base = self.out_dir / f"profile-{self._stamp}"
+        stats = pstats.Stats(self._prof)
+        with self._lock:
+            for prof in self._thread_profs:
+                stats.add(prof)
+            self._thread_profs = []
+        stats.dump_stats(str(base) + ".prof")
+        self._sampler.write(Path(str(base) + ".collapsed"))
+        snap = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        with open(str(base) + "-alloc.txt", "w", encoding="utf-8") as f:
+            cur, peak = tracemalloc.get_traced_memory()
+            f.write(f"traced current={cur / 1e6:.2f}MB peak={peak / 1e6:.2f}MB\n\n")
+            for stat in snap.statistics("lineno")[: self.top]:
+                f.write(f"{stat}\n")
+            f.write("\n# top by traceback\n")
+            for stat in snap.statistics("traceback")[:5]:
+                f.write(f"\n{stat.count} blocks, {stat.size / 1024:.1f} KiB\n")
+                f.write("\n".join(stat.traceback.format()) + "\n")
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        self._prof = self._sampler = None
+        log.info("[PROFILE] written %s.prof / .collapsed / -alloc.txt", base)
+
+    @contextmanager
+    def cycle(self):
+        """Обёртка одного цикла: профилирует, если профиль запрошен."""
+        if not self._left and self._pending:
+            self._begin()
+        if not self._left:
+            yield
+            return
+        self._sampler.tags[self._sampler.thread_id] = "cycle"
+        self._prof.enable()
+        self._sampler.active.set()
+        try:
+            yield
+        finally:
+            self._sampler.active.clear()
+            self._prof.disable()
+            self._left -= 1
+            if self._left == 0:
+                try:
+                    self._finish()
+                except Exception as e:
+                    log.error("[PROFILE_ERR] %s", e)
+
+
+_PROFILER: Optional[CycleProfiler] = None
+
+
+def get_profiler() -> CycleProfiler:
+    global _PROFILER
+    if _PROFILER is None:
+        _PROFILER = CycleProfiler(
+            out_dir=os.getenv("PROFILE_DIR", "logs"),
+            sample_ms=float(os.getenv("PROFILE_SAMPLE_MS", "5")),
+        )
+        n = int(os.getenv("PROFILE_CYCLES", "0") or 0)
+        if n > 0:
+            _PROFILER.arm(n)
+    return _PROFILER
+
+
+def install_profile_signal(cycles: Optional[int] = None) -> None:
+    """SIGUSR1 → профилировать следующие cycles циклов (PROFILE_SIGNAL_CYCLES, по умолчанию 3)."""
+    if not hasattr(signal, "SIGUSR1"):
+        return
+    n = cycles or int(os.getenv("PROFILE_SIGNAL_CYCLES", "3"))
+    signal.signal(signal.SIGUSR1, lambda *_: get_profiler().arm(n))
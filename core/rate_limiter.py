@@ -0,0 +1,45 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Простой потокобезопасный token bucket: rate токенов в секунду, ёмкость burst.
+    try_acquire() — неблокирующая попытка, acquire() — ждёт токен (с таймаутом).
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0) -> None:
+        self.rate = float(rate)
+        self.burst = float(max(burst, 1.0))
+        self._tokens = self.burst
+        self._ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._ts) * self.rate)
+        self._ts = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1.0, timeout: float | None = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait_s = (tokens - self._tokens) / self.rate if self.rate > 0 else 0.05
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                wait_s = min(wait_s, left)
+            time.sleep(max(wait_s, 0.001))
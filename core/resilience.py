@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import logging
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import ccxt
+
+from .config import get_config
+from .logging_setup import log_event
+from .metrics import REST_RETRIES
+from utils.error_handler import (
+    BybitAPIError,
+    BybitRateLimit,
+    BybitTemporaryError,
+    handle_bybit_error,
+)
+
+log = logging.getLogger(__name__)
+
+# retCode из текста исключения ccxt: bybit кладёт туда тело ответа ("bybit {"retCode":10006,...}")
+_RET_CODE_RE = re.compile(r'"retCode"\s*:\s*"?(-?\d+)')
+_RET_MSG_RE = re.compile(r'"retMsg"\s*:\s*"([^"]*)"')
+
+# Для записывающих запросов (POST) повтор безопасен, только если биржа точно отклонила запрос
+# до исполнения: частотный лимит. Таймаут/5xx на create order — исход неизвестен, не повторяем.
+_WRITE_SAFE_CODES = frozenset({10006})
+
+
+class CircuitOpenError(BybitTemporaryError, ccxt.ExchangeNotAvailable):
+    """
+    Эндпоинт временно отключён предохранителем: запрос не отправлялся.
+    Заодно это ccxt.ExchangeNotAvailable (NetworkError) — код, ловящий ошибки ccxt, обработает его как сбой сети.
+    """
+
+
+def classify_error(exc: BaseException, endpoint: Optional[str] = None) -> Optional[BybitAPIError]:
+    """
+    Приводит исключение ccxt/HTTP к классам utils.error_handler.
+    retCode из ответа классифицирует handle_bybit_error; сетевые сбои — BybitTemporaryError.
+    None — ошибка не про биржу (баг в коде и т.п.).
+    """
+    if isinstance(exc, BybitAPIError):
+        return exc
+    text = str(exc)
+    m = _RET_CODE_RE.search(text)
+    if m:
+        msg = _RET_MSG_RE.search(text)
+        resp = {"retCode": int(m.group(1)), "retMsg": msg.group(1) if msg else text}
+        try:
+            handle_bybit_error(resp, endpoint=endpoint, raise_on_not_modified=True)
+        except BybitAPIError as err:
+            return err
+        return None
+    if isinstance(exc, (ccxt.RateLimitExceeded, ccxt.DDoSProtection)):
+        return BybitRateLimit(text, ret_code=10006, endpoint=endpoint)
+    if isinstance(exc, (ccxt.NetworkError, ccxt.ExchangeNotAvailable)):
+        return BybitTemporaryError(text, endpoint=endpoint)
+    if isinstance(exc, ccxt.BaseError):
+        return BybitAPIError(text, endpoint=endpoint)
+    return None
+
+
+def is_retryable_error(err: Optional[BybitAPIError], method: str = "GET") -> bool:
+    if err is None or isinstance(err, CircuitOpenError):
+        return False
+    if not isinstance(err, (BybitRateLimit, BybitTemporaryError)):
+        return False
+    if str(method).upper() == "GET":
+        return True
+    return err.ret_code in _WRITE_SAFE_CODES
+
+
+class CircuitBreaker:
+    """
+    Предохранитель одного эндпоинта: после failures подряд ошибок деградации (лимиты, 5xx,
+    таймауты) открывается на cooldown_s и отклоняет запросы сразу. Затем пропускает
+    один пробный запрос (half-open): успех закрывает, ошибка снова открывает.
+    """
+
+    def __init__(self, endpoint: str, failures: int = 5, cooldown_s: float = 30.0) -> None:
+        self.endpoint = endpoint
+        self.failures = max(1, int(failures))
+        self.cooldown_s = float(cooldown_s)
+        self._errors = 0
+        self._opened_at: Optional[float] = None
+        self._probe = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.cooldown_s:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            st = self._state()
+            if st == "closed":
+                return True
+            if st == "half-open" and not self._probe:
+                self._probe = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._errors = 0
+            self._opened_at = None
+            self._probe = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._errors += 1
+            if self._probe or self._errors >= self.failures:
+                if self._opened_at is None or self._probe:
+                    log.warning("[CIRCUIT] open %s for %.0fs after %d errors",
+                                self.endpoint, self.cooldown_s, self._errors)
+                self._opened_at = time.monotonic()
+                self._probe = False
+
+
+_BREAKERS: Dict[str, CircuitBreaker] = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    with _BREAKERS_LOCK:
+        br = _BREAKERS.get(endpoint)
+        if br is None:
+            rc = get_config().retry
+            br = CircuitBreaker(endpoint, failures=rc.cb_failures, cooldown_s=rc.cb_cooldown_s)
+            _BREAKERS[endpoint] = br
+        return br
+
+
+def breaker_states() -> Dict[str, str]:
+    """{endpoint: closed|open|half-open} для логов/метрик."""
+    with _BREAKERS_LOCK:
+        items = list(_BREAKERS.items())
+    return {ep: br.state for ep, br in items}
+
+
+def reset_breakers() -> None:
+    with _BREAKERS_LOCK:
+        _BREAKERS.clear()
+
+
+def backoff_delay(attempt: int, base_s: float, max_s: float) -> float:
+    """Экспоненциальный бэкофф с полным джиттером: U(0, min(max, base * 2**(attempt-1)))."""
+    return random.uniform(0.0, min(max_s, base_s * (2 ** (attempt - 1))))
+
+
+def call_with_retry(
+    endpoint: str,
+    fn: Callable[[], Any],
+    *,
+    method: str = "GET",
+    retries: Optional[int] = None,
+    base_s: Optional[float] = None,
+    max_s: Optional[float] = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> Any:
+    """
+    Единая обёртка биржевого вызова: предохранитель эндпоинта → вызов → классификация ошибки
+    через handle_bybit_error → повтор с джиттер-бэкоффом только для повторяемых классов.
+    Наружу уходит исходное исключение ccxt (типы для вызывающего кода не меняются);
+    открытый предохранитель — CircuitOpenError, тоже подкласс ccxt.NetworkError.
+    """
+    rc = get_config().retry
+    retries = rc.retries if retries is None else retries
+    base_s = rc.base_s if base_s is None else base_s
+    max_s = rc.max_s if max_s is None else max_s
+    breaker = get_breaker(endpoint)
+
+    attempt = 0
+    while True:
+        attempt += 1
+        if not breaker.allow():
+            raise CircuitOpenError(f"circuit open for {endpoint}", endpoint=endpoint)
+        try:
+            result = fn()
+        except Exception as e:
+            err = classify_error(e, endpoint)
+            if isinstance(err, (BybitRateLimit, BybitTemporaryError)):
+                breaker.record_failure()
+            else:
+                # бизнес-ошибка (маржа, параметры) — эндпоинт жив
+                breaker.record_success()
+            if attempt > retries or not is_retryable_error(err, method):
+                raise
+            delay = backoff_delay(attempt, base_s, max_s)
+            log_event(log, "RETRY", endpoint=endpoint, attempt=attempt, delay_s=round(delay, 3),
+                      error=type(err).__name__, ret_code=err.ret_code)
+            REST_RETRIES.labels(endpoint).inc()
+            sleep(delay)
+            continue
+        breaker.record_success()
+        return result
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from decimal import ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_UP, Decimal
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Векторный путь: если x / шаг ближе _EPS (в долях шага) к границе округления, float-арифметике
+# не доверяем и досчитываем такие элементы точно через Decimal (обычно единицы из тысяч)
+_EPS = 1e-6
+
+_ROUNDING = {"nearest": ROUND_HALF_UP, "down": ROUND_FLOOR, "up": ROUND_CEILING}
+
+
+def _dec(x) -> Decimal:
+    # str(float) — кратчайшее представление, как в ccxt.decimal_to_precision
+    return x if isinstance(x, Decimal) else Decimal(str(x))
+
+
+def _grid(step: Decimal) -> Tuple[int, int]:
+    """Шаг как дробь num / 10**scale с целыми num, scale (0.005 -> (5, 3))."""
+    sign, digits, exp = step.normalize().as_tuple()
+    num = int("".join(map(str, digits)))
+    if exp >= 0:
+        return num * 10**exp, 0
+    return num, -exp
+
+
+@dataclass(frozen=True)
+class SymbolRules:
+    """Правила округления одного инструмента: шаг цены, шаг лота, минимумы."""
+
+    symbol: str
+    tick: Decimal
+    step: Decimal
+    min_qty: Decimal
+    min_notional: Decimal
+
+    def _quantize(self, x, unit: Decimal, mode: str) -> Decimal:
+        d = _dec(x)
+        n = (d / unit).to_integral_value(rounding=_ROUNDING[mode])
+        return n * unit
+
+    def round_price(self, price, mode: str = "nearest") -> float:
+        """Цена к тик-шагу. nearest — как ccxt price_to_precision (half-up)."""
+        return float(self._quantize(price, self.tick, mode))
+
+    def floor_qty(self, qty) -> float:
+        """Количество вниз к шагу лота — как ccxt amount_to_precision (truncate)."""
+        return float(self._quantize(qty, self.step, "down"))
+
+    def ceil_qty(self, qty) -> float:
+        return float(self._quantize(qty, self.step, "up"))
+
+    def price_str(self, price, mode: str = "nearest") -> str:
+        """Цена строкой для тела запроса v5: без экспоненты (1e-05 биржа не примет)."""
+        return format(self._quantize(price, self.tick, mode), "f")
+
+    def qty_str(self, qty) -> str:
+        """Количество строкой (вниз к шагу лота), без экспоненты."""
+        return format(self._quantize(qty, self.step, "down"), "f")
+
+    def adjust(self, qty, price) -> Tuple[float, float]:
+        """
+        qty вниз к шагу, price к тику, затем поднимаем qty до min qty / min notional.
+        Всё в Decimal — без float-страховок вида * 1.0000001.
+        """
+        price_adj = self._quantize(price, self.tick, "nearest")
+        qty_adj = self._quantize(qty, self.step, "down")
+
+        need = qty_adj
+        if self.min_qty > 0:
+            need = max(need, self.min_qty)
+        if self.min_notional > 0 and price_adj > 0:
+            need = max(need, self.min_notional / price_adj)
+        if need > qty_adj:
+            qty_adj = self._quantize(need, self.step, "up")
+        return float(qty_adj), float(price_adj)
+
+
+def rules_from_market(market: Dict) -> Optional[SymbolRules]:
+    prec = market.get("precision") or {}
+    limits = market.get("limits") or {}
+    if not prec.get("price") or not prec.get("amount"):
+        return None
+    return SymbolRules(
+        symbol=market["symbol"],
+        tick=_dec(prec["price"]),
+        step=_dec(prec["amount"]),
+        min_qty=_dec((limits.get("amount") or {}).get("min") or 0),
+        min_notional=_dec((limits.get("cost") or {}).get("min") or 0),
+    )
+
+
+def is_linear_usdt(market: Dict) -> bool:
+    return bool(market.get("linear") and market.get("settle") == "USDT" and market.get("swap", True))
+
+
+class RoundingTable:
+    """
+    Предкомпилированная таблица правил по символам + векторное округление батчами.
+    Векторный путь работает в целых тиках: n = floor/round(x / tick), результат = n * num / 10**scale,
+    поэтому float на выходе совпадает с float(строка ccxt); значения у самой границы шага
+    досчитываются через Decimal.
+    """
+
+    def __init__(self, rules: Iterable[SymbolRules]) -> None:
+        self.rules: Dict[str, SymbolRules] = {r.symbol: r for r in rules}
+        self._index = {s: i for i, s in enumerate(self.rules)}
+        ordered = list(self.rules.values())
+        tick_grid = [_grid(r.tick) for r in ordered]
+        step_grid = [_grid(r.step) for r in ordered]
+        self._tick = np.array([float(r.tick) for r in ordered], dtype=float)
+        self._tick_num = np.array([g[0] for g in tick_grid], dtype=float)
+        self._tick_div = np.array([10.0 ** g[1] for g in tick_grid], dtype=float)
+        self._step = np.array([float(r.step) for r in ordered], dtype=float)
+        self._step_num = np.array([g[0] for g in step_grid], dtype=float)
+        self._step_div = np.array([10.0 ** g[1] for g in step_grid], dtype=float)
+
+    @classmethod
+    def from_markets(cls, markets: Dict[str, Dict], only_linear_usdt: bool = True) -> "RoundingTable":
+        rules = []
+        for m in markets.values():
+            if only_linear_usdt and not is_linear_usdt(m):
+                continue
+            r = rules_from_market(m)
+            if r is not None:
+                rules.append(r)
+        return cls(rules)
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self.rules
+
+    def get(self, symbol: str) -> Optional[SymbolRules]:
+        return self.rules.get(symbol)
+
+    def _idx(self, symbols: Sequence[str]) -> np.ndarray:
+        return np.fromiter((self._index[s] for s in symbols), dtype=np.int64, count=len(symbols))
+
+    def _exact(self, symbols: Sequence[str], idx: np.ndarray, values: np.ndarray, out: np.ndarray, fn) -> None:
+        for i in np.flatnonzero(idx):
+            out[i] = fn(self.rules[symbols[i]], float(values[i]))
+
+    def round_prices(self, symbols: Sequence[str], prices, mode: str = "nearest") -> np.ndarray:
+        """Батч-округление цен к тикам своих символов."""
+        idx = self._idx(symbols)
+        x = np.asarray(prices, dtype=float)
+        q = x / self._tick[idx]
+        if mode == "nearest":
+            q = q + 0.5
+        n = np.ceil(q) if mode == "up" else np.floor(q)
+        frac = q - np.floor(q)
+        tol = _EPS + np.abs(q) * 1e-12
+        ambiguous = (frac < tol) | (frac > 1.0 - tol)
+        out = (n * self._tick_num[idx]) / self._tick_div[idx]
+        self._exact(symbols, ambiguous, x, out, lambda r, v: r.round_price(v, mode))
+        return out
+
+    def floor_qtys(self, symbols: Sequence[str], qtys) -> np.ndarray:
+        """Батч-округление количеств вниз к шагу лота."""
+        idx = self._idx(symbols)
+        x = np.asarray(qtys, dtype=float)
+        q = x / self._step[idx]
+        n = np.floor(q)
+        frac = q - n
+        tol = _EPS + np.abs(q) * 1e-12
+        ambiguous = (frac < tol) | (frac > 1.0 - tol)
+        out = (n * self._step_num[idx]) / self._step_div[idx]
+        self._exact(symbols, ambiguous, x, out, lambda r, v: r.floor_qty(v))
+        return out
+
+
+_TABLE: Optional[RoundingTable] = None
+_TABLE_MARKETS_ID: Optional[int] = None
+_TABLE_LOCK = threading.Lock()
+
+
+def get_rounding_table(ex) -> RoundingTable:
+    """Таблица для загруженных рынков клиента; пересобирается, только если рынки перезагружены."""
+    global _TABLE, _TABLE_MARKETS_ID
+    markets = ex.markets or ex.load_markets()
+    with _TABLE_LOCK:
+        if _TABLE is None or _TABLE_MARKETS_ID != id(markets):
+            _TABLE = RoundingTable.from_markets(markets)
+            _TABLE_MARKETS_ID = id(markets)
+        return _TABLE
+
+
+def round_price(ex, symbol: str, price: float, mode: str = "nearest") -> float:
+    """Локальное округление цены; для символов вне таблицы — фолбэк на ccxt price_to_precision."""
+    rules = get_rounding_table(ex).get(symbol)
+    if rules is None:
+        return float(ex.price_to_precision(symbol, price))
+    return rules.round_price(price, mode)
+
+
+def price_to_precision(ex, symbol: str, price: float) -> str:
+    """Строка цены по тик-шагу (как ccxt price_to_precision) — из таблицы, вне её — через ccxt."""
+    rules = get_rounding_table(ex).get(symbol)
+    if rules is None:
+        return ex.price_to_precision(symbol, price)
+    return rules.price_str(price)
+
+
+def amount_to_precision(ex, symbol: str, qty: float) -> str:
+    """Строка количества по шагу лота (как ccxt amount_to_precision)."""
+    rules = get_rounding_table(ex).get(symbol)
+    if rules is None:
+        return ex.amount_to_precision(symbol, qty)
+    return rules.qty_str(qty)
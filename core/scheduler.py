@@ -0,0 +1,50 @@
+import threading
+import time
+from typing import Optional
+
+_TF_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def timeframe_seconds(timeframe: str) -> int:
+    """
+    '5m' -> 300, '1h' -> 3600, '1d' -> 86400.
+    Месяцы не поддерживаем — для свечного расписания они не нужны.
+    """
+    tf = (timeframe or "").strip().lower()
+    if len(tf) < 2 or tf[-1] not in _TF_UNITS:
+        raise ValueError(f"Неподдерживаемый TIMEFRAME: {timeframe!r}")
+    n = int(tf[:-1])
+    if n <= 0:
+        raise ValueError(f"Неподдерживаемый TIMEFRAME: {timeframe!r}")
+    return n * _TF_UNITS[tf[-1]]
+
+
+def last_bar_close(timeframe: str, now: Optional[float] = None) -> float:
+    """Время (epoch, сек) закрытия последнего завершённого бара."""
+    step = timeframe_seconds(timeframe)
+    now = time.time() if now is None else now
+    return float(int(now // step) * step)
+
+
+def next_bar_close(timeframe: str, now: Optional[float] = None) -> float:
+    """Время (epoch, сек) закрытия текущего (ещё формирующегося) бара."""
+    return last_bar_close(timeframe, now) + timeframe_seconds(timeframe)
+
+
+def sleep_until(ts: float, stop: Optional[threading.Event] = None, tick: float = 15.0, on_tick=None) -> bool:
+    """
+    Спит до момента ts (epoch, сек). Просыпается каждые tick секунд, чтобы
+    вызвать on_tick (хартбит). Возвращает False, если сон прерван stop-событием.
+    """
+    while True:
+        left = ts - time.time()
+        if left <= 0:
+            return True
+        chunk = min(left, tick)
+        if stop is not None:
+            if stop.wait(chunk):
+                return False
+        else:
+            time.sleep(chunk)
+        if on_tick is not None:
+            on_tick()
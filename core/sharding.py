@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import bisect
+import fcntl
+import functools
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+log = logging.getLogger(__name__)
+
+_SLOTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS open_slots (
+    symbol TEXT NOT NULL,
+    side   TEXT NOT NULL,
+    owner  INTEGER NOT NULL,
+    state  TEXT NOT NULL,   -- pending: вход отправляется; open: позиция есть на бирже
+    ts     REAL NOT NULL,
+    PRIMARY KEY (symbol, side)
+)
+"""
+
+
+def _h64(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Консистентное хэширование пар по шардам: у каждого шарда vnodes точек на кольце,
+    пара уходит к первой точке по часовой. При смене числа воркеров переезжает ~1/N пар,
+    а не почти все (как у hash % N).
+    """
+
+    def __init__(self, shards: int, vnodes: Optional[int] = None) -> None:
+        if shards < 1:
+            raise ValueError("shards must be >= 1")
+        self.shards = shards
+        vnodes = vnodes or int(os.getenv("SHARD_VNODES", "100"))
+        ring = sorted((_h64(f"shard-{s}#{v}"), s) for s in range(shards) for v in range(vnodes))
+        self._points = [p for p, _ in ring]
+        self._owners = [s for _, s in ring]
+
+    def shard_of(self, key: str) -> int:
+        i = bisect.bisect(self._points, _h64(key)) % len(self._points)
+        return self._owners[i]
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """"2/4" -> (2, 4): шард с номером 2 из 4 (нумерация с нуля)."""
+    try:
+        index, count = (int(x) for x in str(spec).split("/", 1))
+    except ValueError:
+        raise ValueError(f"shard must look like I/N, got {spec!r}")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"shard index out of range: {spec!r}")
+    return index, count
+
+
+@functools.lru_cache(maxsize=8)
+def _ring(count: int) -> HashRing:
+    return HashRing(count)
+
+
+def shard_owns(pair: str, index: int, count: int) -> bool:
+    """Принадлежит ли пара шарду index из count (для позиций, которых нет в списке пар)."""
+    return count == 1 or _ring(count).shard_of(_pair_key(pair)) == index
+
+
+def shard_pairs(pairs: Sequence[str], index: int, count: int) -> List[str]:
+    """Пары шарда index из count (порядок исходного списка сохраняется)."""
+    return [p for p in pairs if shard_owns(p, index, count)]
+
+
+def _pair_key(pair: str) -> str:
+    # BTC/USDT и BTC/USDT:USDT — одна и та же пара
+    return pair.upper().replace(" ", "").split(":", 1)[0]
+
+
+@contextmanager
+def process_lock(name: str, lock_dir: Optional[str] = None):
+    """
+    Advisory-замок процесса (fcntl.flock) на файл в LOCK_DIR (по умолчанию временная папка).
+    Замок держит открытый дескриптор: упавший процесс отпускает его вместе с дескриптором,
+    «протухших» замков не бывает, а проверка и захват — одна атомарная операция ядра.
+    """
+    d = Path(lock_dir or os.getenv("LOCK_DIR") or tempfile.gettempdir())
+    d.mkdir(parents=True, exist_ok=True)
+    path = d / name
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            holder = os.pread(fd, 32, 0).decode(errors="replace").strip() or "?"
+            raise RuntimeError(f"Already running: {path} (pid {holder})")
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, f"{os.getpid()}\n".encode(), 0)
+        yield path
+    finally:
+        os.close(fd)  # закрытие дескриптора снимает flock
+
+
+class SharedSlots:
+    """
+    Общий для всех шардов счётчик открытых сделок (MAX_OPEN_TRADES) в SQLite.
+
+    reserve() — атомарная проверка лимита и захват слота (BEGIN IMMEDIATE: одна запись
+    за раз на все процессы), так два воркера не займут последний слот одновременно.
+    Каждый воркер отвечает только за свои строки (owner = номер шарда): confirm/release
+    после входа и publish() с фактическими позициями шарда раз в цикл. Незавершённые
+    резервы старше SLOT_PENDING_TTL_S (воркер упал посреди входа) не считаются.
+    """
+
+    def __init__(self, path: Optional[str] = None, pending_ttl_s: Optional[float] = None) -> None:
+        self.path = path or os.getenv("SHARED_STATE_DB", "logs/shared.db")
+        if pending_ttl_s is None:
+            pending_ttl_s = float(os.getenv("SLOT_PENDING_TTL_S", "120"))
+        self.pending_ttl_s = pending_ttl_s
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(_SLOTS_SCHEMA)
+
+    @contextmanager
+    def _tx(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _expire(self, conn) -> None:
+        conn.execute("DELETE FROM open_slots WHERE state='pending' AND ts < ?", (time.time() - self.pending_ttl_s,))
+
+    def reserve(self, symbol: str, side: str, max_open: int, owner: int) -> bool:
+        """Занять слот под вход; False — все MAX_OPEN_TRADES слотов заняты (по всем шардам)."""
+        side = _side(side)
+        with self._tx() as conn:
+            self._expire(conn)
+            if conn.execute("SELECT 1 FROM open_slots WHERE symbol=? AND side=?", (symbol, side)).fetchone():
+                return True  # добор в уже открытую позицию новый слот не занимает
+            n = conn.execute("SELECT COUNT(*) FROM open_slots").fetchone()[0]
+            if max_open > 0 and n >= max_open:
+                return False
+            conn.execute("INSERT INTO open_slots VALUES (?, ?, ?, 'pending', ?)", (symbol, side, owner, time.time()))
+            return True
+
+    def confirm(self, symbol: str, side: str) -> None:
+        with self._tx() as conn:
+            conn.execute(
+                "UPDATE open_slots SET state='open', ts=? WHERE symbol=? AND side=?", (time.time(), symbol, _side(side))
+            )
+
+    def release(self, symbol: str, side: str) -> None:
+        with self._tx() as conn:
+            conn.execute("DELETE FROM open_slots WHERE symbol=? AND side=? AND state='pending'", (symbol, _side(side)))
+
+    def publish(self, owner: int, open_keys: Iterable[Tuple[str, str]]) -> None:
+        """Фактические позиции шарда: закрытые освобождают слоты, найденные на бирже — занимают."""
+        keys = {(s, _side(sd)) for s, sd in open_keys}
+        now = time.time()
+        with self._tx() as conn:
+            self._expire(conn)
+            rows = conn.execute("SELECT symbol, side, state FROM open_slots WHERE owner=?", (owner,)).fetchall()
+            for sym, sd, state in rows:
+                if state == "open" and (sym, sd) not in keys:
+                    conn.execute("DELETE FROM open_slots WHERE symbol=? AND side=?", (sym, sd))
+            for sym, sd in keys:
+                conn.execute(
+                    "INSERT INTO open_slots VALUES (?, ?, ?, 'open', ?) "
+                    "ON CONFLICT(symbol, side) DO UPDATE SET state='open', owner=excluded.owner, ts=excluded.ts",
+                    (sym, sd, owner, now),
+                )
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM open_slots GROUP BY state").fetchall()
+        return {state: n for state, n in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _side(side: str) -> str:
+    return "long" if (side or "").lower() in ("long", "buy") else "short"
+
+
+_SLOTS: Optional[SharedSlots] = None
+_SLOTS_LOCK = threading.Lock()
+
+
+def get_shared_slots() -> SharedSlots:
+    global _SLOTS
+    with _SLOTS_LOCK:
+        if _SLOTS is None:
+            _SLOTS = SharedSlots()
+        return _SLOTS
@@ -1,7 +1,7 @@
 from datetime import datetime, timezone
 from typing import Tuple
 
-import requests
+from .clock_sync import get_clock
 
 
 def now_utc() -> datetime:
@@ -9,15 +9,11 @@ def now_utc() -> datetime:
 
 
 def get_bybit_server_time() -> int:
-    # Public endpoint; works without auth
-    r = requests.get("https://api.bybit.com/v5/market/time", timeout=10)
-    r.raise_for_status()
-    data = r.json()
-    return int(data.get("result", {}).get("timeSecond", 0))
+    # Оценка по общему core.clock_sync (без запроса, если смещение уже замерено)
+    return get_clock().server_ms() // 1000
 
 
 def compare_bybit_time() -> Tuple[float, int]:
     server_sec = get_bybit_server_time()
-    server_dt = datetime.fromtimestamp(server_sec, tz=timezone.utc)
-    delta = abs((server_dt - now_utc()).total_seconds())
+    delta = abs(get_clock().offset_ms or 0.0) / 1000.0
     return delta, server_sec
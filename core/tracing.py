@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+# Текущий span потока; None — трассировка цикла не идёт, span() ничего не делает
+_CURRENT: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("trace_span", default=None)
+
+
+class Span:
+    """Узел дерева цикла: cycle → pair → stage → rest. rest — REST-запросы в поддереве."""
+
+    __slots__ = ("name", "cat", "trace", "parent", "start", "end", "tid", "args", "rest")
+
+    def __init__(
+        self, name: str, cat: str, trace: "CycleTrace", parent: Optional["Span"], args: Dict[str, Any]
+    ) -> None:
+        self.name = name
+        self.cat = cat
+        self.trace = trace
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.tid = threading.get_ident()
+        self.args = args
+        self.rest = 0
+
+    @property
+    def seconds(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+
+class CycleTrace:
+    """Спаны одного цикла guard'а; пишется в Chrome trace JSON (chrome://tracing, ui.perfetto.dev)."""
+
+    def __init__(self, cycle_id: str, budget_s: float) -> None:
+        self.cycle_id = cycle_id
+        self.budget_s = budget_s
+        self.wall0 = time.time()
+        self.root = Span("cycle", "cycle", self, None, {"cycle": cycle_id})
+        self.perf0 = self.root.start
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def _close(self, sp: Span) -> None:
+        sp.end = time.perf_counter()
+        with self._lock:
+            self.spans.append(sp)
+            if sp.parent is not None:
+                sp.parent.rest += sp.rest
+
+    def chrome_events(self) -> List[Dict[str, Any]]:
+        pid = os.getpid()
+        tids: Dict[int, int] = {}
+        names = {t.ident: t.name for t in threading.enumerate()}
+        events: List[Dict[str, Any]] = []
+        for sp in sorted(self.spans, key=lambda s: s.start):
+            tid = tids.setdefault(sp.tid, len(tids) + 1)
+            events.append({
+                "name": sp.name,
+                "cat": sp.cat,
+                "ph": "X",
+                "ts": round((sp.start - self.perf0) * 1e6 + self.wall0 * 1e6),
+                "dur": round((sp.end - sp.start) * 1e6),
+                "pid": pid,
+                "tid": tid,
+                "args": dict(sp.args, rest=sp.rest),
+            })
+        for ident, tid in tids.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                           "args": {"name": names.get(ident, f"thread-{ident}")}})
+        return events
+
+    def summary(self, top: int = 3) -> Dict[str, Any]:
+        """Итог цикла: длительность против бюджета, самые медленные пары и стадии."""
+        pairs: Dict[str, List[float]] = {}
+        stages: Dict[str, List[float]] = {}
+        for s in self.spans:
+            if s.cat in ("pair", "stage"):
+                agg = (pairs if s.cat == "pair" else stages).setdefault(s.name, [0.0, 0])
+                agg[0] += s.seconds
+                agg[1] += s.rest
+        total = self.root.seconds
+        return {
+            "total_ms": round(total * 1000.0, 1),
+            "budget_ms": round(self.budget_s * 1000.0),
+            "budget_pct": round(100.0 * total / self.budget_s, 2) if self.budget_s > 0 else None,
+            "rest": self.root.rest,
+            "slow_pairs": _top(pairs, "pair", top),
+            "slow_stages": _top(stages, "stage", top),
+        }
+
+    def write(self, out_dir: Path, keep: int) -> Path:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.wall0))
+        path = out_dir / f"trace-{stamp}-{self.cycle_id}.json"
+        doc = {"traceEvents": self.chrome_events(), "displayTimeUnit": "ms",
+               "otherData": {"cycle": self.cycle_id, **self.summary()}}
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(doc, default=str), encoding="utf-8")
+        os.replace(tmp, path)
+        if keep > 0:
+            old = sorted(out_dir.glob("trace-*.json"))[:-keep]
+            for p in old:
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
+        return path
+
+
+def _top(agg: Dict[str, List[float]], key: str, n: int) -> List[Dict[str, Any]]:
+    ranked = sorted(agg.items(), key=lambda kv: kv[1][0], reverse=True)[:n]
+    return [{key: k, "ms": round(v[0] * 1000.0, 1), "rest": v[1]} for k, v in ranked]
+
+
+@contextmanager
+def span(name: str, cat: str = "stage", **args: Any):
+    """with span("predict"): ... — дочерний span текущего; вне трассируемого цикла — no-op."""
+    parent = _CURRENT.get()
+    if parent is None:
+        yield None
+        return
+    sp = Span(name, cat, parent.trace, parent, args)
+    token = _CURRENT.set(sp)
+    try:
+        yield sp
+    finally:
+        _CURRENT.reset(token)
+        parent.trace._close(sp)
+
+
+@contextmanager
+def rest_span(endpoint: str):
+    """Одна попытка REST-запроса: span категории rest, засчитывается всем предкам."""
+    with span(endpoint, cat="rest") as sp:
+        if sp is not None:
+            sp.rest = 1
+        yield sp
+
+
+def _format_summary(s: Dict[str, Any]) -> str:
+    pairs = " ".join(f"{p['pair']}={p['ms'] / 1000:.2f}s/{p['rest']}r" for p in s["slow_pairs"]) or "-"
+    stages = " ".join(f"{p['stage']}={p['ms'] / 1000:.2f}s/{p['rest']}r" for p in s["slow_stages"]) or "-"
+    pct = f"{s['budget_pct']:.1f}%" if s["budget_pct"] is not None else "n/a"
+    return (f"[BUDGET] cycle {s['total_ms'] / 1000:.2f}s of {s['budget_ms'] / 1000:.0f}s ({pct}) "
+            f"rest={s['rest']} | pairs: {pairs} | stages: {stages}")
+
+
+@contextmanager
+def cycle_trace(cycle_id: str, budget_s: float):
+    """
+    Трассировка одного цикла (TRACE=0 — выключено): корневой span, по завершении —
+    logs/traces/trace-*.json (TRACE_DIR, храним TRACE_KEEP последних) и строка [BUDGET] в лог.
+    При загрузке цикла больше TRACE_BUDGET_WARN (доля бюджета) строка идёт с уровнем WARNING.
+    """
+    if os.getenv("TRACE", "1") == "0":
+        yield None
+        return
+    trace = CycleTrace(cycle_id, budget_s)
+    token = _CURRENT.set(trace.root)
+    try:
+        yield trace
+    finally:
+        _CURRENT.reset(token)
+        trace._close(trace.root)
+        try:
+            s = trace.summary(top=int(os.getenv("TRACE_TOP", "3")))
+            warn = float(os.getenv("TRACE_BUDGET_WARN", "0.5"))
+            over = s["budget_pct"] is not None and s["budget_pct"] >= warn * 100.0
+            log.log(logging.WARNING if over else logging.INFO, _format_summary(s), extra={"fields": s})
+            trace.write(Path(os.getenv("TRACE_DIR", "logs/traces")), keep=int(os.getenv("TRACE_KEEP", "200")))
+        except Exception as e:
+            log.error("[TRACE_ERR] %s", e)
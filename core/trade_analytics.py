@@ -0,0 +1,362 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from .accounts import PerAccount
+
+log = logging.getLogger(__name__)
+
+# События входа: market/batch пишут order_placed, maker — order_filled (по одному order_id — один вход)
+_ENTRY_EVENTS = ("order_placed", "order_filled")
+_CLOSE_EVENT = "position_closed"
+_SEEN_MAX = 50_000
+# closed-pnl отдаёт до 100 записей на страницу; больше страниц за окно — не про этот бот
+_CLOSED_PNL_PAGES = 20
+# окно одного запроса closed-pnl — не больше 7 суток; история на бирже — 2 года
+_CLOSED_PNL_WINDOW_MS = 7 * 86_400 * 1000
+_CLOSED_PNL_HISTORY_MS = 730 * 86_400 * 1000
+# Сколько после закрытия дочитывать closed-pnl каждый цикл, если запись ещё не появилась
+_CLOSED_PNL_WAIT_S = 300.0
+
+
+def _side_key(side: Any) -> str:
+    return "long" if str(side or "").lower() in ("long", "buy") else "short"
+
+
+def _day(ts: float) -> str:
+    return datetime.fromtimestamp(float(ts), tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+def _f(v: Any) -> float:
+    try:
+        return float(v) if v not in (None, "") else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _day_start_ms(ts: Optional[float] = None) -> int:
+    """Начало текущих суток UTC в мс — с него считается DAILY_LOSS_LIMIT."""
+    t = time.time() if ts is None else ts
+    return int(t // 86_400 * 86_400 * 1000)
+
+
+def fetch_closed_pnl(ex, since_ms: int, until_ms: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Реализованный PnL закрытий с биржи (/v5/position/closed-pnl, linear) за [since_ms, until_ms]
+    (по умолчанию — до сейчас): окнами по 7 суток (предел биржи), внутри окна — по курсору.
+    Запись: id (orderId закрытия), symbol, side позиции, pnl, ts.
+    """
+    now_ms = int(time.time() * 1000)
+    end = now_ms if until_ms is None else min(int(until_ms), now_ms)
+    start = max(int(since_ms), now_ms - _CLOSED_PNL_HISTORY_MS)
+    out: List[Dict[str, Any]] = []
+    while start < end:
+        stop = min(start + _CLOSED_PNL_WINDOW_MS, end)
+        out.extend(_closed_pnl_window(ex, start, stop))
+        start = stop
+    return out
+
+
+def _closed_pnl_window(ex, start_ms: int, end_ms: int) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    params: Dict[str, Any] = {"category": "linear", "startTime": start_ms, "endTime": end_ms, "limit": 100}
+    for _ in range(_CLOSED_PNL_PAGES):
+        result = (ex.privateGetV5PositionClosedPnl(params) or {}).get("result") or {}
+        for r in result.get("list") or []:
+            out.append({
+                "id": r.get("orderId"),
+                "symbol": ex.safe_symbol(r.get("symbol"), None, None, "swap"),
+                # side — сторона закрывающего ордера: Sell закрывает long
+                "side": "long" if str(r.get("side") or "").lower() == "sell" else "short",
+                "pnl": _f(r.get("closedPnl")),
+                "ts": _f(r.get("updatedTime") or r.get("createdTime")) / 1000.0,
+            })
+        cursor = result.get("nextPageCursor")
+        if not cursor or not result.get("list"):
+            break
+        params = {**params, "cursor": cursor}
+    return out
+
+
+@dataclass
+class Aggregate:
+    """PnL/счётчики по символу или по дню."""
+
+    realized_pnl: float = 0.0
+    closed: int = 0
+    wins: int = 0
+    losses: int = 0
+    entries: int = 0
+    entry_notional: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.wins / self.closed if self.closed else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        d = asdict(self)
+        d["hit_rate"] = round(self.hit_rate, 4)
+        return d
+
+
+class TradeAnalytics:
+    """
+    Агрегаты для лимитов риска и отчётов: реализованный PnL, число сделок и hit-rate по символам
+    и дням, открытые позиции и экспозиция. Чтение — O(1).
+    Источники: открытые позиции — position_state (его каждый цикл сверяет с биржей монитор,
+    sync_open), реализованный PnL — closed-pnl биржи (ingest_closed_pnl; при пересборке — за весь
+    период журнала), входы — события журнала (on_event, rebuild). position_closed из журнала
+    PnL не даёт: там оценка по тикеру.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.by_symbol: Dict[str, Aggregate] = defaultdict(Aggregate)
+        self.by_day: Dict[str, Aggregate] = defaultdict(Aggregate)
+        # (symbol, long|short) -> [qty, notional]
+        self.open: Dict[Tuple[str, str], list] = {}
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._seen_closed: "OrderedDict[str, None]" = OrderedDict()
+        self.awaiting_close = 0  # закрытия, чей closed-pnl биржа ещё не отдала
+        self.await_until = 0.0
+        self.events = 0
+
+    # --- инкрементально ---
+    def on_event(self, row: Dict[str, Any]) -> None:
+        """Событие журнала: вход сразу попадает в открытые (до следующей сверки монитором)."""
+        event = row.get("event")
+        if event not in _ENTRY_EVENTS and event != _CLOSE_EVENT:
+            return
+        if str(row.get("mode") or "LIVE").upper() == "DRY":
+            return
+        sym = row.get("symbol") or ""
+        key = (sym, _side_key(row.get("side")))
+        day = _day(row.get("ts") or time.time())
+        with self._lock:
+            self.events += 1
+            if event == _CLOSE_EVENT:
+                self.open.pop(key, None)
+                return
+            oid = row.get("order_id")
+            if oid:
+                if oid in self._seen:
+                    return
+                self._seen[oid] = None
+                if len(self._seen) > _SEEN_MAX:
+                    self._seen.popitem(last=False)
+            qty = _f(row.get("qty"))
+            notional = qty * _f(row.get("price"))
+            for agg in (self.by_symbol[sym], self.by_day[day]):
+                agg.entries += 1
+                agg.entry_notional += notional
+            pos = self.open.setdefault(key, [0.0, 0.0])
+            pos[0] += qty
+            pos[1] += notional
+
+    def sync_open(self, states: Iterable[Any]) -> None:
+        """Открытые позиции = position_state (symbol, side, qty, entry), сверенный с биржей."""
+        fresh = {}
+        for st in states:
+            qty = _f(getattr(st, "qty", 0.0))
+            fresh[(st.symbol, _side_key(st.side))] = [qty, qty * _f(getattr(st, "entry", 0.0))]
+        with self._lock:
+            self.open = fresh
+
+    def ingest_closed_pnl(self, records: Iterable[Dict[str, Any]]) -> int:
+        """Записи closed-pnl (fetch_closed_pnl) → реализованный PnL; повторы по id пропускаются."""
+        new = 0
+        with self._lock:
+            for r in records:
+                rid = r.get("id")
+                if rid:
+                    if rid in self._seen_closed:
+                        continue
+                    self._seen_closed[rid] = None
+                    if len(self._seen_closed) > _SEEN_MAX:
+                        self._seen_closed.popitem(last=False)
+                pnl = _f(r.get("pnl"))
+                for agg in (self.by_symbol[r.get("symbol") or ""], self.by_day[_day(r.get("ts") or time.time())]):
+                    agg.realized_pnl += pnl
+                    agg.closed += 1
+                    agg.wins += pnl > 0
+                    agg.losses += pnl < 0
+                new += 1
+            self.awaiting_close = max(0, self.awaiting_close - new)
+        return new
+
+    def observe_positions(self, states: Iterable[Any], closed: int = 0, now: Optional[float] = None) -> int:
+        """
+        Сверка после прохода монитора: открытые — из position_state; closed закрытий ждут своего
+        closed-pnl не дольше _CLOSED_PNL_WAIT_S. Возвращает число ещё не пришедших закрытий.
+        """
+        self.sync_open(states)
+        now = time.time() if now is None else now
+        with self._lock:
+            if closed:
+                self.awaiting_close += closed
+                self.await_until = now + _CLOSED_PNL_WAIT_S
+            elif self.awaiting_close and now >= self.await_until:
+                log.warning("[ANALYTICS] closed-pnl не пришёл для %d закрытий — перестаю ждать", self.awaiting_close)
+                self.awaiting_close = 0
+            return self.awaiting_close
+
+    # --- пересборка из истории ---
+    def rebuild(
+        self,
+        rows: Iterable[Dict[str, Any]] | pd.DataFrame,
+        closed_pnl: Iterable[Dict[str, Any]] = (),
+    ) -> "TradeAnalytics":
+        """
+        Счётчики входов из событий журнала (строки или DataFrame) и реализованный PnL/hit-rate
+        из записей closed-pnl (fetch_closed_pnl за период журнала) — groupby вместо цикла по строкам.
+        """
+        df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(list(rows))
+        with self._lock:
+            self._reset()
+            self._rebuild_closed(pd.DataFrame(list(closed_pnl), columns=["id", "symbol", "side", "pnl", "ts"]))
+            if df.empty:
+                return self
+            df = df[df["event"].isin(_ENTRY_EVENTS)]
+            df = df[df["mode"].fillna("LIVE").str.upper() != "DRY"].sort_values("ts", kind="stable")
+            if df.empty:
+                return self
+            self.events = len(df)
+            df = df.assign(
+                day=pd.to_datetime(df["ts"].astype(float), unit="s", utc=True).dt.strftime("%Y-%m-%d"),
+                qty=pd.to_numeric(df["qty"], errors="coerce").fillna(0.0),
+                price=pd.to_numeric(df["price"], errors="coerce").fillna(0.0),
+            )
+            has_id = df["order_id"].notna() & (df["order_id"] != "")
+            entries = pd.concat([df[has_id].drop_duplicates("order_id"), df[~has_id]]).sort_values("ts")
+            entries = entries.assign(notional=entries["qty"] * entries["price"])
+            for col, target in (("symbol", self.by_symbol), ("day", self.by_day)):
+                e = entries.groupby(col).agg(entries=("qty", "size"), entry_notional=("notional", "sum"))
+                for name, r in e.iterrows():
+                    agg = target[name]
+                    agg.entries = int(r["entries"])
+                    agg.entry_notional = float(r["entry_notional"])
+            ids = entries["order_id"]
+            for oid in ids[ids.notna() & (ids != "")].tail(_SEEN_MAX):
+                self._seen[oid] = None
+        return self
+
+    def _rebuild_closed(self, cp: pd.DataFrame) -> None:
+        """PnL/закрытия/выигрыши по символу и дню из closed-pnl (под self._lock, после _reset)."""
+        if cp.empty:
+            return
+        has_id = cp["id"].notna() & (cp["id"] != "")
+        cp = pd.concat([cp[has_id].drop_duplicates("id"), cp[~has_id]])
+        cp = cp.assign(
+            symbol=cp["symbol"].fillna(""),
+            pnl=pd.to_numeric(cp["pnl"], errors="coerce").fillna(0.0),
+            day=pd.to_datetime(pd.to_numeric(cp["ts"], errors="coerce").fillna(time.time()), unit="s", utc=True)
+            .dt.strftime("%Y-%m-%d"),
+        )
+        cp = cp.assign(win=(cp["pnl"] > 0).astype(int), loss=(cp["pnl"] < 0).astype(int))
+        for col, target in (("symbol", self.by_symbol), ("day", self.by_day)):
+            g = cp.groupby(col).agg(realized_pnl=("pnl", "sum"), closed=("pnl", "size"),
+                                    wins=("win", "sum"), losses=("loss", "sum"))
+            for name, r in g.iterrows():
+                agg = target[name]
+                agg.realized_pnl = float(r["realized_pnl"])
+                agg.closed = int(r["closed"])
+                agg.wins = int(r["wins"])
+                agg.losses = int(r["losses"])
+        ids = cp["id"]
+        for rid in ids[ids.notna() & (ids != "")].tail(_SEEN_MAX):
+            self._seen_closed[rid] = None
+
+    # --- чтение (O(1)) ---
+    def open_trades(self) -> int:
+        with self._lock:
+            return len(self.open)
+
+    def exposure(self) -> float:
+        with self._lock:
+            return float(sum(v[1] for v in self.open.values()))
+
+    def daily_pnl(self, day: Optional[str] = None) -> float:
+        with self._lock:
+            agg = self.by_day.get(day or _day(time.time()))
+            return agg.realized_pnl if agg else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        today = _day(time.time())
+        with self._lock:
+            return {
+                "events": self.events,
+                "open_trades": len(self.open),
+                "exposure": round(sum(v[1] for v in self.open.values()), 4),
+                "today": self.by_day[today].as_dict() if today in self.by_day else Aggregate().as_dict(),
+                "symbols": {s: a.as_dict() for s, a in self.by_symbol.items()},
+            }
+
+
+def _load(account: Optional[str]) -> TradeAnalytics:
+    from .bybit_exchange import get_exchange
+    from .position_state import get_state_store
+    from .trade_journal import get_journal
+    from .trade_log import FIELDS, flush_trade_log
+
+    flush_trade_log()
+    df = pd.DataFrame(get_journal().query(event=list(_ENTRY_EVENTS)), columns=FIELDS)
+    # PnL — за весь период журнала (с первого входа), но не меньше чем за текущие сутки
+    since_ms = _day_start_ms()
+    first = pd.to_numeric(df["ts"], errors="coerce").min()
+    if pd.notna(first):
+        since_ms = min(since_ms, int(first * 1000))
+    closed: List[Dict[str, Any]] = []
+    failed = None
+    try:
+        closed = fetch_closed_pnl(get_exchange(), since_ms)
+    except Exception as e:
+        failed = e
+    a = TradeAnalytics().rebuild(df, closed)
+    a.sync_open(get_state_store().all())
+    if failed is not None:
+        # без PnL не блокируем: монитор догрузит closed-pnl за сутки на следующем цикле
+        log.warning("[ANALYTICS] closed-pnl: %s", failed)
+        a.awaiting_close, a.await_until = 1, time.time() + _CLOSED_PNL_WAIT_S
+    return a
+
+
+_ANALYTICS: PerAccount[TradeAnalytics] = PerAccount(_load)
+
+
+def get_analytics() -> TradeAnalytics:
+    """
+    Экземпляр текущего аккаунта: при первом обращении — счётчики входов из журнала,
+    открытые позиции из position_state и PnL из closed-pnl биржи за период журнала; дальше
+    обновляется событиями append_trade_event и сверкой после монитора (sync_positions).
+    """
+    return _ANALYTICS.get()
+
+
+def on_trade_event(row: Dict[str, Any]) -> None:
+    """Хук trade_log: обновляет агрегаты, только если они уже подняты (без пересборки на пути ордера)."""
+    a = _ANALYTICS.peek()
+    if a is not None:
+        a.on_event(row)
+
+
+def sync_positions(ex, states: Iterable[Any], closed: int = 0) -> None:
+    """
+    После прохода монитора: открытые — из сверенного position_state; если позиции закрылись
+    (или их closed-pnl ещё не пришёл) — дочитываем реализованный PnL за сутки с биржи.
+    """
+    a = _ANALYTICS.peek()
+    if a is None:
+        return
+    if a.observe_positions(states, closed):
+        a.ingest_closed_pnl(fetch_closed_pnl(ex, _day_start_ms()))
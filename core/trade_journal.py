@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import csv
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from .accounts import PerAccount, account_path
+from .trade_log import FIELDS
+
+log = logging.getLogger(__name__)
+
+# Старый формат logs/trades.csv (до core/trade_log.py): сигналы без ордеров
+LEGACY_FIELDS = ["ts", "pair", "signal", "confidence", "price", "tp", "sl", "dry_run"]
+
+_NUMERIC = ("qty", "price", "sl", "tp")
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS events (
+        id       INTEGER PRIMARY KEY,
+        ts       REAL NOT NULL,
+        event    TEXT NOT NULL,
+        symbol   TEXT,
+        side     TEXT,
+        qty      REAL,
+        price    REAL,
+        sl       REAL,
+        tp       REAL,
+        order_id TEXT,
+        link_id  TEXT,
+        mode     TEXT,
+        extra    TEXT,
+        uid      TEXT NOT NULL UNIQUE
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_events_ts ON events (ts)",
+    "CREATE INDEX IF NOT EXISTS ix_events_symbol_ts ON events (symbol, ts)",
+    "CREATE INDEX IF NOT EXISTS ix_events_event_ts ON events (event, ts)",
+]
+
+_COLUMNS = FIELDS + ["uid"]
+_INSERT = f"INSERT OR IGNORE INTO events ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' for _ in _COLUMNS)})"
+
+
+def _num(v: Any) -> Optional[float]:
+    if v in (None, "", "None"):
+        return None
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def _symbol(s: str) -> str:
+    s = (s or "").upper().replace(" ", "")
+    if s and ":" not in s and "/" in s:
+        quote = s.split("/")[1]
+        s = f"{s}:{quote}"
+    return s
+
+
+def _uid(row: Dict[str, Any]) -> str:
+    """Ключ идемпотентности: повторный импорт того же файла не дублирует события."""
+    # None пишется в CSV как "" — приводим так же, чтобы живое событие и его строка в CSV совпали
+    raw = "\x1f".join("" if row.get(k) is None else str(row.get(k)) for k in FIELDS)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def normalize_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Строка формата core.trade_log.FIELDS -> запись журнала (числа — float, пустые — None)."""
+    out = {k: row.get(k) for k in FIELDS}
+    out["ts"] = float(row.get("ts") or 0.0)
+    for k in _NUMERIC:
+        out[k] = _num(out[k])
+    for k in ("order_id", "link_id", "extra", "mode", "side", "symbol"):
+        v = out[k]
+        out[k] = None if v in (None, "", "None") else str(v)
+    out["uid"] = _uid(row)
+    return out
+
+
+def normalize_legacy(values: List[str]) -> Dict[str, Any]:
+    """
+    Строка старого формата ts(ISO),pair,signal,confidence,price,tp,sl,dry_run -> событие "signal".
+    """
+    d = dict(zip(LEGACY_FIELDS, values))
+    signal = (d.get("signal") or "").lower()
+    row = {
+        "ts": datetime.fromisoformat(d["ts"]).timestamp(),
+        "event": "signal",
+        "symbol": _symbol(d.get("pair", "")),
+        "side": {"long": "buy", "short": "sell"}.get(signal, signal),
+        "qty": "",
+        "price": d.get("price"),
+        "sl": d.get("sl"),
+        "tp": d.get("tp"),
+        "order_id": "",
+        "link_id": "",
+        "mode": "DRY" if str(d.get("dry_run", "")).lower() == "true" else "LIVE",
+        "extra": f"confidence={d.get('confidence', '')}",
+    }
+    return normalize_row(row)
+
+
+def parse_csv_rows(lines: Iterable[List[str]]) -> Iterator[Dict[str, Any]]:
+    """
+    Разбирает CSV, где вперемешку строки старого и нового формата (заголовок может быть
+    только один — от старого формата). Формат определяется по каждой строке.
+    """
+    for values in lines:
+        if not values or values[0] == "ts":
+            continue
+        try:
+            if len(values) == len(LEGACY_FIELDS) and not _is_epoch(values[0]):
+                yield normalize_legacy(values)
+            else:
+                # новые строки: FIELDS; лишние поля (переносы в extra) склеиваем обратно
+                if len(values) > len(FIELDS):
+                    values = values[: len(FIELDS) - 1] + [",".join(values[len(FIELDS) - 1:])]
+                yield normalize_row(dict(zip(FIELDS, values)))
+        except (ValueError, KeyError) as e:
+            log.warning("[JOURNAL] skip malformed row: %s %s", values[:3], e)
+
+
+def _is_epoch(v: str) -> bool:
+    try:
+        float(v)
+        return True
+    except ValueError:
+        return False
+
+
+class TradeJournal:
+    """
+    Журнал торговых событий в SQLite (WAL) с индексами по ts, (symbol, ts), (event, ts):
+    диапазонные и посимвольные выборки не читают весь лог.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or os.getenv("TRADE_JOURNAL_DB", "logs/journal.db")
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        with self._conn:
+            for stmt in _SCHEMA:
+                self._conn.execute(stmt)
+
+    def append_many(self, rows: Iterable[Dict[str, Any]], *, normalized: bool = False) -> int:
+        recs = [r if normalized else normalize_row(r) for r in rows]
+        if not recs:
+            return 0
+        with self._lock, self._conn:
+            cur = self._conn.executemany(_INSERT, [[r[c] for c in _COLUMNS] for r in recs])
+            return cur.rowcount
+
+    def append(self, row: Dict[str, Any]) -> int:
+        return self.append_many([row])
+
+    def import_csv(self, path: str, chunk: int = 5000) -> Dict[str, int]:
+        """Импорт logs/trades.csv любого (в т.ч. смешанного) формата. Повторный импорт безопасен."""
+        seen = inserted = 0
+        buf: List[Dict[str, Any]] = []
+        with open(path, newline="", encoding="utf-8") as f:
+            for rec in parse_csv_rows(csv.reader(f)):
+                buf.append(rec)
+                seen += 1
+                if len(buf) >= chunk:
+                    inserted += self.append_many(buf, normalized=True)
+                    buf.clear()
+        inserted += self.append_many(buf, normalized=True)
+        return {"rows": seen, "inserted": inserted, "duplicates": seen - inserted}
+
+    def _where(self, start, end, symbol, event):
+        cond, args = [], []
+        if start is not None:
+            cond.append("ts >= ?")
+            args.append(float(start))
+        if end is not None:
+            cond.append("ts < ?")
+            args.append(float(end))
+        if symbol:
+            cond.append("symbol = ?")
+            args.append(_symbol(symbol))
+        if event:
+            events = [event] if isinstance(event, str) else list(event)
+            cond.append(f"event IN ({', '.join('?' for _ in events)})")
+            args.extend(events)
+        return (" WHERE " + " AND ".join(cond)) if cond else "", args
+
+    def query(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        *,
+        symbol: Optional[str] = None,
+        event: Optional[Any] = None,
+        limit: Optional[int] = None,
+        desc: bool = False,
+    ) -> Iterator[Dict[str, Any]]:
+        """События в [start, end) по времени, опционально по символу/типу(ам). Курсор, без загрузки всего."""
+        where, args = self._where(start, end, symbol, event)
+        sql = f"SELECT {', '.join(FIELDS)} FROM events{where} ORDER BY ts {'DESC' if desc else 'ASC'}"
+        if limit:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        if self.path == ":memory:":
+            with self._lock:
+                rows = self._conn.execute(sql, args).fetchall()
+            yield from (dict(r) for r in rows)
+            return
+        # Отдельное читающее соединение: WAL позволяет читать параллельно с записью,
+        # результат отдаётся порциями, а не целиком в память
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        try:
+            cur = conn.execute(sql, args)
+            while True:
+                rows = cur.fetchmany(1000)
+                if not rows:
+                    break
+                for r in rows:
+                    yield dict(r)
+        finally:
+            conn.close()
+
+    def count(self, start=None, end=None, *, symbol=None, event=None) -> int:
+        where, args = self._where(start, end, symbol, event)
+        with self._lock:
+            return int(self._conn.execute(f"SELECT COUNT(*) FROM events{where}", args).fetchone()[0])
+
+    def symbols(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT DISTINCT symbol FROM events WHERE symbol IS NOT NULL")]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# Журнал на аккаунт (core.accounts): logs/journal.db, logs/journal.sub1.db, ...
+_JOURNALS: PerAccount[TradeJournal] = PerAccount(
+    lambda acc: TradeJournal(account_path(os.getenv("TRADE_JOURNAL_DB", "logs/journal.db"), acc))
+)
+
+
+def get_journal() -> TradeJournal:
+    return _JOURNALS.get()
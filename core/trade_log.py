@@ -1,9 +1,19 @@
 # core/trade_log.py
+import atexit
+import contextvars
 import csv
+import logging
 import os
+import queue
+import sys
+import threading
 import time
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional
+
+from .accounts import ACCOUNT, PerAccount, account_path
+
+log = logging.getLogger(__name__)
 
 LOG_PATH = Path(os.getenv("TRADE_LOG_PATH", "logs/trades.csv"))
 LOG_TO_STDOUT = (
@@ -25,13 +35,19 @@ FIELDS = [
     "extra",
 ]
 
+# Фоновая запись: TRADE_LOG_ASYNC=0 — старое поведение (синхронно на каждый event)
+_ASYNC = os.getenv("TRADE_LOG_ASYNC", "1") != "0"
+# fsync: event — после каждой пачки записей, interval — не чаще TRADE_LOG_FSYNC_INTERVAL_S,
+# shutdown — только при остановке (ОС сбрасывает кэш сама)
+_FSYNC = os.getenv("TRADE_LOG_FSYNC", "interval").lower()
+_FSYNC_INTERVAL_S = float(os.getenv("TRADE_LOG_FSYNC_INTERVAL_S", "1.0"))
+_QUEUE_MAX = int(os.getenv("TRADE_LOG_QUEUE", "10000"))
+_BATCH_MAX = 256
+# Дублировать события в индексируемый журнал (core/trade_journal.py, SQLite)
+_JOURNAL = os.getenv("TRADE_JOURNAL", "1") != "0"
 
-def append_trade_event(row: Dict) -> None:
-    # подготовка CSV
-    LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
-    write_header = not LOG_PATH.exists()
 
-    # значения по умолчанию
+def _with_defaults(row: Dict) -> Dict:
     row = dict(row)
     row.setdefault("ts", time.time())
     row.setdefault("extra", "")
@@ -40,20 +56,186 @@ def append_trade_event(row: Dict) -> None:
     row.setdefault("order_id", "")
     row.setdefault("link_id", "")
     row.setdefault("mode", "LIVE")
+    return row
+
+
+_ECHO_FIELDS = ("event", "symbol", "side", "qty", "price", "sl", "tp", "order_id", "link_id", "mode")
+
+
+def _print_row(row: Dict) -> None:
+    log.info("TRADE", extra={"fields": {k: row.get(k) for k in _ECHO_FIELDS}})
+
+
+def _to_journal(rows: List[Dict]) -> None:
+    if not _JOURNAL:
+        return
+    try:
+        from .trade_journal import get_journal
+
+        get_journal().append_many(rows)
+    except Exception as e:
+        log.error("[JOURNAL_ERR] %s", e)
+
+
+def _append_sync(row: Dict) -> None:
+    # подготовка CSV (у каждого аккаунта свой файл)
+    path = Path(account_path(str(LOG_PATH), ACCOUNT.get()))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_header = not path.exists()
 
     # запись в CSV
-    with LOG_PATH.open("a", newline="", encoding="utf-8") as f:
+    with path.open("a", newline="", encoding="utf-8") as f:
         w = csv.DictWriter(f, fieldnames=FIELDS)
         if write_header:
             w.writeheader()
         w.writerow({k: row.get(k, "") for k in FIELDS})
         f.flush()
+    _to_journal([row])
 
     # печать в stdout (Railway logs)
     if LOG_TO_STDOUT:
-        print(
-            f"[TRADE] event={row.get('event')} "
-            f"sym={row.get('symbol')} side={row.get('side')} qty={row.get('qty')} "
-            f"px={row.get('price')} sl={row.get('sl')} tp={row.get('tp')} "
-            f"order_id={row.get('order_id')} link_id={row.get('link_id')} mode={row.get('mode')}"
-        )
+        _print_row(row)
+
+
+class _TradeLogWriter:
+    """
+    Один поток-писатель: держит CSV открытым, пишет пачками из ограниченной очереди.
+    На пути ордера остаётся только put в очередь (микросекунды); файл, stdout и fsync — здесь.
+    У каждого аккаунта свой писатель: поток работает в контексте своего аккаунта (журнал, логи).
+    """
+
+    def __init__(
+        self, path: Path, fsync: str = _FSYNC, queue_max: int = _QUEUE_MAX, account: Optional[str] = None
+    ) -> None:
+        self.path = path
+        self.fsync = fsync
+        self._q: "queue.Queue[Optional[Dict]]" = queue.Queue(maxsize=max(1, queue_max))
+        self._file = None
+        self._writer = None
+        self._last_fsync = time.monotonic()
+        ctx = contextvars.Context()
+        ctx.run(ACCOUNT.set, account)
+        name = f"trade-log-{account}" if account else "trade-log"
+        self._thread = threading.Thread(target=ctx.run, args=(self._run,), name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, row: Dict) -> None:
+        try:
+            self._q.put_nowait(row)
+        except queue.Full:
+            # Очередь переполнена — притормаживаем вызывающего, но событие не теряем
+            self._q.put(row)
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.path.open("a", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=FIELDS)
+        if self._file.tell() == 0:
+            self._writer.writeheader()
+
+    def _write(self, rows: List[Dict]) -> None:
+        if self._file is None:
+            self._open()
+        self._writer.writerows({k: r.get(k, "") for k in FIELDS} for r in rows)
+        self._file.flush()
+        now = time.monotonic()
+        if self.fsync == "event" or (self.fsync == "interval" and now - self._last_fsync >= _FSYNC_INTERVAL_S):
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+        _to_journal(rows)
+        if LOG_TO_STDOUT:
+            for r in rows:
+                _print_row(r)
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            item = self._q.get()
+            batch, marks = [], [item]
+            while len(marks) < _BATCH_MAX:
+                try:
+                    marks.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            for m in marks:
+                if m is None:
+                    stop = True
+                elif isinstance(m, threading.Event):
+                    continue
+                else:
+                    batch.append(m)
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    log.error("[TRADE_LOG_ERR] %s", e)
+            # маркеры flush() отпускаем только после записи всего, что стояло перед ними
+            for m in marks:
+                if isinstance(m, threading.Event):
+                    m.set()
+            for _ in marks:
+                self._q.task_done()
+        self._close_file()
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            finally:
+                self._file.close()
+                self._file = None
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Дождаться записи всего, что уже в очереди."""
+        done = threading.Event()
+        self._q.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        self._q.put(None)
+        self._thread.join(timeout)
+
+
+_WRITERS: PerAccount[_TradeLogWriter] = PerAccount(
+    lambda acc: _TradeLogWriter(Path(account_path(str(LOG_PATH), acc)), account=acc)
+)
+
+
+def _get_writer() -> _TradeLogWriter:
+    return _WRITERS.get()
+
+
+def _to_analytics(row: Dict) -> None:
+    # агрегаты (core/trade_analytics.py) обновляем сразу, чтобы проверки лимитов видели вход
+    # ещё до того, как писатель доберётся до строки; модуль тянет pandas — импортируем, только если уже загружен
+    mod = sys.modules.get("core.trade_analytics")
+    if mod is not None:
+        try:
+            mod.on_trade_event(row)
+        except Exception as e:
+            log.error("[ANALYTICS_ERR] %s", e)
+
+
+def append_trade_event(row: Dict) -> None:
+    # значения по умолчанию (ts — момент события, а не записи)
+    row = _with_defaults(row)
+    _to_analytics(row)
+    if _ASYNC:
+        _get_writer().put(row)
+    else:
+        _append_sync(row)
+
+
+def flush_trade_log(timeout: float = 5.0) -> bool:
+    """Сбросить очереди всех аккаунтов на диск (например, перед чтением файла/выгрузкой в GitHub)."""
+    return all([w.flush(timeout) for _, w in _WRITERS.items()])
+
+
+def close_trade_log(timeout: float = 5.0) -> None:
+    """Дописать очереди, fsync и закрыть файлы. Вызывается автоматически при выходе процесса."""
+    for w in _WRITERS.pop_all():
+        w.close(timeout)
+
+
+atexit.register(close_trade_log)
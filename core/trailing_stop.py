@@ -5,6 +5,11 @@ import time
 import logging
 from typing import Any, Dict, List, Tuple
 
+from .candle_cache import fetch_ohlcv_cached
+from .config import Config, get_config
+from .rounding import round_price
+from utils.error_handler import handle_bybit_error
+
 logger = logging.getLogger("trailing_stop")
 
 # Не критично, но пусть импорт будет безопасным
@@ -30,31 +35,17 @@ def _market_id(exchange, unified_symbol: str) -> str:
     return m["id"]
 
 
-def _assert_ok(resp: Dict[str, Any]) -> None:
+def _assert_ok(resp: Dict[str, Any], endpoint: str = "v5/position/trading-stop") -> None:
     """
-    Бросаем исключение, если Bybit вернул ошибку.
-    retCode=110043 ("not modified") трактуем как OK с предупреждением.
+    Бросаем классифицированное исключение (utils.error_handler), если Bybit вернул ошибку.
+    retCode=110043/34040 ("not modified") трактуем как OK.
     """
-    rc = resp.get("retCode")
-    if rc in (0, "0", None):
-        return
-    if str(rc) == "110043":
-        logger.warning("Bybit retCode=110043 (not modified) — считаем как OK")
-        return
-    raise RuntimeError(
-        f"Bybit error retCode={rc}, retMsg={resp.get('retMsg')}, result={resp.get('result')}"
-    )
-
-
-def _backoff_sleep(attempt: int) -> None:
-    """Экспоненциальный бэкофф, но не больше 2с."""
-    delay = min(_RATE_DELAY * (2 ** (attempt - 1)), 2.0)
-    time.sleep(delay)
+    handle_bybit_error(resp, endpoint=endpoint)
 
 
 def _fetch_ohlcv(exchange, symbol: str, timeframe: str, limit: int) -> List[List[float]]:
     # Формат: [ts, open, high, low, close, volume]
-    return exchange.fetch_ohlcv(symbol, timeframe=timeframe, limit=limit)
+    return fetch_ohlcv_cached(exchange, symbol, timeframe, limit)
 
 
 def _sma(values: List[float], period: int) -> float:
@@ -121,6 +112,8 @@ def set_trailing_stop_ccxt(
     """
     POST /v5/position/trading-stop (ccxt: privatePostV5PositionTradingStop)
     ВАЖНО: числовые параметры — строками.
+    Повторы при 10006/429 делает общий слой (core.resilience) внутри клиента;
+    max_retries оставлен для совместимости сигнатуры.
     """
     bybit_symbol = _market_id(exchange, symbol)
     payload = {
@@ -136,23 +129,10 @@ def set_trailing_stop_ccxt(
         "slTriggerBy": trigger_by,
     }
 
-    attempt = 0
-    while True:
-        attempt += 1
-        try:
-            resp = exchange.privatePostV5PositionTradingStop(payload)
-            _assert_ok(resp)
-            time.sleep(_RATE_DELAY)
-            return resp
-        except Exception as e:
-            msg = str(e)
-            # 10006/429 — перегрузка, повторяем с бэкоффом
-            if "10006" in msg or "rate limit" in msg.lower():
-                if attempt >= max_retries:
-                    raise
-                _backoff_sleep(attempt)
-                continue
-            raise
+    resp = exchange.privatePostV5PositionTradingStop(payload)
+    _assert_ok(resp)
+    time.sleep(_RATE_DELAY)
+    return resp
 
 
 def verify_trailing_state(exchange, symbol: str, *, category: str = "linear") -> Dict[str, Any]:
@@ -289,34 +269,39 @@ def update_trailing_for_symbol(
     callback_rate: float | None = None,
     auto_callback: bool | None = None,
     auto_cb_k: float | None = None,
+    cfg: Config | None = None,
+    atr: float | None = None,
 ) -> Dict[str, Any]:
     """
     Устанавливает трейлинг-стоп:
       mode="atr":  LONG → entry + K*ATR ; SHORT → entry - K*ATR
       mode="pct":  LONG → entry*(1+up_pct) ; SHORT → entry*(1-down_pct)
-    Все параметры можно задать через .env.
+    Параметры по умолчанию — из снимка настроек cfg.trailing (core.config), явные аргументы важнее.
+    atr — уже посчитанный ATR (CycleSnapshot.atr_for), чтобы не тянуть свечи ещё раз.
     """
-    activation_mode = (activation_mode or os.getenv("TS_ACTIVATION_MODE", "atr")).lower()
+    t = (cfg or get_config()).trailing
+    activation_mode = (activation_mode or t.activation_mode).lower()
 
     # Параметры ATR/процентов
-    atr_timeframe = atr_timeframe or os.getenv("ATR_TIMEFRAME", "5m")
-    atr_period = int(atr_period or int(os.getenv("ATR_PERIOD", "14")))
-    atr_k = float(atr_k or float(os.getenv("TS_ACTIVATION_ATR_K", "1.0")))
+    atr_timeframe = atr_timeframe or t.atr_timeframe
+    atr_period = int(atr_period or t.atr_period)
+    atr_k = float(atr_k or t.activation_atr_k)
 
-    up_pct = float(os.getenv("TS_ACTIVATION_UP_PCT", "0.003")) if up_pct is None else float(up_pct)
-    down_pct = float(os.getenv("TS_ACTIVATION_DOWN_PCT", "0.003")) if down_pct is None else float(down_pct)
-    min_up_pct = float(os.getenv("TS_ACTIVATION_MIN_UP_PCT", "0.001"))
-    min_dn_pct = float(os.getenv("TS_ACTIVATION_MIN_DOWN_PCT", "0.001"))
+    up_pct = t.up_pct if up_pct is None else float(up_pct)
+    down_pct = t.down_pct if down_pct is None else float(down_pct)
+    min_up_pct = t.min_up_pct
+    min_dn_pct = t.min_down_pct
 
-    auto_callback = bool(int(os.getenv("TS_CALLBACK_RATE_AUTO", "0"))) if auto_callback is None else bool(auto_callback)
-    auto_cb_k = float(os.getenv("TS_CALLBACK_RATE_ATR_K", "0.75")) if auto_cb_k is None else float(auto_cb_k)
-    callback_rate = float(os.getenv("TS_CALLBACK_RATE", "1.0")) if callback_rate is None else float(callback_rate)
+    auto_callback = t.callback_auto if auto_callback is None else bool(auto_callback)
+    auto_cb_k = t.callback_atr_k if auto_cb_k is None else float(auto_cb_k)
+    callback_rate = t.callback_rate if callback_rate is None else float(callback_rate)
 
     side_l = (side or "").lower()
 
     # Рассчитать активатор/шаг
     if activation_mode == "atr":
-        atr, _ = compute_atr(exchange, symbol, atr_timeframe, atr_period)
+        if atr is None:
+            atr, _ = compute_atr(exchange, symbol, atr_timeframe, atr_period)
         if atr > 0.0:
             active, cb_pct = compute_trailing_from_atr(
                 entry_price,
@@ -342,7 +327,7 @@ def update_trailing_for_symbol(
 
     # Подгон к шагу цены
     try:
-        active_precise = float(exchange.price_to_precision(symbol, active))
+        active_precise = round_price(exchange, symbol, active)
     except Exception:
         active_precise = float(active)
 
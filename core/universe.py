@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .bybit_exchange import normalize_symbol
+from .config import Config, ScanConfig, get_config
+from .logging_setup import log_event
+
+log = logging.getLogger(__name__)
+
+
+def _f(v: Any) -> float:
+    try:
+        return float(v or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def linear_usdt_perps(ex) -> Dict[str, str]:
+    """id рынка → unified-символ для всех активных линейных USDT-перпетуалов (из загруженных рынков)."""
+    out: Dict[str, str] = {}
+    for m in (ex.markets or {}).values():
+        if m.get("swap") and m.get("linear") and m.get("quote") == "USDT" and m.get("settle") == "USDT" \
+                and m.get("active", True) is not False:
+            out[m["id"]] = m["symbol"]
+    return out
+
+
+def _model_ids(model_dir: str) -> Set[str]:
+    try:
+        names = os.listdir(model_dir)
+    except OSError:
+        return set()
+    return {n[len("model_"):-len(".pkl")] for n in names if n.startswith("model_") and n.endswith(".pkl")}
+
+
+def _ticker(sym: str, row: Dict[str, Any]) -> Dict[str, Any]:
+    """Сырой тикер v5 → минимальный ccxt-вид (last/close/bid/ask), которого хватает снимку цикла."""
+    last = _f(row.get("lastPrice"))
+    return {
+        "symbol": sym, "last": last, "close": last, "bid": _f(row.get("bid1Price")), "ask": _f(row.get("ask1Price")),
+        "high": _f(row.get("highPrice24h")), "low": _f(row.get("lowPrice24h")),
+        "quoteVolume": _f(row.get("turnover24h")), "info": row,
+    }
+
+
+def _pct_rank(x: np.ndarray) -> np.ndarray:
+    """Перцентильный ранг 0..1 (больше значение — больше ранг)."""
+    if x.size <= 1:
+        return np.ones_like(x, dtype=float)
+    r = np.empty(x.size, dtype=float)
+    r[np.argsort(x, kind="stable")] = np.arange(x.size, dtype=float)
+    return r / (x.size - 1)
+
+
+@dataclass
+class ScanResult:
+    pairs: List[str]                                   # итоговый набор: закреплённые PAIRS + кандидаты
+    tickers: Dict[str, Dict[str, Any]] = field(default_factory=dict)  # тикеры набора (для CycleSnapshot)
+    added: List[str] = field(default_factory=list)
+    dropped: List[str] = field(default_factory=list)
+    scanned: int = 0
+    eligible: int = 0
+
+
+class UniverseScanner:
+    """
+    Предотбор пар из всей вселенной линейных USDT-перпетуалов перед дорогими стадиями
+    (модель, ATR, вход). Один bulk-запрос /v5/market/tickers?category=linear (сырые ответы,
+    без разбора ccxt на каждый символ), ранжирование векторно в NumPy:
+
+        score = w_volume·rank(log turnover24h) + w_volatility·rank((high-low)/last) − w_spread·rank(spread)
+
+    Гистерезис: участник остаётся в наборе, пока его место не хуже SCAN_EXIT_RANK, новый
+    попадает, только заняв место в первых SCAN_TOP_N — набор не «мигает» на границе.
+    Набор переживает перезапуски (SCAN_STATE_FILE), чтобы гистерезис работал и в --once.
+    """
+
+    def __init__(self, cfg: Optional[ScanConfig] = None, state_file: Optional[str] = None) -> None:
+        self.cfg = cfg or get_config().scan
+        self.state_file = Path(state_file or os.getenv("SCAN_STATE_FILE", "logs/universe.json"))
+        self._lock = threading.Lock()
+        self._members: List[str] = self._load()
+        self._markets_key: Optional[int] = None
+        self._perps: Dict[str, str] = {}
+
+    def _load(self) -> List[str]:
+        try:
+            return list(json.loads(self.state_file.read_text(encoding="utf-8")).get("members", []))
+        except (OSError, ValueError):
+            return []
+
+    def _save(self) -> None:
+        try:
+            self.state_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.state_file.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps({"members": self._members, "ts": time.time()}), encoding="utf-8")
+            os.replace(tmp, self.state_file)
+        except OSError as e:
+            log.warning("[SCAN] state not saved: %s", e)
+
+    @property
+    def members(self) -> List[str]:
+        return list(self._members)
+
+    def rank(self, rows: Sequence[Dict[str, Any]], perps: Dict[str, str], models: Optional[Set[str]] = None
+             ) -> Tuple[List[str], int]:
+        """Сырые тикеры → (символы по убыванию score среди прошедших фильтры, сколько перпов рассмотрено)."""
+        c = self.cfg
+        rows = [r for r in rows if r.get("symbol") in perps and (models is None or r["symbol"] in models)]
+        n = len(rows)
+        if not n:
+            return [], 0
+        a = np.array(
+            [[_f(r.get("lastPrice")), _f(r.get("bid1Price")), _f(r.get("ask1Price")),
+              _f(r.get("highPrice24h")), _f(r.get("lowPrice24h")), _f(r.get("turnover24h"))] for r in rows],
+            dtype=float,
+        )
+        last, bid, ask, hi, lo, turnover = a.T
+        mid = np.where((bid > 0) & (ask > 0), (bid + ask) / 2.0, last)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            spread_bps = np.where(mid > 0, (ask - bid) / mid * 1e4, np.inf)
+            vol = np.where(last > 0, (hi - lo) / last, 0.0)
+        ok = (last > 0) & (turnover >= c.min_turnover) & (spread_bps <= c.max_spread_bps) & (spread_bps >= 0)
+        idx = np.flatnonzero(ok)
+        if idx.size == 0:
+            return [], n
+        score = (
+            c.w_volume * _pct_rank(np.log1p(turnover[idx]))
+            + c.w_volatility * _pct_rank(vol[idx])
+            - c.w_spread * _pct_rank(spread_bps[idx])
+        )
+        order = idx[np.argsort(-score, kind="stable")]
+        return [perps[rows[i]["symbol"]] for i in order], n
+
+    def select(self, ranked: Sequence[str]) -> Tuple[List[str], List[str], List[str]]:
+        """Гистерезис над ранжированным списком: (набор, добавлены, выбыли)."""
+        c = self.cfg
+        pos = {s: i for i, s in enumerate(ranked)}
+        with self._lock:
+            kept = [s for s in self._members if pos.get(s, len(ranked)) < c.exit_rank]
+            room = max(0, c.top_n - len(kept))
+            new = [s for s in ranked[:c.top_n] if s not in kept][:room]
+            members = sorted(kept + new, key=lambda s: pos[s])
+            dropped = [s for s in self._members if s not in members]
+            changed = members != self._members
+            self._members = members
+        if changed:
+            self._save()
+        return members, new, dropped
+
+    def scan(self, ex, pinned: Sequence[str] = ()) -> ScanResult:
+        """Один bulk-запрос тикеров → набор пар цикла (закреплённые PAIRS всегда в наборе)."""
+        key = id(ex.markets)
+        if key != self._markets_key:
+            self._perps, self._markets_key = linear_usdt_perps(ex), key
+        resp = ex.publicGetV5MarketTickers({"category": "linear"})
+        rows = ((resp or {}).get("result") or {}).get("list") or []
+        t0 = time.process_time()
+        models = _model_ids(os.getenv("MODEL_DIR", "models")) if self.cfg.require_model else None
+        ranked, n = self.rank(rows, self._perps, models)
+        members, added, dropped = self.select(ranked)
+        pairs = list(dict.fromkeys([normalize_symbol(p) for p in pinned] + members))
+        want = set(pairs)
+        tickers = {}
+        for r in rows:
+            sym = self._perps.get(r.get("symbol"))
+            if sym in want:
+                tickers[sym] = _ticker(sym, r)
+        log_event(log, "SCAN", scanned=len(rows), perps=n, eligible=len(ranked), selected=len(members),
+                  added=added, dropped=dropped, cpu_ms=round((time.process_time() - t0) * 1000.0, 2))
+        return ScanResult(
+            pairs=pairs,
+            tickers=tickers,
+            added=added,
+            dropped=dropped,
+            scanned=len(rows),
+            eligible=len(ranked),
+        )
+
+
+_SCANNER: Optional[UniverseScanner] = None
+_SCANNER_LOCK = threading.Lock()
+
+
+def get_scanner(cfg: Optional[Config] = None) -> UniverseScanner:
+    """Сканер процесса; при перечитке .env берёт новые SCAN_* (набор участников сохраняется)."""
+    global _SCANNER
+    sc = (cfg or get_config()).scan
+    with _SCANNER_LOCK:
+        if _SCANNER is None:
+            _SCANNER = UniverseScanner(sc)
+        _SCANNER.cfg = sc
+        return _SCANNER
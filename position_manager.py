@@ -1,13 +1,25 @@
 from __future__ import annotations
 
+import logging
 import os
 import time
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
-from core.bybit_exchange import create_exchange, normalize_symbol
-from core.market_info import adjust_qty_price
+import ccxt
+
+from core.bybit_exchange import get_exchange, normalize_symbol, rest_calls_total
+from core.config import Config, get_config
+from core.maker_entry import make_book_source, maker_entry
+from core.order_prep import CycleSnapshot, OrderPlan, ensure_leverage, prepare_entry
+from core.order_tracker import get_order_tracker
+from core.logging_setup import log_event
+from core.metrics import stage_timer
+from core.resilience import classify_error
+from core.rounding import amount_to_precision, price_to_precision
 from core.trade_log import append_trade_event
-from core.indicators import atr_latest_from_ohlcv
+from utils.error_handler import BybitInvalidParams, BybitNotModified
+
+log = logging.getLogger(__name__)
 
 
 def _calc_order_qty(balance_usdt: float, price: float, risk_fraction: float, leverage: int) -> float:
@@ -21,119 +33,105 @@ def _calc_order_qty(balance_usdt: float, price: float, risk_fraction: float, lev
     return (notional / price) if price > 1e-12 else 0.0
 
 
-def _wait_fill(ex, sym: str, order_id: str, timeout_s: int = 8) -> Dict[str, Any]:
+def _wait_fills(ex, orders: Sequence[Tuple[str, str]], timeout_s: int = 8) -> Dict[str, Dict[str, Any]]:
     """
-    Ожидание исполнения ордера best‑effort: опрос раз в 0.5с до timeout_s.
-    Возвращает последний известный статус ордера.
+    Ожидание исполнения ордеров best‑effort через общий OrderTracker:
+    событие из приватного потока ордеров, иначе опрос fetch_order с адаптивным бэкоффом.
+    Возвращает {order_id: последний известный статус}. Ордера уже приняты биржей —
+    сбой ожидания только логируется (пустой результат), в order_error/"error" он не попадает.
     """
-    t0 = time.time()
-    last = {}
-    while time.time() - t0 < timeout_s:
+    with stage_timer("fill_wait"):
         try:
-            o = ex.fetch_order(order_id, sym)
-            last = o or last
-            st = (o.get("status") or "").lower()
-            if st in ("closed", "canceled", "rejected"):
-                return o
-        except Exception:
-            # игнорируем разовые сбои сети/таймауты
-            pass
-        time.sleep(0.5)
-    return last
-
-
-def open_position(symbol: str, side: str, price: Optional[float] = None) -> Dict[str, Any]:
+            return get_order_tracker().wait_many(ex, orders, timeout_s=timeout_s)
+        except Exception as e:
+            log.warning("[FILL_WAIT] %s: %s", type(e).__name__, e)
+            return {}
+
+
+def _wait_fill(ex, sym: str, order_id: str, timeout_s: int = 8) -> Dict[str, Any]:
+    """Ожидание одного ордера (см. _wait_fills); {} — статус неизвестен."""
+    return _wait_fills(ex, [(sym, order_id)], timeout_s=timeout_s).get(str(order_id), {})
+
+
+def open_position(
+    symbol: str,
+    side: str,
+    price: Optional[float] = None,
+    *,
+    snapshot: Optional[CycleSnapshot] = None,
+    signal_ts: Optional[float] = None,
+    cfg: Optional[Config] = None,
+) -> Dict[str, Any]:
     """
     MARKET‑ордер с TP/SL и ATR‑расчётом. Игнорирует 'leverage not modified' (110043),
     помечает 10001 как retryable. Логирует: order_placed / order_filled / order_error.
     DRY_RUN=1 — не отправляет ордера.
+
+    snapshot — снимок цикла (баланс/тикеры/ATR), чтобы не повторять запросы на каждый вход;
+    signal_ts — момент получения сигнала, для замера signal→submit;
+    cfg — снимок настроек цикла (core.config), по умолчанию текущий.
     """
     # DRY mode: ничего не отправляем
     if os.getenv("DRY_RUN", "").strip() == "1":
         return {"status": "dry", "reason": "DRY_RUN=1", "symbol": symbol, "side": side}
 
-    ex = create_exchange()
-    sym = normalize_symbol(symbol)
-
-    # Баланс
-    bal = ex.fetch_balance()
-    usdt = float(bal.get("USDT", {}).get("free", 0.0) or 0.0)
-
-    # Цена (если не передали)
-    if price is None:
-        t = ex.fetch_ticker(sym)
-        price = float(t.get("last") or t.get("close") or 0.0)
+    cfg = cfg or get_config()
+    t_start = signal_ts or time.time()
+    rest_before = rest_calls_total()
 
-    # Округляем цену входа по тик‑шагу
-    px = float(ex.price_to_precision(sym, price))
+    ex = get_exchange()
+    sym = normalize_symbol(symbol)
 
-    # Сторона ордера
-    order_side = "buy" if side.lower() == "long" else "sell"
+    if snapshot is None:
+        snapshot = CycleSnapshot.capture(ex, [sym])
 
-    # Устанавливаем плечо (110043 = already set — не считается ошибкой)
-    leverage = int(os.getenv("LEVERAGE", "3"))
-    try:
-        ex.set_leverage(leverage, sym)
-    except Exception as e:
-        if "110043" not in str(e):
-            print("⚠️ set_leverage:", e)
-
-    # --- ATR‑базированный риск ---
-    tf = os.getenv("TIMEFRAME", "5m")
-    atr_period = int(os.getenv("ATR_PERIOD", "14"))
-    sl_mult = float(os.getenv("SL_ATR_MULT", "1.8"))
-    tp_mult = float(os.getenv("TP_ATR_MULT", "2.2"))
-    risk_pct = float(os.getenv("RISK_PCT", "0.007"))  # 0.7% от депозита
-
-    # Получаем ATR для стоп‑дистанции
-    ohlcv = ex.fetch_ohlcv(sym, timeframe=tf, limit=max(atr_period + 1, 200))
-    atr, _last_close = atr_latest_from_ohlcv(ohlcv, period=atr_period)
-
-    # Дистанция SL от точки входа
-    stop_dist = max(atr * sl_mult, 1e-9)
-
-    # Размер позиции (в базовой валюте) = риск/стоп‑дистанция
-    risk_usdt = max(1e-6, usdt * risk_pct)
-    qty_raw = risk_usdt / stop_dist if stop_dist > 0 else 0.0
-
-    # Корректируем количество и цену под шаг лота/тик
-    qty, px, _ = adjust_qty_price(sym, qty_raw, px)
-    if qty <= 0:
+    plan = prepare_entry(ex, sym, side, snapshot, price=price, cfg=cfg)
+    if plan is None:
         return {
             "status": "error",
             "reason": "qty<=0 after adjust",
-            "balance": usdt,
-            "qty_raw": qty_raw,
+            "balance": snapshot.balance_usdt,
         }
 
-    # TP/SL по ATR
-    if order_side == "buy":
-        sl_price = float(ex.price_to_precision(sym, px - stop_dist))
-        tp_price = float(ex.price_to_precision(sym, px + tp_mult * atr))
-    else:
-        sl_price = float(ex.price_to_precision(sym, px + stop_dist))
-        tp_price = float(ex.price_to_precision(sym, px - tp_mult * atr))
-
-    params = {"takeProfit": tp_price, "stopLoss": sl_price}
-
-    # Отладка
-    print(
-        "🔎 DEBUG ORDER:",
-        {
-            "symbol": sym,
-            "side": order_side,
-            "qty_raw": qty_raw,
-            "qty": qty,
-            "entry_price": px,
-            "TP": tp_price,
-            "SL": sl_price,
-            "lev": leverage,
-        },
+    # Плечо: запрос только если для символа ещё не выставляли (110043 — не ошибка)
+    ensure_leverage(ex, sym, plan.leverage)
+
+    order_side = plan.side
+    qty, px = plan.qty, plan.price
+    tp_price, sl_price = plan.tp, plan.sl
+    params = plan.params
+
+    # Отладка (DEBUG, прореживается — см. LOG_DEBUG_SAMPLE)
+    log_event(
+        log,
+        "ORDER_PLAN",
+        logging.DEBUG,
+        symbol=sym,
+        side=order_side,
+        qty_raw=plan.qty_raw,
+        qty=qty,
+        entry_price=px,
+        tp=tp_price,
+        sl=sl_price,
+        lev=plan.leverage,
     )
 
+    # MAKER_ENTRY=true: post-only у лучшей цены с перестановкой, фолбэк IOC/market
+    if cfg.entry.maker:
+        return _open_maker(ex, plan, t_start, rest_before)
+
     try:
-        # Размещение
-        o = ex.create_order(sym, type="market", side=order_side, amount=qty, price=None, params=params)
+        # Размещение (submitted_at — момент отправки, для замера латентности от закрытия бара)
+        submitted_at = time.time()
+        with stage_timer("order_submit"):
+            o = ex.create_order(sym, type="market", side=order_side, amount=qty, price=None, params=params)
+        log_event(
+            log,
+            "ENTRY_STATS",
+            symbol=sym,
+            signal_to_submit_ms=round((submitted_at - t_start) * 1000.0, 1),
+            rest_calls=rest_calls_total() - rest_before,
+        )
 
         # Лог: размещён
         try:
@@ -155,12 +153,12 @@ def open_position(symbol: str, side: str, price: Optional[float] = None) -> Dict
                 }
             )
         except Exception as _e:
-            print("[WARN] trade-log placed:", _e)
+            log.warning("trade-log placed: %s", _e)
 
         # Дождаться исполнения (best‑effort)
         oid = o.get("id") or o.get("orderId")
         if oid:
-            o = _wait_fill(ex, sym, oid)
+            o = _wait_fill(ex, sym, oid) or o
 
         # Успех
         return {
@@ -170,7 +168,8 @@ def open_position(symbol: str, side: str, price: Optional[float] = None) -> Dict
             "price": px,
             "tp": tp_price,
             "sl": sl_price,
-            "balance": usdt,
+            "balance": plan.balance,
+            "submitted_at": submitted_at,
         }
 
     except Exception as e:
@@ -195,16 +194,18 @@ def open_position(symbol: str, side: str, price: Optional[float] = None) -> Dict
                 }
             )
         except Exception as _e:
-            print("[WARN] trade-log error:", _e)
+            log.warning("trade-log error: %s", _e)
 
-        # Коды Bybit
-        if "10001" in msg:
+        # Коды Bybit: классификация utils.error_handler (через core.resilience)
+        err = classify_error(e, "v5/order/create")
+        code = getattr(err, "ret_code", None)
+        if isinstance(err, BybitInvalidParams) and code == 10001:
             return {
                 "status": "retryable",
                 "reason": "10001 invalid request",
                 "error": msg,
             }
-        if "110043" in msg:
+        if isinstance(err, BybitNotModified):
             return {
                 "status": "ok_with_warning",
                 "warning": "110043 leverage not modified",
@@ -212,3 +213,225 @@ def open_position(symbol: str, side: str, price: Optional[float] = None) -> Dict
             }
 
         return {"status": "error", "error": msg, "qty": qty, "price": px}
+
+
+def _open_maker(ex, plan: OrderPlan, t_start: float, rest_before: int) -> Dict[str, Any]:
+    """Вход через maker-движок; результат в формате open_position."""
+    submitted_at = time.time()
+    try:
+        with stage_timer("maker_entry"):
+            res = maker_entry(ex, plan, make_book_source(ex), tracker=get_order_tracker())
+    except Exception as e:
+        msg = str(e)
+        _log_plan_event(plan, "order_error", extra=f"maker: {msg}")
+        return {"status": "error", "error": msg, "qty": plan.qty, "price": plan.price}
+
+    log_event(
+        log,
+        "ENTRY_STATS",
+        symbol=plan.symbol,
+        signal_to_submit_ms=round((submitted_at - t_start) * 1000.0, 1),
+        rest_calls=rest_calls_total() - rest_before,
+        maker=True,
+    )
+    o = res.get("order") or {}
+    extra = f"maker reprices={res.get('reprices')} fallback={res.get('maker_fallback')} filled={res.get('filled')}"
+    if res.get("filled", 0.0) > 0:
+        _log_plan_event(plan, "order_filled", order_id=o.get("id"), link_id=o.get("clientOrderId"), extra=extra)
+    else:
+        _log_plan_event(plan, "order_error", order_id=o.get("id"), extra=extra)
+
+    return {
+        "status": "closed" if res["status"] in ("closed", "partial") else res["status"],
+        "order": o,
+        "qty": res.get("filled") or 0.0,
+        "price": res.get("average") or plan.price,
+        "tp": plan.tp,
+        "sl": plan.sl,
+        "balance": plan.balance,
+        "submitted_at": submitted_at,
+        "maker": res,
+    }
+
+
+# ---------------------------------------------------------------------
+# Пакетный вход (Bybit v5 /v5/order/create-batch)
+# ---------------------------------------------------------------------
+# Однажды получив «эндпоинт недоступен», больше не пробуем батч в этом процессе
+_BATCH_UNAVAILABLE = False
+
+# Ошибки, при которых батч точно не принят биржей и можно безопасно уйти в последовательный режим.
+# Сетевые ошибки/таймауты сюда НЕ входят: ордера могли уйти — повтор дал бы двойной вход.
+# «Эндпоинт недоступен» — батч выключается до перезапуска; BadRequest — отказ конкретного
+# запроса (параметры пачки), эту пачку шлём поштучно, следующие снова батчем.
+_BATCH_UNAVAILABLE_ERRORS = (ccxt.NotSupported, ccxt.PermissionDenied, AttributeError)
+_BATCH_FALLBACK_ERRORS = _BATCH_UNAVAILABLE_ERRORS + (ccxt.BadRequest,)
+
+
+def _log_plan_event(plan: OrderPlan, event: str, order_id=None, link_id=None, extra: str = "") -> None:
+    try:
+        append_trade_event(
+            {
+                "ts": time.time(),
+                "event": event,
+                "symbol": plan.symbol,
+                "side": plan.side,
+                "qty": plan.qty,
+                "price": plan.price,
+                "tp": plan.tp,
+                "sl": plan.sl,
+                "order_id": order_id,
+                "link_id": link_id,
+                "mode": "LIVE",
+                "extra": extra,
+            }
+        )
+    except Exception as _e:
+        log.warning("trade-log %s: %s", event, _e)
+
+
+def _batch_request(ex, plans: Sequence[OrderPlan], link_ids: Sequence[str]) -> Dict[str, Any]:
+    """Тело create-batch: Market-ордера с TP/SL, числа — строками по точности инструмента (требование v5)."""
+    return {
+        "category": "linear",
+        "request": [
+            {
+                "symbol": ex.market(p.symbol)["id"],
+                "side": "Buy" if p.side == "buy" else "Sell",
+                "orderType": "Market",
+                "qty": amount_to_precision(ex, p.symbol, p.qty),
+                "takeProfit": price_to_precision(ex, p.symbol, p.tp),
+                "stopLoss": price_to_precision(ex, p.symbol, p.sl),
+                "tpslMode": "Full",
+                "orderLinkId": lid,
+            }
+            for p, lid in zip(plans, link_ids)
+        ],
+    }
+
+
+def _submit_batch_chunk(ex, plans: Sequence[OrderPlan]) -> List[Dict[str, Any]]:
+    """
+    Отправляет до BATCH_ORDER_MAX ордеров одним запросом и раскладывает ответ по ордерам:
+    result.list[i] + retExtInfo.list[i] (code/msg) → order_placed / order_error в trade-log.
+    """
+    stamp = int(time.time() * 1000)
+    link_ids = [f"kbat-{stamp}-{i}" for i in range(len(plans))]
+    submitted_at = time.time()
+    with stage_timer("order_submit"):
+        resp = ex.privatePostV5OrderCreateBatch(_batch_request(ex, plans, link_ids))
+
+    rows = ((resp or {}).get("result") or {}).get("list") or []
+    infos = ((resp or {}).get("retExtInfo") or {}).get("list") or []
+    by_link = {r.get("orderLinkId"): r for r in rows if r.get("orderLinkId")}
+
+    out: List[Dict[str, Any]] = []
+    for i, (plan, lid) in enumerate(zip(plans, link_ids)):
+        row = by_link.get(lid) or (rows[i] if i < len(rows) else {})
+        info = infos[i] if i < len(infos) else {}
+        code = int(info.get("code", 0) or 0)
+        oid = row.get("orderId") or None
+        base = {
+            "symbol": plan.symbol,
+            "side": plan.side,
+            "qty": plan.qty,
+            "price": plan.price,
+            "tp": plan.tp,
+            "sl": plan.sl,
+            "balance": plan.balance,
+            "submitted_at": submitted_at,
+            "link_id": lid,
+        }
+        if code == 0 and oid:
+            _log_plan_event(plan, "order_placed", order_id=oid, link_id=lid)
+            out.append({**base, "status": "placed", "order": {"id": oid, "clientOrderId": lid, "info": row}})
+        else:
+            msg = f"{code} {info.get('msg') or 'rejected in batch'}"
+            _log_plan_event(plan, "order_error", link_id=lid, extra=msg)
+            out.append({**base, "status": "retryable" if code == 10001 else "error", "error": msg})
+    return out
+
+
+def open_positions_batch(
+    entries: Sequence[Tuple[str, str]],
+    *,
+    snapshot: Optional[CycleSnapshot] = None,
+    signal_ts: Optional[float] = None,
+    cfg: Optional[Config] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Пакетный вход по нескольким сигналам одного цикла. entries — [(symbol, side)].
+    Плечо (кэш) и расчёт — как в open_position, затем create-batch пачками по BATCH_ORDER_MAX.
+    Частичные отказы разбираются по каждому ордеру; если batch-эндпоинт недоступен —
+    последовательный open_position. Результаты — в порядке entries.
+    """
+    global _BATCH_UNAVAILABLE
+
+    if os.getenv("DRY_RUN", "").strip() == "1":
+        return [{"status": "dry", "reason": "DRY_RUN=1", "symbol": s, "side": sd} for s, sd in entries]
+    cfg = cfg or get_config()
+    if _BATCH_UNAVAILABLE or cfg.entry.maker:
+        # maker-вход — поштучный по природе (перестановка лимита по стакану)
+        return [open_position(s, side=sd, snapshot=snapshot, signal_ts=signal_ts, cfg=cfg) for s, sd in entries]
+
+    t_start = signal_ts or time.time()
+    rest_before = rest_calls_total()
+    ex = get_exchange()
+    if snapshot is None:
+        snapshot = CycleSnapshot.capture(ex, [s for s, _ in entries])
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(entries)
+    ready: List[Tuple[int, OrderPlan]] = []
+    for i, (sym, side) in enumerate(entries):
+        plan = prepare_entry(ex, sym, side, snapshot, cfg=cfg)
+        if plan is None:
+            results[i] = {"status": "error", "reason": "qty<=0 after adjust", "symbol": normalize_symbol(sym)}
+            continue
+        ensure_leverage(ex, plan.symbol, plan.leverage)
+        ready.append((i, plan))
+
+    chunk = cfg.entry.batch_order_max
+    for k in range(0, len(ready), chunk):
+        part = ready[k:k + chunk]
+        plans = [p for _, p in part]
+        try:
+            part_res = _submit_batch_chunk(ex, plans)
+        except _BATCH_FALLBACK_ERRORS as e:
+            if isinstance(e, _BATCH_UNAVAILABLE_ERRORS):
+                log.warning("[BATCH] эндпоинт недоступен, перехожу на последовательный вход: %s", e)
+                _BATCH_UNAVAILABLE = True
+            else:
+                log.warning("[BATCH] пачка отклонена, эти ордера — поштучно: %s", e)
+            part_res = []
+            for p in plans:
+                r = open_position(p.symbol, side="long" if p.side == "buy" else "short", snapshot=snapshot,
+                                  signal_ts=signal_ts, cfg=cfg)
+                r.setdefault("symbol", p.symbol)
+                part_res.append(r)
+        except Exception as e:
+            # Таймаут/сеть: биржа могла принять ордера — не дублируем, помечаем как неизвестные
+            msg = f"batch submit failed: {e}"
+            for p in plans:
+                _log_plan_event(p, "order_error", extra=msg)
+            part_res = [{"status": "error", "error": msg, "symbol": p.symbol, "qty": p.qty, "price": p.price}
+                        for p in plans]
+        for (i, _), r in zip(part, part_res):
+            results[i] = r
+
+    log_event(
+        log,
+        "ENTRY_STATS",
+        batch=len(ready),
+        signal_to_submit_ms=round((time.time() - t_start) * 1000.0, 1),
+        rest_calls=rest_calls_total() - rest_before,
+    )
+
+    # Ожидание исполнения — всех ордеров сразу
+    placed = [r for r in results if r and r.get("status") == "placed"]
+    fills = _wait_fills(ex, [(r["symbol"], r["order"]["id"]) for r in placed])
+    for r in placed:
+        o = fills.get(str(r["order"]["id"])) or r["order"]
+        r["order"] = o
+        r["status"] = o.get("status") or "unknown"
+
+    return [r or {"status": "error", "error": "not submitted"} for r in results]
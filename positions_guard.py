@@ -1,16 +1,23 @@
 import argparse
+import contextvars
+import logging
 import os
+import signal
+import subprocess
 import sys
-import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager, nullcontext
 
 from datetime import datetime, timezone
-from core.bybit_exchange import normalize_symbol, create_exchange
+from core.accounts import account_label, current_account, use_account
+from core.bybit_exchange import normalize_symbol, get_exchange
+from core.clock_sync import get_clock
+from core.config import Config, ConfigError, base_env, get_config, reload_config
 from core.env_loader import load_and_check_env
 from core.market_info import (
     cancel_open_orders,
-    get_balance,
     get_open_orders,
     get_symbol_price,
     has_open_position,
@@ -21,39 +28,52 @@ from core.trailing_stop import (
     update_trailing_for_symbol,
     verify_trailing_state,
     set_stop_loss_only,
-    compute_atr,
 )
 
-from position_manager import open_position
+from position_manager import open_position, open_positions_batch
+from core.order_prep import CycleSnapshot
+from core.rounding import round_price
 from core.indicators import compute_snapshot, atr_latest_from_ohlcv
-
-try:
-    # Гарантируем небеферизованный stdout в любом окружении
-    if hasattr(sys.stdout, "reconfigure"):
-        sys.stdout.reconfigure(line_buffering=True)
-    os.environ.setdefault("PYTHONUNBUFFERED", "1")
-    # Локальный файл логов (на Railway тоже полезно)
-    Path("logs").mkdir(exist_ok=True)
-    with open("logs/boot.log", "a", encoding="utf-8") as f:
-        f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] BOOT: positions_guard.py loaded, cwd={os.getcwd()}\n")
-    print("BOOT: positions_guard loaded", flush=True)
-except Exception:
-    pass
-
-# Память о том, что безубыток уже переведён (по паре и направлению)
-_BE_DONE: dict = {}
-
-
-def _has_trailing(exchange, symbol: str) -> bool:
+from core.scheduler import last_bar_close, next_bar_close, sleep_until, timeframe_seconds
+from core.order_tracker import start_order_tracker
+from core.position_state import get_state_store
+from core.position_monitor import OpenPosition, be_trigger_price, monitor_positions
+from core.trade_analytics import get_analytics, sync_positions
+from core.profiling import get_profiler, install_profile_signal
+from core.metrics import CYCLE_SECONDS, CYCLES, LAST_CYCLE_TS, stage_timer, start_metrics_server
+from core.logging_setup import bind_pair, log_event, new_cycle_id, setup_logging
+from core.tracing import cycle_trace, span as trace_span
+from core.sharding import get_shared_slots, parse_shard, process_lock, shard_owns, shard_pairs
+from core.universe import get_scanner
+
+log = logging.getLogger("guard")
+
+# Флаг мягкой остановки daemon-режима (SIGTERM/SIGINT)
+_STOP = threading.Event()
+# Запрос перечитать .env (SIGHUP)
+_RELOAD = threading.Event()
+# (номер, всего) шарда воркера (--shard I/N); None — один процесс на все пары
+_SHARD: tuple[int, int] | None = None
+
+
+def _has_trailing(exchange, symbol: str, side: str | None = None) -> bool:
     """
-    Проверяем, установлен ли уже трейлинг по символу. Использует verify_trailing_state().
+    Проверяем, установлен ли уже трейлинг по символу.
+    Сначала локальное состояние (position_state), на биржу (verify_trailing_state) — только если не знаем.
     """
+    store = get_state_store()
+    if side is not None:
+        st = store.get(symbol, side)
+        if st is not None and st.trailing_set:
+            return True
     try:
         st = verify_trailing_state(exchange, symbol)
         rows = (st.get("result", {}) or {}).get("list") or []
         for r in rows:
             ts = str(r.get("trailingStop") or "").strip()
             if ts not in ("", "0", "0.0", "None"):
+                if side is not None:
+                    store.update(symbol, side, trailing_set=True)
                 return True
     except Exception:
         pass
@@ -61,80 +81,91 @@ def _has_trailing(exchange, symbol: str) -> bool:
 
 _last_hb = 0.0
 def _heartbeat(msg: str = "HB"):
-    """Периодически печатает хартбит, чтобы в Railway были живые логи."""
+    """Периодически пишет хартбит, чтобы в Railway были живые логи."""
     global _last_hb
     now = time.time()
     if now - _last_hb >= 15:  # каждые ~15 секунд
         _last_hb = now
-        print(f"{time.strftime('%H:%M:%S')} {msg}", flush=True)
-        try:
-            with open("logs/boot.log", "a", encoding="utf-8") as f:
-                f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {msg}\n")
-        except Exception:
-            pass
-
-
-def _maybe_breakeven(exchange, symbol: str, entry_px: float, side: str) -> None:
+        log.info(msg)
+
+
+def _maybe_breakeven(
+    exchange,
+    symbol: str,
+    entry_px: float,
+    side: str,
+    price: float | None = None,
+    cfg: Config | None = None,
+    snapshot: CycleSnapshot | None = None,
+) -> None:
     """
     Переносит стоп-лосс в безубыток, если цена прошла достаточное расстояние.
-    Условия и коэффициенты берём из .env: ENABLE_BREAKEVEN, BE_MODE,
-    BE_ATR_K, BE_TRIGGER_PCT, BE_OFFSET_PCT.
+    Условия и коэффициенты — из cfg.breakeven (ENABLE_BREAKEVEN, BE_MODE,
+    BE_ATR_K, BE_TRIGGER_PCT, BE_OFFSET_PCT).
+    Состояние (BE уже сделан, цена срабатывания) хранится в position_state, поэтому
+    повторные запуски --once не ходят на биржу, пока цена не дошла до триггера.
+    snapshot — снимок цикла: цена и ATR из него, без отдельных запросов тикера и свечей.
     """
-    if os.getenv("ENABLE_BREAKEVEN", "1") != "1":
+    cfg = cfg or get_config()
+    if not cfg.breakeven.enabled:
         return
 
-    sid = (side or "").lower()
-    key = (symbol, sid)
-    if _BE_DONE.get(key):
+    store = get_state_store()
+    st = store.get(symbol, side)
+    if st is None or (entry_px and abs(st.entry - entry_px) > 1e-12):
+        st = store.open(symbol, side, entry_px)
+    if st.be_applied:
         return
 
-    be_mode = os.getenv("BE_MODE", "atr").lower()  # "atr" | "pct"
-    be_offset_pct = float(os.getenv("BE_OFFSET_PCT", "0.0005"))
-
-    # Текущая цена
-    cur = get_symbol_price(symbol)
-    should_move = False
-
-    if be_mode == "atr":
-        k = float(os.getenv("BE_ATR_K", "0.5"))
-        tf = os.getenv("ATR_TIMEFRAME", "5m")
-        per = int(os.getenv("ATR_PERIOD", "14"))
-        atr, _ = compute_atr(exchange, symbol, tf, per)
-        if atr > 0:
-            if sid in ("long", "buy"):
-                should_move = cur >= entry_px + k * atr
-            else:
-                should_move = cur <= entry_px - k * atr
-    else:
-        trig = float(os.getenv("BE_TRIGGER_PCT", "0.004"))
-        if sid in ("long", "buy"):
-            should_move = cur >= entry_px * (1 + trig)
-        else:
-            should_move = cur <= entry_px * (1 - trig)
+    trigger = be_trigger_price(exchange, st, cfg, snapshot)
+    st.last_check = time.time()
+    if trigger <= 0:
+        store.put(st)
+        return
 
+    # Текущая цена: из снимка цикла, иначе один тикер
+    if not price and snapshot is not None:
+        price = snapshot.price(exchange, symbol)
+    cur = float(price) if price else get_symbol_price(symbol)
+    long_ = st.side == "long"
+    should_move = cur >= trigger if long_ else cur <= trigger
     if not should_move:
+        store.put(st)
         return
 
-    if sid in ("long", "buy"):
-        be_price = float(exchange.price_to_precision(symbol, entry_px * (1 + be_offset_pct)))
+    be_offset_pct = cfg.breakeven.offset_pct
+    if long_:
+        be_price = round_price(exchange, symbol, st.entry * (1 + be_offset_pct))
     else:
-        be_price = float(exchange.price_to_precision(symbol, entry_px * (1 - be_offset_pct)))
+        be_price = round_price(exchange, symbol, st.entry * (1 - be_offset_pct))
 
-    print("[BE] move SL to", be_price)
+    log_event(log, "BE", symbol=symbol, side=side, sl=be_price, trigger=trigger, price=cur)
     try:
-        set_stop_loss_only(exchange, symbol, be_price)
-        _BE_DONE[key] = True
+        with stage_timer("breakeven_set"):
+            set_stop_loss_only(exchange, symbol, be_price)
+        st.be_applied, st.last_sl = True, be_price
     except Exception as e:
-        print("[BE_ERR]", e)
-
-
-def apply_trailing_after_entry(sym: str, signal: str, res: dict, dry_run: bool) -> None:
+        log.warning("[BE_ERR] %s: %s", symbol, e)
+    store.put(st)
+
+
+def apply_trailing_after_entry(
+    sym: str,
+    side: str,
+    res: dict,
+    dry_run: bool,
+    cfg: Config | None = None,
+    snapshot: CycleSnapshot | None = None,
+) -> None:
     """
     Вешает трейлинг-стоп и переводит SL в безубыток сразу после успешного входа.
     Использует update_trailing_for_symbol и _maybe_breakeven().
+    snapshot — снимок цикла: ATR и цена из него; если монитор уже сверил позиции
+    (positions_synced), трейлинг на бирже заново не проверяется.
     """
+    cfg = cfg or get_config()
     if dry_run or not isinstance(res, dict) or res.get("status") in {"error", "retryable"}:
-        print("[TS_SKIP]", {"dry_run": dry_run, "status": res.get("status") if isinstance(res, dict) else "?"})
+        log_event(log, "TS_SKIP", dry_run=dry_run, status=res.get("status") if isinstance(res, dict) else "?")
         return
 
     try:
@@ -143,44 +174,59 @@ def apply_trailing_after_entry(sym: str, signal: str, res: dict, dry_run: bool)
             try:
                 entry_px = get_symbol_price(sym)
             except Exception:
-                ex_tmp = create_exchange()
+                ex_tmp = get_exchange()
                 tkr = ex_tmp.fetch_ticker(sym)
                 entry_px = float(tkr.get("last") or tkr.get("close") or 0.0)
 
-        ex_ts = create_exchange()
-
-        if os.getenv("USE_TRAILING_STOP", "1") in ("1", "true", "True"):
-            if not _has_trailing(ex_ts, sym):
-                print("[TS_CALL]", {"symbol": sym, "entry": entry_px, "side": signal})
-                ts_resp = update_trailing_for_symbol(ex_ts, sym, entry_px, signal)
-                print("[TS_OK]", ts_resp)
+        ex_ts = get_exchange()
+        # Новый вход — новое состояние позиции (флаги трейлинга/BE сбрасываются)
+        prev = get_state_store().get(sym, side)
+        get_state_store().open(sym, side, entry_px, float(res.get("qty") or 0.0))
+
+        if cfg.trailing.enabled:
+            if snapshot is not None and snapshot.positions_synced:
+                # трейлинг — на позицию: добор к позиции с трейлингом его сохраняет, у новой его нет
+                has_ts = prev is not None and prev.trailing_set
+                if has_ts:
+                    get_state_store().update(sym, side, trailing_set=True)
+            else:
+                has_ts = _has_trailing(ex_ts, sym, side)
+            if not has_ts:
+                log_event(log, "TS_CALL", symbol=sym, entry=entry_px, side=side)
+                t = cfg.trailing
+                atr = None
+                if snapshot is not None and t.activation_mode.lower() == "atr":
+                    atr = snapshot.atr_for(ex_ts, sym, t.atr_timeframe, t.atr_period)
+                with stage_timer("trailing_set"):
+                    ts_resp = update_trailing_for_symbol(ex_ts, sym, entry_px, side, cfg=cfg, atr=atr)
+                log_event(log, "TS_OK", symbol=sym, resp=ts_resp)
+                get_state_store().update(sym, side, trailing_set=True)
             else:
-                print("[TS_SKIP] already has trailing for", sym)
+                log_event(log, "TS_SKIP", symbol=sym, reason="already has trailing")
 
-            _maybe_breakeven(ex_ts, sym, entry_px, signal)
+            _maybe_breakeven(ex_ts, sym, entry_px, side, cfg=cfg, snapshot=snapshot)
         else:
-            print("[TS_SKIP] trailing disabled by USE_TRAILING_STOP")
+            log_event(log, "TS_SKIP", symbol=sym, reason="USE_TRAILING_STOP=0")
     except Exception as e:
-        print("[TS_ERR]", e)
+        log.error("[TS_ERR] %s: %s", sym, e)
 
 
 @contextmanager
 def single_instance_lock(name: str = "positions_guard.lock"):
     """
-    Предохраняет от одновременного запуска нескольких копий скрипта.
-    Создаёт файл-замок в /tmp, удаляет его по завершении.
+    Предохраняет от одновременного запуска нескольких копий скрипта (или шарда).
+    fcntl-замок на файл в LOCK_DIR: снимается ядром и при падении процесса.
     """
-    path = os.path.join(tempfile.gettempdir(), name)
-    if os.path.exists(path):
-        raise RuntimeError(f"Already running: {path}")
-    try:
-        open(path, "w").close()
+    with process_lock(name) as path:
+        log.debug("lock: %s", path)
         yield
-    finally:
-        try:
-            os.remove(path)
-        except Exception as e:
-            print(f"[WARN] lock cleanup failed: {e}")
+
+
+def _own_pairs(pairs) -> list:
+    """Пары этого процесса: все или доля шарда (консистентное хэширование)."""
+    if _SHARD is None:
+        return list(pairs)
+    return shard_pairs(list(pairs), *_SHARD)
 
 
 def ensure_models_exist(pairs, timeframe="15m", limit=2000, model_dir="models"):
@@ -196,31 +242,589 @@ def ensure_models_exist(pairs, timeframe="15m", limit=2000, model_dir="models"):
         if not os.path.exists(mpath):
             missing.append(p)
     if missing:
-        print(f"🧠 Нет моделей для: {missing} — обучаем...")
+        log.info("🧠 Нет моделей для: %s — обучаем...", missing)
         for p in missing:
             try:
                 train_model_for_pair(
                     p, timeframe=timeframe, limit=limit, model_dir=model_dir
                 )
             except Exception as e:
-                print(f"⚠️ {p}: {e}")
+                log.warning("⚠️ %s: %s", p, e)
 
 
-def main():
-    load_and_check_env()
+def run_cycle(
+    args, pairs, dry_run: bool, bar_close_ts: float | None = None, stagger_s: float = 0.0, cfg: Config | None = None
+) -> None:
+    """
+    Один проход по всем парам: ордера → позиция → прогноз → вход → трейлинг.
+    bar_close_ts — время закрытия бара, по которому считаем латентность до отправки ордера.
+    stagger_s — пауза между парами, чтобы не бить по REST пачкой сразу после закрытия бара.
+    cfg — снимок настроек на весь цикл (перечитка .env подменяет его только между циклами).
+    """
+    cfg = cfg or get_config()
+    cid = new_cycle_id()
+    t0 = time.perf_counter()
+    try:
+        # трасса cycle → pair → stage → rest в logs/traces + строка [BUDGET] против длины бара
+        with cycle_trace(cid, budget_s=timeframe_seconds(args.timeframe)), get_profiler().cycle():
+            try:
+                _run_cycle(args, pairs, dry_run, bar_close_ts, stagger_s, cfg)
+            finally:
+                bind_pair(None)
+    finally:
+        CYCLE_SECONDS.observe(time.perf_counter() - t0)
+        CYCLES.inc()
+        LAST_CYCLE_TS.set(time.time())
+
+
+def _run_cycle(args, pairs, dry_run: bool, bar_close_ts: float | None, stagger_s: float, cfg: Config) -> None:
+    min_balance = cfg.risk.min_balance_usdt
+    ex = get_exchange()
+    # SCAN_UNIVERSE=1: вся вселенная линейных USDT-перпов одним запросом → топ кандидатов + PAIRS
+    scanned = None
+    if cfg.scan.enabled and not args.pair:
+        try:
+            with stage_timer("scan"):
+                scanned = get_scanner(cfg).scan(ex, pinned=pairs)
+            pairs = _own_pairs(scanned.pairs)
+        except Exception as e:
+            log.error("[SCAN_ERR] %s — цикл по PAIRS", e)
+
+    # Снимок цикла: баланс + все тикеры одним запросом (или из скана), дальше входы берут данные отсюда
+    with stage_timer("ticker"):
+        snapshot = CycleSnapshot.capture(ex, pairs, tickers=scanned.tickers if scanned else None)
+    usdt = snapshot.balance_usdt
+    log_event(log, "BALANCE", usdt=round(usdt, 2))
+
+    # ACCOUNTS: данные и сигналы — один раз, монитор и входы — на каждом аккаунте параллельно
+    fan_out = bool(cfg.accounts)
+
+    # Монитор открытых позиций (BE/трейлинг) — каждый цикл, независимо от баланса и сигналов
+    if not fan_out:
+        _monitor(ex, snapshot, pairs, dry_run, cfg)
+        if usdt < min_balance:
+            log.warning("⛔ Баланс ниже минимума (%s USDT) — торговля пропущена.", min_balance)
+            return
+
+    # BATCH_ENTRY=1: сигналы цикла копим и отправляем одним create-batch после прохода по парам
+    batch_mode = cfg.entry.batch or fan_out
+    pending: list = []
+
+    for i, p in enumerate(pairs):
+        if _STOP.is_set():
+            log.info("[DAEMON] stop requested — прерываю цикл")
+            return
+        if stagger_s > 0 and i > 0:
+            if _STOP.wait(stagger_s):
+                return
+
+        sym = normalize_symbol(p)
+        bind_pair(sym)
+        get_profiler().tag(sym)
+        with trace_span(sym, cat="pair"):
+            _process_pair(args, ex, snapshot, sym, dry_run, bar_close_ts, pending, batch_mode, cfg, fan_out)
+    bind_pair(None)
+
+    if fan_out:
+        _fan_out(args, pairs, pending, snapshot, dry_run, bar_close_ts, cfg)
+        return
+    if pending:
+        with stage_timer("entry"):
+            if len(pending) == 1:
+                sym, side, signal_ts = pending[0]
+                results = [open_position(sym, side=side, snapshot=snapshot, signal_ts=signal_ts, cfg=cfg)]
+            else:
+                results = open_positions_batch(
+                    [(sym, side) for sym, side, _ in pending],
+                    snapshot=snapshot,
+                    signal_ts=min(ts for _, _, ts in pending),
+                    cfg=cfg,
+                )
+        for (sym, side, _), res in zip(pending, results):
+            bind_pair(sym)
+            with trace_span(sym, cat="pair", batch=True):
+                _after_entry(sym, side, res, dry_run, bar_close_ts, cfg, snapshot)
+
+
+def _process_pair(
+    args,
+    ex,
+    snapshot,
+    sym: str,
+    dry_run: bool,
+    bar_close_ts: float | None,
+    pending: list,
+    batch_mode: bool,
+    cfg: Config,
+    fan_out: bool = False,
+) -> None:
+    """
+    Одна пара цикла: ордера → позиция → прогноз → вход (в batch-режиме — в pending).
+    fan_out — сигнал только копится в pending: ордера, позиция и лимиты проверяются на каждом аккаунте.
+    """
+    with stage_timer("ticker"):
+        price = snapshot.price(ex, sym)
+
+    # 1-2) Открытые ордера и позиция по паре
+    if not fan_out and _pair_busy(args, sym):
+        return
 
+    # 3) Прогноз
+    pred = predict_trend(sym, timeframe=args.timeframe)
+    side = str(pred.get("signal", "hold")).lower()
+    conf = float(pred.get("confidence", 0.0))
+    signal_ts = time.time()
+
+    # Отладочный вывод индикаторов
+    if cfg.daemon.debug_indicators:
+        try:
+            snap = compute_snapshot(sym, timeframe=args.timeframe, limit=max(args.limit, 200))
+            log_event(log, "IND", logging.DEBUG, **snap)
+        except Exception as _e:
+            log.debug("[IND_ERR] %s", _e)
+
+    log_event(log, "PREDICT", price=price, signal=side, conf=round(conf, 4), proba=pred.get("proba", {}))
+
+    # 4) Условия входа
+    threshold = args.threshold if args.threshold is not None else cfg.entry.conf_threshold
+    if dry_run or side not in ("long", "short") or conf < threshold:
+        log.debug("⏸ Условия входа не выполнены (или DRY).")
+        return
+
+    if fan_out:
+        pending.append((sym, side, signal_ts))
+        return
+
+    # 5) Лимиты риска по агрегатам журнала (O(1), без чтения лога)
+    if _entry_blocked(sym, side, cfg, extra_open=len(pending)):
+        return
+
+    if batch_mode:
+        pending.append((sym, side, signal_ts))
+        return
+
+    with stage_timer("entry"):
+        res = open_position(sym, side=side, snapshot=snapshot, signal_ts=signal_ts, cfg=cfg)
+    _after_entry(sym, side, res, dry_run, bar_close_ts, cfg, snapshot)
+
+
+def _pair_busy(args, sym: str) -> bool:
+    """Открытые ордера (без --auto-cancel) или позиция при --no-pyramid — вход по паре пропускаем."""
+    # 1) Проверка: есть ли открытые ордера?
+    with stage_timer("orders"):
+        opened = get_open_orders(sym)
+    if opened:
+        log.info("⏳ Есть открытые ордера по %s: %d", sym, len(opened))
+        if args.auto_cancel:
+            n = cancel_open_orders(sym)
+            log.info("🧹 Отменил %s ордер(ов).", n)
+        else:
+            log.info("⏸ Пропускаю вход (запусти с --auto-cancel, чтобы чистить хвосты).")
+            return True
+
+    # 2) Проверка: есть ли уже позиция?
+    if args.no_pyramid and _has_position(sym):
+        log.info("🏕 Уже есть позиция по %s — пирамидинг выключен (--no-pyramid). Пропуск.", sym)
+        return True
+    return False
+
+
+def _entry_blocked(sym: str, side: str, cfg: Config, extra_open: int = 0) -> bool:
+    """Лимиты риска аккаунта и общий слот MAX_OPEN_TRADES шарда; True — вход пропускаем."""
+    blocked = _risk_block(cfg, extra_open=extra_open)
+    if blocked:
+        log.warning("⛔ %s — вход по %s пропущен.", blocked, sym)
+        return True
+    # В шардированном режиме MAX_OPEN_TRADES общий: слот занимается атомарно в общем хранилище
+    max_open = cfg.risk.max_open_trades
+    if _shared_slots_on(cfg) and not get_shared_slots().reserve(sym, side, max_open, _SHARD[0]):
+        log.warning("⛔ MAX_OPEN_TRADES=%s занят всеми шардами — вход по %s пропущен.", max_open, sym)
+        return True
+    return False
+
+
+def _shared_slots_on(cfg: Config) -> bool:
+    # слоты шардов считают позиции основного аккаунта; у доп. аккаунтов лимит свой, по их журналу
+    return _SHARD is not None and current_account() is None and cfg.risk.max_open_trades > 0
+
+
+def _monitor(ex, snapshot, pairs, dry_run: bool, cfg: Config) -> None:
+    """Монитор позиций аккаунта (BE/трейлинг); у шарда — только его позиции и публикация слотов."""
+    owns = (lambda s: shard_owns(s, *_SHARD)) if _SHARD is not None else None
+    synced = False
+    if not dry_run and cfg.monitor.enabled:
+        try:
+            with stage_timer("position_monitor"):
+                summary = monitor_positions(ex, snapshot=snapshot, cfg=cfg, owns=owns)
+                log_event(log, "MONITOR", **summary)
+                # лимиты риска: открытые — из сверенного состояния, PnL закрытий — из closed-pnl биржи
+                sync_positions(ex, get_state_store().all(), closed=summary["closed"])
+            synced = snapshot.positions_synced = True
+        except Exception as e:
+            log.error("[MONITOR_ERR] %s", e)
+    if owns is not None and _shared_slots_on(cfg):
+        _publish_slots(ex, owns, synced)
+
+
+def _publish_slots(ex, owns, synced: bool) -> None:
+    """
+    Позиции шарда → общий счётчик MAX_OPEN_TRADES (закрытые освобождают слоты) — каждый цикл,
+    даже без монитора (DRY_RUN, POSITION_MONITOR=0): тогда position_state не сверен, и позиции
+    берутся с биржи одним fetch_positions.
+    """
+    try:
+        if synced:
+            held = [(st.symbol, st.side) for st in get_state_store().all() if owns(st.symbol)]
+        else:
+            positions = (OpenPosition.from_ccxt(x) for x in ex.fetch_positions() or [])
+            held = [(p.symbol, p.side) for p in positions if p is not None and p.symbol and owns(p.symbol)]
+        get_shared_slots().publish(_SHARD[0], held)
+    except Exception as e:
+        log.error("[SLOTS_ERR] %s", e)
+
+
+def _fan_out(args, pairs, pending: list, snapshot, dry_run: bool, bar_close_ts: float | None, cfg: Config) -> None:
+    """
+    Исполнение сигналов цикла на всех аккаунтах (основной + ACCOUNTS) параллельно: у каждого
+    свой клиент (и rate limiter), баланс, лимиты риска, размер позиции и журнал сделок.
+    """
+    names = [None] + [a.name for a in cfg.accounts]
+    with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="account") as pool:
+        futs = [
+            (name, pool.submit(contextvars.copy_context().run, _run_account, name, args, pairs, pending,
+                               snapshot, dry_run, bar_close_ts, cfg))
+            for name in names
+        ]
+        for name, f in futs:
+            try:
+                f.result()
+            except Exception as e:
+                log.error("[ACCOUNT_ERR] %s: %s", account_label(name), e)
+
+
+def _run_account(
+    name, args, pairs, pending: list, snapshot, dry_run: bool, bar_close_ts: float | None, cfg: Config
+) -> None:
+    label = account_label(name)
+    with use_account(name), trace_span(label, cat="account"), get_profiler().thread(label):
+        acfg = cfg.for_account(name)
+        ex = get_exchange()
+        if name is None:
+            snap = snapshot
+        else:
+            with stage_timer("balance"):
+                snap = snapshot.for_account(ex)
+            log_event(log, "BALANCE", usdt=round(snap.balance_usdt, 2))
+        _monitor(ex, snap, pairs, dry_run, acfg)
+
+        if not pending:
+            return
+        if snap.balance_usdt < acfg.risk.min_balance_usdt:
+            log.warning("⛔ Баланс ниже минимума (%s USDT) — торговля пропущена.", acfg.risk.min_balance_usdt)
+            return
+        todo = []
+        for sym, side, signal_ts in pending:
+            bind_pair(sym)
+            if _pair_busy(args, sym) or _entry_blocked(sym, side, acfg, extra_open=len(todo)):
+                continue
+            todo.append((sym, side, signal_ts))
+        bind_pair(None)
+        if not todo:
+            return
+
+        with stage_timer("entry"):
+            if len(todo) == 1 or not acfg.entry.batch:
+                results = []
+                for sym, side, signal_ts in todo:
+                    bind_pair(sym)
+                    results.append(open_position(sym, side=side, snapshot=snap, signal_ts=signal_ts, cfg=acfg))
+            else:
+                results = open_positions_batch(
+                    [(sym, side) for sym, side, _ in todo],
+                    snapshot=snap,
+                    signal_ts=min(ts for _, _, ts in todo),
+                    cfg=acfg,
+                )
+        for (sym, side, _), res in zip(todo, results):
+            bind_pair(sym)
+            _after_entry(sym, side, res, dry_run, bar_close_ts, acfg, snap)
+        bind_pair(None)
+
+
+def _has_position(sym: str) -> bool:
+    with stage_timer("positions"):
+        return has_open_position(sym)
+
+
+def _risk_block(cfg: Config | None = None, extra_open: int = 0) -> str | None:
+    """
+    Причина запрета новых входов или None: DAILY_LOSS_LIMIT (USDT реализованного убытка
+    за текущие сутки UTC, по closed-pnl биржи) и MAX_OPEN_TRADES (позиции из position_state).
+    0 — лимит выключен.
+    У шарда MAX_OPEN_TRADES проверяется не здесь, а резервом в общем хранилище (core.sharding).
+    """
+    risk = (cfg or get_config()).risk
+    loss_limit = risk.daily_loss_limit
+    max_open = risk.max_open_trades
+    if loss_limit <= 0 and max_open <= 0:
+        return None
+    try:
+        a = get_analytics()
+    except Exception as e:
+        log.error("[ANALYTICS_ERR] %s", e)
+        return None
+    pnl = a.daily_pnl()
+    if loss_limit > 0 and pnl <= -loss_limit:
+        return f"дневной убыток {pnl:.2f} USDT достиг DAILY_LOSS_LIMIT={loss_limit:g}"
+    n_open = a.open_trades() + extra_open
+    if max_open > 0 and _SHARD is None and n_open >= max_open:
+        return f"открытых сделок {n_open} >= MAX_OPEN_TRADES={max_open}"
+    return None
+
+
+def _after_entry(
+    sym: str,
+    side: str,
+    res: dict,
+    dry_run: bool,
+    bar_close_ts: float | None,
+    cfg: Config | None = None,
+    snapshot: CycleSnapshot | None = None,
+) -> None:
+    """Печать результата, латентность от закрытия бара, трейлинг + BE."""
+    log_event(log, "ENTRY_RESULT", symbol=sym, side=side, result=res)
+    if _shared_slots_on(cfg or get_config()):
+        _settle_slot(sym, side, res)
+    if bar_close_ts is not None and isinstance(res, dict) and res.get("submitted_at"):
+        lat_ms = (float(res["submitted_at"]) - bar_close_ts) * 1000.0
+        log_event(log, "LATENCY", symbol=sym, bar_close_to_submit_ms=round(lat_ms))
+    apply_trailing_after_entry(sym, side, res, dry_run, cfg, snapshot)
+    # Больше ничего не делаем: apply_trailing_after_entry() ставит трейл и переводит в BE
+
+
+def _settle_slot(sym: str, side: str, res: dict) -> None:
+    """Резерв слота после входа: успешный — позиция открыта, иначе слот освобождается."""
+    try:
+        if isinstance(res, dict) and res.get("status") not in {"error", "retryable", "dry"}:
+            get_shared_slots().confirm(sym, side)
+        else:
+            get_shared_slots().release(sym, side)
+    except Exception as e:
+        log.error("[SLOTS_ERR] %s: %s", sym, e)
+
+
+def _install_stop_handlers() -> None:
+    """SIGTERM/SIGINT → мягкая остановка: текущая пара дорабатывает, новый цикл не начинается."""
+    def _handler(signum, _frame):
+        log.info("[DAEMON] signal %s — завершаюсь после текущей пары", signum)
+        _STOP.set()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            signal.signal(sig, _handler)
+        except (ValueError, OSError):
+            # не главный поток / платформа без сигнала
+            pass
+    # SIGHUP → перечитать .env перед следующим циклом (без сигнала — по mtime файла)
+    if hasattr(signal, "SIGHUP"):
+        try:
+            signal.signal(signal.SIGHUP, lambda *_: _RELOAD.set())
+        except (ValueError, OSError):
+            pass
+    # SIGUSR1 → профиль следующих циклов (kill -USR1 <pid>)
+    try:
+        install_profile_signal()
+    except (ValueError, OSError):
+        pass
+
+
+def run_daemon(args, pairs, dry_run: bool) -> None:
+    """
+    Долгоживущий режим: клиент биржи, кэш свечей и модели остаются в памяти.
+    Просыпаемся сразу после закрытия бара TIMEFRAME (+BAR_CLOSE_DELAY_S),
+    либо каждые CHECK_INTERVAL секунд при ALIGN_TO_BAR=0.
+    Изменения .env (или SIGHUP) применяются без рестарта: перед циклом берётся новый снимок
+    настроек; если он не прошёл валидацию — работаем на старом.
+    """
+    _install_stop_handlers()
+    cfg = get_config()
+    d = cfg.daemon
+
+    # /metrics для Prometheus (METRICS_PORT=0 — выключено)
+    metrics_port = d.metrics_port
+    if metrics_port > 0:
+        if _SHARD is not None:
+            metrics_port += _SHARD[0]  # у каждого воркера свой порт: METRICS_PORT + номер шарда
+        try:
+            start_metrics_server(metrics_port, d.metrics_host)
+        except OSError as e:
+            log.warning("[METRICS] не запущен: %s", e)
+
+    # Прогрев: рынки и HTTP-сессия создаются один раз; смещение часов — по расписанию (CLOCK_SYNC_INTERVAL_S)
+    get_exchange()
+    get_clock().start()
+    # Приватный поток ордеров на каждый аккаунт: fill-события вместо опроса fetch_order
+    # (ORDER_STREAM=off — только опрос)
+    trackers = []
+    if not dry_run:
+        for name in [None] + [a.name for a in cfg.accounts]:
+            with use_account(name):
+                try:
+                    trackers.append(start_order_tracker())
+                except Exception as e:
+                    log.warning("[ORDER_STREAM] не запущен, работаем опросом: %s", e)
+    log_event(log, "DAEMON_START", tf=args.timeframe, align=d.align_to_bar, delay_s=d.bar_close_delay_s,
+              stagger_s=d.pair_stagger_s, shard=f"{_SHARD[0]}/{_SHARD[1]}" if _SHARD else None, pairs=len(pairs),
+              accounts=[account_label(None)] + [a.name for a in cfg.accounts])
+
+    next_wake = next_bar_close(args.timeframe) + d.bar_close_delay_s if d.align_to_bar else time.time()
+    while not _STOP.is_set():
+        if not sleep_until(next_wake, _STOP, on_tick=lambda: _heartbeat("HB daemon idle")):
+            break
+
+        if d.config_reload or _RELOAD.is_set():
+            new = reload_config(force=_RELOAD.is_set())
+            _RELOAD.clear()
+            if new is not None:
+                cfg, d = new, new.daemon
+                if not args.pair and new.pairs:
+                    pairs = _own_pairs(new.pairs)
+
+        bar_close_ts = last_bar_close(args.timeframe) if d.align_to_bar else None
+        t0 = time.time()
+        try:
+            run_cycle(args, pairs, dry_run, bar_close_ts=bar_close_ts, stagger_s=d.pair_stagger_s, cfg=cfg)
+        except Exception as e:
+            # Один упавший цикл не должен валить процесс
+            log.exception("[DAEMON_ERR] %s", e)
+        log_event(log, "CYCLE_DONE", seconds=round(time.time() - t0, 3))
+
+        if d.align_to_bar:
+            next_wake = next_bar_close(args.timeframe) + d.bar_close_delay_s
+        else:
+            next_wake = t0 + d.check_interval_s
+
+    for tracker in trackers:
+        tracker.stop()
+    log.info("[DAEMON] stopped")
+
+
+def _worker_argv(argv: list) -> list:
+    """Аргументы координатора без --workers (воркеру добавляется свой --shard)."""
+    out, skip = [], False
+    for a in argv:
+        if skip:
+            skip = False
+        elif a == "--workers":
+            skip = True
+        elif not a.startswith("--workers="):
+            out.append(a)
+    return out
+
+
+def _shard_cassette(path: str, i: int) -> str:
+    """logs/c.jsonl.gz → logs/c.shard0.jsonl.gz"""
+    root, ext = os.path.splitext(path)
+    if ext == ".gz":
+        root, inner = os.path.splitext(root)
+        ext = inner + ext
+    return f"{root}.shard{i}{ext}"
+
+
+def run_workers(n: int, argv: list, daemon: bool) -> None:
+    """
+    Координатор: n процессов-воркеров «positions_guard.py ... --shard i/n», каждый под своим
+    fcntl-замком и со своей долей PAIRS. Общие лимиты — в SHARED_STATE_DB (core.sharding).
+    Упавший воркер перезапускается с backoff (1, 2, 4 … 60 с); SIGTERM/SIGINT — всем воркерам.
+    """
+    _install_stop_handlers()
+    base = [sys.executable, os.path.abspath(__file__)] + _worker_argv(argv)
+    log_file = os.getenv("LOG_FILE", "logs/guard.log")
+    procs: dict = {}
+    fails = [0] * n
+    next_start = [0.0] * n
+
+    def _spawn(i: int) -> subprocess.Popen:
+        # окружение до load_dotenv: ключи .env воркер читает из файла сам, иначе они стали бы
+        # «окружением процесса» и перекрывали бы файл при перечитке (CONFIG_RELOAD)
+        env = base_env()
+        for key in ("EXCHANGE_TRANSPORT", "CASSETTE"):  # --record/--replay координатора
+            if key in os.environ:
+                env[key] = os.environ[key]
+        if log_file:
+            root, ext = os.path.splitext(log_file)
+            env["LOG_FILE"] = f"{root}.shard{i}{ext}"  # RotatingFileHandler не делится между процессами
+        if env.get("EXCHANGE_TRANSPORT", "live") != "live" and env.get("CASSETTE"):
+            env["CASSETTE"] = _shard_cassette(env["CASSETTE"], i)  # у воркера своя кассета
+        p = subprocess.Popen(base + ["--shard", f"{i}/{n}"], env=env)
+        log_event(log, "WORKER_START", shard=f"{i}/{n}", worker_pid=p.pid)
+        return p
+
+    for i in range(n):
+        procs[i] = _spawn(i)
+    while not _STOP.is_set() and procs:
+        for i, p in list(procs.items()):
+            rc = p.poll()
+            if rc is None:
+                continue
+            if rc == 0 or not daemon:
+                log_event(log, "WORKER_EXIT", shard=f"{i}/{n}", rc=rc)
+                del procs[i]
+                continue
+            if next_start[i] == 0.0:
+                fails[i] += 1
+                next_start[i] = time.time() + min(60.0, 2.0 ** (fails[i] - 1))
+                log_event(log, "WORKER_EXIT", logging.WARNING, shard=f"{i}/{n}", rc=rc,
+                          restart_in_s=round(next_start[i] - time.time()))
+            elif time.time() >= next_start[i]:
+                next_start[i] = 0.0
+                procs[i] = _spawn(i)
+        _STOP.wait(1.0)
+
+    for p in procs.values():
+        if p.poll() is None:
+            p.terminate()
+    for i, p in procs.items():
+        try:
+            p.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            log.warning("[WORKERS] shard %s/%s не завершился за 30с — kill", i, n)
+            p.kill()
+    log.info("[WORKERS] stopped")
+
+
+def build_parser(cfg: Config) -> argparse.ArgumentParser:
+    """Аргументы guard'а; значения по умолчанию — из снимка настроек."""
     parser = argparse.ArgumentParser()
     parser.add_argument("--once", action="store_true", help="Один проход и выход")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Постоянный режим: цикл сразу после закрытия каждого бара TIMEFRAME",
+    )
     parser.add_argument("--pair", type=str)
     parser.add_argument(
-        "--threshold", type=float, default=float(os.getenv("CONF_THRESHOLD", "0.65"))
+        "--threshold", type=float, default=None, help="По умолчанию CONF_THRESHOLD (перечитывается из .env)"
     )
     parser.add_argument("--no-lock", action="store_true", help="Запуск без single-instance lock")
-    parser.add_argument("--timeframe", type=str, default=os.getenv("TIMEFRAME", "5m"))
     parser.add_argument(
-        "--limit", type=int, default=int(os.getenv("TRAIN_LIMIT", "3000"))
+        "--workers",
+        type=int,
+        default=cfg.daemon.workers,
+        help="Координатор: N процессов-воркеров, PAIRS делятся между ними консистентным хэшированием",
     )
+    parser.add_argument(
+        "--shard", type=parse_shard, default=None, metavar="I/N", help="Воркер: только пары шарда I из N"
+    )
+    parser.add_argument("--timeframe", type=str, default=cfg.entry.timeframe)
+    parser.add_argument("--limit", type=int, default=cfg.daemon.train_limit)
     parser.add_argument("--live", action="store_true", help="Разрешить реальные сделки")
+    parser.add_argument("--dry-run", action="store_true", help="Без сделок (режим по умолчанию; несовместим с --live)")
+    transport = parser.add_mutually_exclusive_group()
+    transport.add_argument("--record", metavar="CASSETTE", help="Записать все запросы к бирже в кассету (*.jsonl[.gz])")
+    transport.add_argument(
+        "--replay", metavar="CASSETTE", help="Без сети: ответы биржи из кассеты (REPLAY_LATENCY_SCALE)"
+    )
     parser.add_argument(
         "--autotrain",
         action="store_true",
@@ -234,35 +838,77 @@ def main():
     parser.add_argument(
         "--no-pyramid", action="store_true", help="Не входить, если уже есть позиция"
     )
-    args = parser.parse_args()
-
-    pairs = (
-        [args.pair]
-        if args.pair
-        else [s.strip() for s in os.getenv("PAIRS", "").split(",") if s.strip()]
+    parser.add_argument(
+        "--profile",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Профилировать N циклов: cProfile/tracemalloc/wall-clock в logs/ (также PROFILE_CYCLES, SIGUSR1)",
     )
+    return parser
+
+
+def main():
+    global _SHARD
+    try:
+        cfg = load_and_check_env()
+    except ConfigError as e:
+        # невалидный .env — падаем на старте, а не посреди выставления ордера
+        setup_logging()
+        log.error("[CONFIG] %s", "; ".join(e.errors))
+        raise SystemExit(2)
+    # Логи: JSON через QueueHandler → QueueListener (stdout + logs/guard.log с ротацией);
+    # торговый поток только кладёт запись в очередь, I/O — в фоновом потоке.
+    # После загрузки .env — LOG_LEVEL/LOG_FORMAT/LOG_FILE/LOG_DEBUG_SAMPLE берутся и из файла
+    setup_logging()
+    log_event(log, "BOOT", cwd=os.getcwd(), pid=os.getpid())
+
+    parser = build_parser(cfg)
+    args = parser.parse_args()
+    if args.dry_run and args.live:
+        parser.error("--dry-run и --live несовместимы")
+    if args.record or args.replay:
+        # через окружение: его наследуют воркеры и читает core.cassette при создании клиента
+        os.environ["EXCHANGE_TRANSPORT"] = "record" if args.record else "replay"
+        os.environ["CASSETTE"] = args.record or args.replay
+    if args.profile > 0:
+        get_profiler().arm(args.profile)
+
+    pairs = [args.pair] if args.pair else list(cfg.pairs)
     if not pairs:
         raise ValueError("PAIRS пуст — заполни в .env")
 
-    min_balance = float(os.getenv("MIN_BALANCE_USDT", "5"))
     dry_run = not args.live
+    daemon = args.daemon and not args.once
 
-    print("──────── Kolopovstrategy guard ────────")
-    print("⏱ ", datetime.now(timezone.utc).isoformat())
-    print(f"Mode: {'LIVE' if not dry_run else 'DRY'} | Threshold={args.threshold}")
-    print("📈 Pairs:", ", ".join(pairs))
+    if args.workers > 1 and args.shard is None and not args.pair:
+        with single_instance_lock("positions_guard.coordinator.lock"):
+            run_workers(args.workers, sys.argv[1:], daemon)
+        return
+    if args.shard is not None:
+        _SHARD = args.shard
+        pairs = _own_pairs(pairs)
+        if not pairs:
+            log.warning("[SHARD] %s/%s: ни одной пары из PAIRS — только монитор позиций шарда", *_SHARD)
+
+    log_event(
+        log,
+        "GUARD_START",
+        utc=datetime.now(timezone.utc).isoformat(),
+        mode="LIVE" if not dry_run else "DRY",
+        threshold=args.threshold if args.threshold is not None else cfg.entry.conf_threshold,
+        run="DAEMON" if daemon else "ONCE",
+        pairs=pairs,
+        shard=f"{_SHARD[0]}/{_SHARD[1]}" if _SHARD else None,
+    )
 
     if args.autotrain:
         ensure_models_exist(pairs, timeframe=args.timeframe, limit=args.limit)
 
-    lock_ctx = nullcontext() if args.no_lock else single_instance_lock()
+    lock_name = f"positions_guard.shard-{_SHARD[0]}-of-{_SHARD[1]}.lock" if _SHARD else "positions_guard.lock"
+    lock_ctx = nullcontext() if args.no_lock else single_instance_lock(lock_name)
     with lock_ctx:
-        print("DEBUG PROXY_URL:", os.getenv("PROXY_URL"))
-        usdt = get_balance("USDT")
-        print(f"💰 Баланс USDT: {usdt:.2f}")
-        if usdt < min_balance:
-            print(f"⛔ Баланс ниже минимума ({min_balance} USDT) — торговля пропущена.")
-            return
+        log.debug("PROXY_URL: %s", os.getenv("PROXY_URL"))
 
         # DRY_RUN переменная – двойной предохранитель
         if dry_run:
@@ -270,48 +916,11 @@ def main():
         else:
             os.environ.pop("DRY_RUN", None)
 
-        for p in pairs:
-            sym = normalize_symbol(p)
-            price = get_symbol_price(sym)
-
-            # 1) Проверка: есть ли открытые ордера?
-            opened = get_open_orders(sym)
-            if opened:
-                print(f"⏳ Есть открытые ордера по {sym}: {len(opened)}")
-                if args.auto_cancel:
-                    n = cancel_open_orders(sym)
-                    print(f"🧹 Отменил {n} ордер(ов).")
-                else:
-                    print("⏸ Пропускаю вход (запусти с --auto-cancel, чтобы чистить хвосты).")
-                    continue
-
-            # 2) Проверка: есть ли уже позиция?
-            if args.no_pyramid and has_open_position(sym):
-                print(f"🏕 Уже есть позиция по {sym} — пирамидинг выключен (--no-pyramid). Пропуск.")
-                continue
-
-            # 3) Прогноз
-            pred = predict_trend(sym, timeframe=args.timeframe)
-            signal = str(pred.get("signal", "hold")).lower()
-            conf = float(pred.get("confidence", 0.0))
-
-            # Отладочный вывод индикаторов
-            if os.getenv("DEBUG_INDICATORS", "0") == "1":
-                try:
-                    snap = compute_snapshot(sym, timeframe=args.timeframe, limit=max(args.limit, 200))
-                    print("[IND]", sym, snap)
-                except Exception as _e:
-                    print("[IND_ERR]", _e)
-
-            print(f"🔮 {sym} @ {price:.4f} → signal={signal} conf={conf:.2f} proba={pred.get('proba', {})}")
-
-            # 4) Условия входа
-            if dry_run or signal not in ("long", "short") or conf < args.threshold:
-                print("⏸ Условия входа не выполнены (или DRY).")
-                continue
+        if daemon:
+            run_daemon(args, pairs, dry_run)
+        else:
+            run_cycle(args, pairs, dry_run, bar_close_ts=last_bar_close(args.timeframe), cfg=cfg)
 
-            res = open_position(sym, side=signal)
-            print("🧾 Результат:", res)
-            apply_trailing_after_entry(sym, signal, res, dry_run)
 
-            # Больше ничего не делаем: apply_trailing_after_entry() ставит трейл и переводит в BE
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 # tools/agent_guard.py
+import os
 import shutil
 import subprocess
 import sys
@@ -91,11 +92,18 @@ def dry_run_positions_guard() -> None:
         print("positions_guard.py not found — skip dry-run.")
         return
 
+    # Без сети: ответы биржи из записанной кассеты (python positions_guard.py --once --record PATH)
+    cassette = Path(os.getenv("GUARD_CASSETTE", str(ROOT / "fixtures" / "cassettes" / "guard_cycle.jsonl.gz")))
+    if not cassette.exists():
+        print(f"{cassette.as_posix()} not found — skip dry-run.")
+        return
+    offline = ["--once", "--dry-run", "--no-lock", "--replay", str(cassette)]
+
     # Пытаемся запустить с одной парой (DRY)
-    rc = run([sys.executable, str(pg), "--pair", "BTC/USDT:USDT", "--dry-run"])
+    rc = run([sys.executable, str(pg), "--pair", "BTC/USDT:USDT"] + offline)
     if rc != 0:
-        # fallback — без аргументов
-        run([sys.executable, str(pg), "--dry-run"])
+        # fallback — пары из .env
+        run([sys.executable, str(pg)] + offline)
 
 
 def main() -> None:
@@ -0,0 +1,105 @@
+"""
+Бенчмарк логирования: сколько времени торговый поток тратит на одну строку лога.
+
+    python tools/bench_logging.py --n 5000 --sink-latency-ms 0.2
+
+print      — старый путь: print в stdout + дописывание в файл (как _heartbeat в boot.log)
+queue      — core.logging_setup: QueueHandler в вызывающем потоке, JSON и I/O в QueueListener
+debug      — то же для DEBUG-строк с прореживанием (LOG_DEBUG_SAMPLE)
+
+stdout подменяется «медленным» потоком (sink-latency-ms на каждую запись) — так ведёт себя
+stdout, когда читатель (docker/Railway) не успевает. Печатаются p50/p99 на вызов и время
+дописывания очереди после последнего вызова.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.logging_setup import log_event, new_cycle_id, setup_logging, shutdown_logging  # noqa: E402
+
+
+class SlowSink:
+    def __init__(self, latency_s: float) -> None:
+        self.latency_s = latency_s
+        self.lines = 0
+
+    def write(self, s: str) -> int:
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        self.lines += s.count("\n")
+        return len(s)
+
+    def flush(self) -> None:
+        pass
+
+
+def _pct(xs, q):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))] * 1e6
+
+
+def bench_print(n: int, sink: SlowSink, path: str):
+    lat = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        print("[TS_CALL]", {"symbol": "BTC/USDT:USDT", "entry": 65000.0 + i, "side": "long"}, file=sink, flush=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] TS_CALL {i}\n")
+        lat.append(time.perf_counter() - t0)
+    return lat, 0.0
+
+
+def bench_queue(n: int, level: int):
+    log = logging.getLogger("bench")
+    new_cycle_id()
+    lat = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        log_event(log, "TS_CALL", level, symbol="BTC/USDT:USDT", entry=65000.0 + i, side="long")
+        lat.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    shutdown_logging()
+    return lat, time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--n", type=int, default=5000)
+    ap.add_argument("--sink-latency-ms", type=float, default=0.2)
+    ap.add_argument("--mode", choices=["print", "queue", "debug", "all"], default="all")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-log-")
+    results = {}
+    modes = ["print", "queue", "debug"] if args.mode == "all" else [args.mode]
+    for mode in modes:
+        sink = SlowSink(args.sink_latency_ms / 1000.0)
+        path = os.path.join(tmp, f"{mode}.log")
+        if mode == "print":
+            lat, drain = bench_print(args.n, sink, path)
+        else:
+            setup_logging(level="DEBUG", fmt="json", log_file=path, stream=sink)
+            lat, drain = bench_queue(args.n, logging.DEBUG if mode == "debug" else logging.INFO)
+        results[mode] = {
+            "calls": args.n,
+            "caller_p50_us": round(_pct(lat, 0.5), 1),
+            "caller_p99_us": round(_pct(lat, 0.99), 1),
+            "caller_total_ms": round(sum(lat) * 1000.0, 1),
+            "drain_ms": round(drain * 1000.0, 1),
+            "lines_out": sink.lines,
+        }
+        print(mode, json.dumps(results[mode]))
+
+    if "print" in results and "queue" in results:
+        speedup = results["print"]["caller_total_ms"] / max(results["queue"]["caller_total_ms"], 1e-9)
+        print(f"caller-side speedup queue vs print: x{speedup:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Локальный симулятор Bybit v5 для нагрузочных прогонов (core.exchange_sim).
+
+    python tools/bybit_sim.py --port 8765 --symbols BTCUSDT,ETHUSDT,SOLUSDT --latency-ms 30 --jitter-ms 20
+    python tools/bybit_sim.py --candles logs/cassettes/cycle.jsonl.gz --speed 60 --p10006 0.02 --p429 0.01
+    python tools/bybit_sim.py --candles data/candles/ --speed 0      # время только через POST /sim/advance
+
+Затем guard против симулятора:
+
+    BYBIT_API_URL=http://127.0.0.1:8765 BYBIT_API_KEY=sim1 BYBIT_SECRET_KEY=x \\
+        ORDER_STREAM=off MAKER_BOOK_STREAM=off python positions_guard.py --once --live
+
+--candles — папка <SYMBOL>.csv (ts_ms,open,high,low,close,volume) или кассета --record:
+её ответы /v5/market/kline становятся рынком. Символы без свечей — синтетика (seed).
+Аккаунт — по API-ключу (у каждого ключа свой баланс --balance USDT). WebSocket не эмулируется.
+GET /sim/state — позиции и equity аккаунтов, POST /sim/advance {"bars": N} — перемотка.
+"""
+import argparse
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.exchange_sim import BybitSim, Faults, SimServer, build_series  # noqa: E402
+from core.logging_setup import setup_logging  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=int(os.getenv("SIM_PORT", "8765")))
+    ap.add_argument("--symbols", default=os.getenv("PAIRS", "BTCUSDT,ETHUSDT"), help="символы с синтетическими свечами")
+    ap.add_argument("--candles", help="папка *.csv или кассета *.jsonl[.gz]")
+    ap.add_argument("--interval", default="60", help="интервал синтетики (v5: 1,5,15,60,240,D)")
+    ap.add_argument("--bars", type=int, default=5000, help="длина синтетики, баров")
+    ap.add_argument("--warmup", type=int, default=1000, help="баров истории до старта")
+    ap.add_argument("--speed", type=float, default=1.0, help="секунд рынка в секунду; 0 — только /sim/advance")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--balance", type=float, default=10_000.0, help="стартовый USDT на аккаунт")
+    ap.add_argument("--spread-bps", type=float, default=2.0)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0, help="экспоненциальный хвост задержки (среднее)")
+    ap.add_argument("--p10006", type=float, default=0.0, help="доля приватных запросов с retCode 10006")
+    ap.add_argument("--p429", type=float, default=0.0, help="доля запросов с HTTP 429")
+    ap.add_argument("--no-rate-limits", action="store_true", help="не ограничивать запросы лимитами Bybit на UID")
+    ap.add_argument("--no-recv-window", action="store_true", help="не проверять X-BAPI-TIMESTAMP (10002)")
+    args = ap.parse_args()
+
+    setup_logging()
+    series = build_series(args.symbols.split(","), args.candles, args.interval, args.bars, args.seed)
+    if not series:
+        ap.error("нет ни свечей, ни символов")
+    sim = BybitSim(
+        series,
+        balance=args.balance,
+        speed=args.speed,
+        warmup=args.warmup,
+        spread_bps=args.spread_bps,
+        check_recv_window=not args.no_recv_window,
+    )
+    faults = Faults(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        p_10006=args.p10006,
+        p_429=args.p429,
+        seed=args.seed,
+        rate_limits=not args.no_rate_limits,
+    )
+    server = SimServer(sim, faults, host=args.host, port=args.port).start()
+    print(f"BYBIT_API_URL={server.url}  ({len(series)} symbols)", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Офлайн-проверка maker-входа (core.maker_entry) на LocalBookSim: без сети и ключей.
+
+Сценарии — с потоком ордеров (LocalOrderStream → OrderTracker) и без него (опрос fetch_order):
+исполнение у лучшей цены, перестановка за ценой и исполнение (без amend после fill),
+фолбэк IOC по таймауту и фолбэк market, когда цена ушла за LIMIT_SLIPPAGE_BPS.
+
+    python tools/check_maker_entry.py
+"""
+import logging
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from core.maker_entry import LocalBookSim, maker_entry  # noqa: E402
+from core.order_prep import OrderPlan  # noqa: E402
+from core.order_tracker import LocalOrderStream, OrderTracker  # noqa: E402
+from core.rate_limiter import TokenBucket  # noqa: E402
+
+SYM = "BTC/USDT:USDT"
+
+# (bid, ask) по шагам; план — buy по цене сигнала 100.1, граница 50 bps (100.6)
+SCENARIOS = {
+    # лимит на bid 100.0, ask опускается к нему — maker-исполнение без перестановок
+    "fill": ([(100.0, 100.1), (100.0, 100.1), (99.95, 100.0)], "ioc", 2.0),
+    # bid растёт — лимит переставляется следом, затем исполняется; amend после fill не шлём
+    "amend": ([(100.0, 100.1), (100.05, 100.15), (100.1, 100.2), (99.9, 100.0), (100.2, 100.3), (100.3, 100.4)],
+              "ioc", 2.0),
+    # лимит не исполнился до таймаута — остаток IOC по границе (ask внутри неё)
+    "ioc_fallback": ([(100.0, 100.1), (100.4, 100.5)], "ioc", 0.5),
+    # цена ушла за границу — остаток рынком
+    "market_fallback": ([(100.0, 100.1), (100.7, 100.8)], "market", 2.0),
+}
+
+
+class _Sim(LocalBookSim):
+    """LocalBookSim, считающий amend уже исполненного/снятого ордера."""
+
+    late_amends = 0
+
+    def edit_order(self, id, symbol, type, side, amount=None, price=None, params=None):
+        if self.orders[id]["status"] != "open":
+            self.late_amends += 1
+        return super().edit_order(id, symbol, type, side, amount, price, params)
+
+
+class _Warnings(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__(logging.WARNING)
+        self.messages = []
+
+    def emit(self, record) -> None:
+        self.messages.append(record.getMessage())
+
+
+def run(name: str, streaming: bool) -> dict:
+    updates, fallback, timeout_s = SCENARIOS[name]
+    tracker = None
+    sim = _Sim(SYM, updates)
+    if streaming:
+        stream = LocalOrderStream()
+        tracker = OrderTracker(stream).start()
+        sim.on_order_update = tracker.on_message  # синхронно, как уже доставленный кадр WS
+    plan = OrderPlan(SYM, "buy", 1.0, 1.0, 100.1, 110.0, 90.0, 5, 1.0, 1000.0)
+    warns = _Warnings()
+    logging.getLogger("core.maker_entry").addHandler(warns)
+    try:
+        res = maker_entry(sim, plan, sim, tracker=tracker, slippage_bps=50.0, timeout_s=timeout_s,
+                          amend_bucket=TokenBucket(rate=100.0, burst=100), fallback=fallback)
+    finally:
+        logging.getLogger("core.maker_entry").removeHandler(warns)
+        if tracker is not None:
+            tracker.stop()
+    return {"res": res, "calls": sim.calls, "late_amends": sim.late_amends, "warnings": warns.messages}
+
+
+def check() -> int:
+    bad = 0
+    expected = {
+        "fill": lambda r: r["status"] == "closed" and not r["maker_fallback"] and r["reprices"] == 0,
+        "amend": lambda r: r["status"] == "closed" and not r["maker_fallback"] and r["reprices"] >= 1,
+        "ioc_fallback": lambda r: r["status"] == "closed" and r["maker_fallback"] and r["average"] == 100.5,
+        "market_fallback": lambda r: r["status"] == "closed" and r["maker_fallback"] and r["average"] == 100.8,
+    }
+    for streaming in (True, False):
+        for name, ok_fn in expected.items():
+            out = run(name, streaming)
+            r = out["res"]
+            # с потоком статус fill известен сразу; без него — не больше одной попытки до опроса
+            late_ok = out["late_amends"] <= (0 if streaming else 1)
+            ok = ok_fn(r) and r["filled"] == 1.0 and late_ok and not out["warnings"]
+            bad += not ok
+            mode = "stream" if streaming else "poll"
+            print(f"{'OK  ' if ok else 'FAIL'} {name:<16} {mode:<6} status={r['status']} avg={r['average']} "
+                  f"reprices={r['reprices']} fallback={r['maker_fallback']} late_amends={out['late_amends']} "
+                  f"calls={','.join(out['calls'])}"
+                  + (f" warnings={out['warnings']}" if out["warnings"] else ""))
+    print(f"failures={bad}")
+    return bad
+
+
+def main():
+    sys.exit(1 if check() else 0)
+
+
+if __name__ == "__main__":
+    main()
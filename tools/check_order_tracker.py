@@ -0,0 +1,132 @@
+"""
+Офлайн-проверка core.order_tracker: без сети и ключей, на LocalOrderStream и заглушке биржи.
+
+Сценарии: исполнение из потока событий (без fetch_order), фолбэк на опрос, несколько ордеров
+сразу и сбои опроса (сеть, ошибка биржи, BybitAPIError, открытый предохранитель, баг заглушки):
+ожидание уже принятого ордера не должно бросать — только status="unknown". Предохранитель
+проверяется и через настоящий call_with_retry: CircuitOpenError должен быть ошибкой ccxt.
+
+    python tools/check_order_tracker.py
+"""
+import sys
+import time
+from pathlib import Path
+
+import ccxt
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from core.order_tracker import LocalOrderStream, OrderTracker  # noqa: E402
+from core.resilience import CircuitOpenError, call_with_retry, get_breaker, reset_breakers  # noqa: E402
+from utils.error_handler import BybitAPIError  # noqa: E402
+
+SYM = "BTC/USDT:USDT"
+
+
+class StubExchange:
+    """fetch_order по сценарию: список ответов (dict) или исключений, последний повторяется."""
+
+    def __init__(self, *script) -> None:
+        self.script = list(script)
+        self.calls = 0
+
+    def fetch_order(self, oid, sym):
+        self.calls += 1
+        step = self.script[min(self.calls, len(self.script)) - 1]
+        if isinstance(step, BaseException):
+            raise step
+        return {"id": oid, "symbol": sym, **step}
+
+
+class BreakerExchange(StubExchange):
+    """fetch_order через call_with_retry, как в core.bybit_exchange: эндпоинт за предохранителем."""
+
+    endpoint = "v5/order/realtime"
+
+    def fetch_order(self, oid, sym):
+        return call_with_retry(self.endpoint, lambda: super(BreakerExchange, self).fetch_order(oid, sym),
+                               retries=0)
+
+
+def _frame(oid: str, status: str) -> dict:
+    return {"topic": "order", "data": [
+        {"orderId": oid, "symbol": "BTCUSDT", "orderStatus": status, "avgPrice": "100", "cumExecQty": "1"},
+    ]}
+
+
+def _tracker(transport=None) -> OrderTracker:
+    return OrderTracker(transport, poll_min_s=0.01, poll_max_s=0.05, stream_grace_s=0.05)
+
+
+def check() -> int:
+    bad = 0
+
+    def expect(name: str, ok: bool, got) -> None:
+        nonlocal bad
+        bad += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {name}: {got}")
+
+    # поток: финальный статус из кадра Bybit v5, опрос не нужен
+    stream = LocalOrderStream()
+    tr = _tracker(stream).start()
+    ex = StubExchange({"status": "open"})
+    stream.push(_frame("s1", "Filled"))
+    time.sleep(0.05)
+    o = tr.wait(ex, SYM, "s1", timeout_s=1.0)
+    expect("stream fill", o.get("status") == "closed" and ex.calls == 0, (o.get("status"), ex.calls))
+    tr.stop()
+
+    # без потока: опрос с бэкоффом до финального статуса
+    ex = StubExchange({"status": "open"}, {"status": "open"}, {"status": "closed", "filled": 1.0})
+    o = _tracker().wait(ex, SYM, "p1", timeout_s=2.0)
+    expect("poll fill", o.get("status") == "closed", (o.get("status"), ex.calls))
+
+    # несколько ордеров: каждый со своим итогом
+    ex = StubExchange({"status": "closed"})
+    out = _tracker().wait_many(ex, [(SYM, "m1"), (SYM, "m2")], timeout_s=1.0)
+    expect("wait_many", {o.get("status") for o in out.values()} == {"closed"} and len(out) == 2, out.keys())
+
+    # сбои опроса: ожидание не бросает, ордер — unknown (id и symbol сохраняются)
+    failures = {
+        "network": ccxt.RequestTimeout("timeout"),
+        "exchange": ccxt.ExchangeError('bybit {"retCode":10001,"retMsg":"params error"}'),
+        "bybit_api": BybitAPIError("boom", ret_code=10016),
+        "circuit_open": CircuitOpenError("circuit open for v5/order/realtime", endpoint="v5/order/realtime"),
+        "stub_bug": RuntimeError("unexpected"),
+    }
+    for name, exc in failures.items():
+        ex = StubExchange(exc)
+        try:
+            o = _tracker().wait(ex, SYM, f"f-{name}", timeout_s=0.2)
+        except Exception as e:  # именно это и проверяем
+            expect(f"poll failure {name}", False, f"ESCAPED: {type(e).__name__}")
+            continue
+        ok = o.get("status") == "unknown" and o.get("id") == f"f-{name}" and o.get("symbol") == SYM
+        expect(f"poll failure {name}", ok, o)
+
+    # настоящий предохранитель: открыт после серии сбоев, запрос не уходит, ожидание не бросает
+    expect("circuit_open is ccxt.NetworkError", issubclass(CircuitOpenError, ccxt.NetworkError),
+           CircuitOpenError.__mro__[1:4])
+    reset_breakers()
+    breaker = get_breaker(BreakerExchange.endpoint)
+    for _ in range(breaker.failures):
+        breaker.record_failure()
+    ex = BreakerExchange({"status": "closed"})
+    try:
+        o = _tracker().wait(ex, SYM, "b1", timeout_s=0.2)
+        expect("breaker open", o.get("status") == "unknown" and ex.calls == 0, (o.get("status"), ex.calls))
+    except Exception as e:
+        expect("breaker open", False, f"ESCAPED: {type(e).__name__}")
+    reset_breakers()
+
+    print(f"failures={bad}")
+    return bad
+
+
+def main():
+    sys.exit(1 if check() else 0)
+
+
+if __name__ == "__main__":
+    main()
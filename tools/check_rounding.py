@@ -0,0 +1,125 @@
+"""
+Property-проверка core.rounding против ccxt для всех linear USDT-рынков Bybit.
+
+Для каждого рынка генерируем случайные цены/количества (включая значения на границах шага
+и «половинки» тика) и сравниваем скалярный (Decimal) и векторный (NumPy) путь
+с ccxt price_to_precision / amount_to_precision.
+
+    python tools/check_rounding.py --samples 200 --seed 1
+    python tools/check_rounding.py --offline     # синтетические рынки, без сети и ключей (CI)
+
+--offline — ccxt.bybit без подключения с набором синтетических рынков: смешанные тики и шаги
+лота (десятичные, «пятёрки», крупнее единицы, очень мелкие), те же проверки.
+"""
+import argparse
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from core.rounding import RoundingTable, is_linear_usdt  # noqa: E402
+
+# (тик цены, шаг лота) синтетических рынков: рядом стоят «неудобные» для float сочетания
+_SYNTHETIC = [
+    ("0.1", "0.001"), ("0.5", "0.01"), ("0.01", "1"), ("0.05", "10"), ("0.0001", "0.1"),
+    ("0.0005", "100"), ("0.00001", "0.5"), ("0.025", "5"), ("5", "0.0001"), ("0.0000001", "1000"),
+    ("0.25", "0.00001"), ("0.001", "0.005"), ("10", "0.002"), ("0.002", "25"),
+]
+
+
+def synthetic_exchange():
+    """ccxt.bybit без сети с синтетическими linear USDT-рынками _SYNTHETIC."""
+    import ccxt
+
+    ex = ccxt.bybit({"options": {"defaultType": "swap"}})
+    markets = []
+    for i, (tick, step) in enumerate(_SYNTHETIC):
+        base = f"SYN{i:02d}"
+        markets.append({
+            "id": f"{base}USDT", "symbol": f"{base}/USDT:USDT", "base": base, "quote": "USDT", "settle": "USDT",
+            "baseId": base, "quoteId": "USDT", "settleId": "USDT", "type": "swap", "spot": False, "margin": False,
+            "swap": True, "future": False, "option": False, "contract": True, "linear": True, "inverse": False,
+            "active": True, "contractSize": 1.0,
+            "precision": {"price": float(tick), "amount": float(step)},
+            "limits": {"amount": {"min": float(step), "max": None}, "price": {"min": float(tick), "max": None},
+                       "cost": {"min": 5.0, "max": None}, "leverage": {"min": 1, "max": 50}},
+            "info": {},
+        })
+    ex.set_markets(markets)
+    return ex
+
+
+def _samples(rng: random.Random, unit: float, ref: float, n: int):
+    """Случайные значения вокруг ref + точные кратные шага и их «половинки»."""
+    out = []
+    for _ in range(n):
+        k = rng.randint(1, 10**6)
+        out.append(k * unit)
+        out.append((k + 0.5) * unit)
+        out.append(ref * rng.uniform(0.01, 100.0))
+        out.append(rng.uniform(unit, unit * 1000))
+    return out
+
+
+def check(ex, samples: int, seed: int) -> int:
+    rng = random.Random(seed)
+    table = RoundingTable.from_markets(ex.markets)
+    bad = 0
+    checked = 0
+    for sym, m in ex.markets.items():
+        if not is_linear_usdt(m) or sym not in table:
+            continue
+        rules = table.get(sym)
+        tick = float(rules.tick)
+        step = float(rules.step)
+        ref_px = tick * 10**4
+
+        prices = _samples(rng, tick, ref_px, samples)
+        qtys = _samples(rng, step, step * 100, samples)
+        vec_px = table.round_prices([sym] * len(prices), prices)
+        vec_qty = table.floor_qtys([sym] * len(qtys), qtys)
+
+        for x, v in zip(prices, vec_px):
+            try:
+                want = float(ex.price_to_precision(sym, x))
+            except Exception:
+                continue
+            got = rules.round_price(x)
+            if got != want or not np.isclose(v, want, rtol=0, atol=0):
+                bad += 1
+                print(f"[PRICE] {sym} x={x!r} ccxt={want!r} decimal={got!r} vector={v!r}")
+        for x, v in zip(qtys, vec_qty):
+            try:
+                want = float(ex.amount_to_precision(sym, x))
+            except Exception:
+                continue
+            got = rules.floor_qty(x)
+            if got != want or v != want:
+                bad += 1
+                print(f"[QTY] {sym} x={x!r} ccxt={want!r} decimal={got!r} vector={v!r}")
+        checked += 1
+    print(f"markets={checked} mismatches={bad}")
+    return bad
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--samples", type=int, default=100)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--offline", action="store_true", help="синтетические рынки вместо рынков Bybit")
+    args = p.parse_args()
+    if args.offline:
+        ex = synthetic_exchange()
+    else:
+        from core.bybit_exchange import create_exchange
+
+        ex = create_exchange()
+    sys.exit(1 if check(ex, args.samples, args.seed) else 0)
+
+
+if __name__ == "__main__":
+    main()
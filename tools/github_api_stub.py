@@ -0,0 +1,108 @@
+"""
+Локальная замена GitHub Contents API для проверки core.github_uploader без сети и токена.
+
+    python tools/github_api_stub.py --port 8765
+    GITHUB_API_URL=http://127.0.0.1:8765 GITHUB_TOKEN=x GITHUB_REPO=me/logs python -c \
+        "from core.github_uploader import upload_trades_to_github; upload_trades_to_github()"
+
+Поддерживает GET/PUT /repos/<owner>/<repo>/contents/<path> с проверкой sha как у GitHub
+(422 — sha не передан для существующего файла, 409 — sha устарел) и GET /_stats
+со счётчиками запросов и объёмом принятых данных.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+_PATH_RE = re.compile(r"^/repos/([^/]+/[^/]+)/contents/(.+)$")
+
+
+def _blob_sha(data: bytes) -> str:
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class ContentsStore:
+    def __init__(self) -> None:
+        self.files = {}
+        self.stats = {"GET": 0, "PUT": 0, "bytes_in": 0}
+        self.lock = threading.Lock()
+
+
+def make_handler(store: ContentsStore):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):  # тихо
+            pass
+
+        def _send(self, code: int, obj) -> None:
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/_stats":
+                with store.lock:
+                    return self._send(200, dict(store.stats, files=sorted(k[1] for k in store.files)))
+            m = _PATH_RE.match(path)
+            if not m:
+                return self._send(404, {"message": "Not Found"})
+            with store.lock:
+                store.stats["GET"] += 1
+                data = store.files.get((m.group(1), m.group(2)))
+            if data is None:
+                return self._send(404, {"message": "Not Found"})
+            return self._send(200, {"path": m.group(2), "sha": _blob_sha(data), "size": len(data)})
+
+        def do_PUT(self):
+            m = _PATH_RE.match(urlparse(self.path).path)
+            if not m:
+                return self._send(404, {"message": "Not Found"})
+            if not self.headers.get("Authorization"):
+                return self._send(401, {"message": "Requires authentication"})
+            raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            req = json.loads(raw or b"{}")
+            key = (m.group(1), m.group(2))
+            data = base64.b64decode(req.get("content") or "")
+            with store.lock:
+                store.stats["PUT"] += 1
+                store.stats["bytes_in"] += len(raw)
+                cur = store.files.get(key)
+                if cur is not None:
+                    if not req.get("sha"):
+                        return self._send(422, {"message": '"sha" wasn\'t supplied.'})
+                    if req["sha"] != _blob_sha(cur):
+                        return self._send(409, {"message": f"{key[1]} does not match {req['sha']}"})
+                store.files[key] = data
+            sha = _blob_sha(data)
+            return self._send(201 if cur is None else 200, {"content": {"path": key[1], "sha": sha}})
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 0):
+    """Запускает сервер в фоне; возвращает (server, store). port=0 — свободный порт."""
+    store = ContentsStore()
+    srv = ThreadingHTTPServer((host, port), make_handler(store))
+    threading.Thread(target=srv.serve_forever, name="github-stub", daemon=True).start()
+    return srv, store
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    args = ap.parse_args()
+    srv = ThreadingHTTPServer((args.host, args.port), make_handler(ContentsStore()))
+    print(f"GitHub Contents API stub on http://{args.host}:{args.port}")
+    srv.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
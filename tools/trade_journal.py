@@ -0,0 +1,60 @@
+"""
+Журнал сделок: импорт logs/trades.csv (оба формата) и выборки.
+
+    python tools/trade_journal.py import logs/trades.csv
+    python tools/trade_journal.py query --symbol BTC/USDT --event order_placed --since 2025-08-01
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.trade_journal import TradeJournal  # noqa: E402
+
+
+def _ts(v):
+    if v is None:
+        return None
+    try:
+        return float(v)
+    except ValueError:
+        dt = datetime.fromisoformat(v)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", default=None, help="путь к SQLite (по умолчанию TRADE_JOURNAL_DB или logs/journal.db)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    imp = sub.add_parser("import", help="импорт CSV")
+    imp.add_argument("csv", nargs="+")
+
+    q = sub.add_parser("query", help="выборка событий (JSON lines)")
+    q.add_argument("--since", help="epoch или ISO-дата (UTC)")
+    q.add_argument("--until", help="epoch или ISO-дата (UTC)")
+    q.add_argument("--symbol")
+    q.add_argument("--event", action="append")
+    q.add_argument("--limit", type=int)
+    q.add_argument("--count", action="store_true", help="только количество")
+
+    args = ap.parse_args()
+    j = TradeJournal(args.db)
+    if args.cmd == "import":
+        for path in args.csv:
+            print(path, j.import_csv(path))
+        return
+    if args.count:
+        print(j.count(_ts(args.since), _ts(args.until), symbol=args.symbol, event=args.event))
+        return
+    for row in j.query(_ts(args.since), _ts(args.until), symbol=args.symbol, event=args.event, limit=args.limit):
+        print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()